@@ -0,0 +1,188 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+
+import numpy as np
+
+from reader import Camera, UltrasonicSensor
+from threaded_reader import SensorReaderThread
+
+
+class Measurement:
+    """
+    One timestamped acquisition, a frame paired with the filtered
+    distance closest to it in time plus the configs fetched alongside.
+    """
+
+    def __init__(
+        self,
+        timestamp: float,
+        frame: Any,
+        frame_ts: float,
+        distance: float,
+        distance_ts: Optional[float],
+        configs: dict,
+        latencies: dict[str, float],
+    ) -> None:
+        self.timestamp = timestamp
+        self.frame = frame
+        self.frame_ts = frame_ts
+        self.distance = distance
+        # NOTE: None when the distance did not come from a timestamped sample
+        self.distance_ts = distance_ts
+        self.configs = configs
+        self.latencies = latencies
+
+    def skew_ms(self) -> Optional[float]:
+        """
+        Returns how far apart the frame and the distance sample were taken.
+        """
+        if self.distance_ts is None:
+            return None
+        return abs(self.frame_ts - self.distance_ts) * 1000
+
+
+class AcquisitionCoordinator:
+    """
+    Runs the distance sampling, the frame grab and the config lookup at the
+    same time so a detection only waits for the slowest of them.
+    """
+
+    # NOTE: samples further than this from the frame are not paired with it
+    max_skew: float = 0.5
+
+    def __init__(
+        self,
+        camera: Camera,
+        sensor: UltrasonicSensor,
+        config_handler: Any = None,
+    ) -> None:
+        self.camera = camera
+        self.sensor = sensor
+        self.config_handler = config_handler
+        self.executor = ThreadPoolExecutor(
+            max_workers=3, thread_name_prefix="acquisition"
+        )
+
+    def __timed(self, name: str, latencies: dict[str, float], task, *args):
+        start = time.monotonic()
+        result = task(*args)
+        latencies[name] = (time.monotonic() - start) * 1000
+        return result
+
+    def __grab_frame(self) -> Any:
+        self.camera.read()
+        return self.camera.get_reading()
+
+    def __sample_distance(self) -> float:
+        self.sensor.read()
+        return float(self.sensor.get_reading())  # pyright: ignore
+
+    def __fetch_configs(self, config_names: list) -> dict:
+        # INFO: every config request is in flight at once
+        return self.config_handler.get_configs(config_names)
+
+    def __pair(self, frame_ts: float, fallback: float) -> tuple[float, Optional[float]]:
+        """
+        Returns the (distance, timestamp) of the filtered distance closest to the frame,
+        falls back to the current filtered distance when none is close enough.
+        """
+        stream = SensorReaderThread.shared(
+            self.sensor.port, self.sensor.baud_rate
+        )  # pyright: ignore
+        closest = stream.filtered_at(frame_ts, self.max_skew)
+        if closest is None:
+            return fallback, None
+        return float(closest[1]), closest[0]
+
+    def __grab_frames(self, count: int) -> list:
+        frames = self.camera.capture_frames(count)
+        if frames:
+            return frames
+        # NOTE: the stream was already waited on, fall back to a single fswebcam shot
+        self.camera.read(stream=False)
+        return [(self.camera.captured_at, self.camera.get_reading())]
+
+    def acquire_batch(
+        self, count: int, config_names: Optional[list] = None
+    ) -> list[Measurement]:
+        """
+        Acquires `count` consecutive frames, each paired with its own distance,
+        while the distance and the configs are acquired concurrently.
+        """
+        latencies: dict[str, float] = {}
+        start = time.monotonic()
+        frames_future = self.executor.submit(
+            self.__timed, "frames", latencies, self.__grab_frames, count
+        )
+        distance_future = self.executor.submit(
+            self.__timed, "distance", latencies, self.__sample_distance
+        )
+        configs_future = None
+        if config_names:
+            configs_future = self.executor.submit(
+                self.__timed, "config", latencies, self.__fetch_configs, config_names
+            )
+
+        frames = frames_future.result()
+        filtered_distance = distance_future.result()
+        configs = configs_future.result() if configs_future else {}
+        latencies["total"] = (time.monotonic() - start) * 1000
+
+        measurements = []
+        for frame_ts, frame in frames:
+            distance, distance_ts = self.__pair(frame_ts, filtered_distance)
+            measurements.append(
+                Measurement(
+                    time.time(),
+                    frame,
+                    frame_ts,
+                    distance,
+                    distance_ts,
+                    configs,
+                    latencies,
+                )
+            )
+        print(
+            f":: [ACQUISITION] {len(measurements)} frames "
+            + " ".join(f"{name}: {ms:.1f} ms" for name, ms in latencies.items())
+        )
+        return measurements
+
+    def acquire(self, config_names: Optional[list] = None) -> Measurement:
+        """
+        Acquires one frame, its distance and the requested configs concurrently.
+        """
+        latencies: dict[str, float] = {}
+        start = time.monotonic()
+        frame_future = self.executor.submit(
+            self.__timed, "frame", latencies, self.__grab_frame
+        )
+        distance_future = self.executor.submit(
+            self.__timed, "distance", latencies, self.__sample_distance
+        )
+        configs_future = None
+        if config_names:
+            configs_future = self.executor.submit(
+                self.__timed, "config", latencies, self.__fetch_configs, config_names
+            )
+
+        frame = frame_future.result()
+        if isinstance(frame, np.ndarray):
+            # NOTE: a stream frame is a view into the grabber's ring, it would be
+            # overwritten while the caller is still detecting on it
+            frame = frame.copy()
+        filtered_distance = distance_future.result()
+        configs = configs_future.result() if configs_future else {}
+        latencies["total"] = (time.monotonic() - start) * 1000
+
+        frame_ts = self.camera.captured_at
+        distance, distance_ts = self.__pair(frame_ts, filtered_distance)
+        measurement = Measurement(
+            time.time(), frame, frame_ts, distance, distance_ts, configs, latencies
+        )
+        print(
+            ":: [ACQUISITION] "
+            + " ".join(f"{name}: {ms:.1f} ms" for name, ms in latencies.items())
+        )
+        return measurement
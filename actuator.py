@@ -0,0 +1,153 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+from controller import GPIO_MAPPING, PORT_STATE, Controller
+
+# INFO: a schedule is a list of (state, seconds to hold it) steps
+Schedule = list[tuple[PORT_STATE, float]]
+
+
+class GateActuator:
+    """
+    Fast path for driving the gate pins.
+    The pin writers are resolved once at startup, so a write is a single
+    call into the GPIO module without enum lookups or logging. Timed
+    schedules (pulses, blinks) run on a worker thread so the caller never
+    sleeps, and the delay from each command to its first edge is recorded.
+    """
+
+    def __init__(
+        self,
+        controller: Controller,
+        pins: tuple[GPIO_MAPPING, ...] = (GPIO_MAPPING.GATE_TRIGGER,),
+        latency_history: int = 256,
+    ) -> None:
+        self.controller = controller
+        # INFO: pin -> function taking the raw state value
+        self.writers: dict[GPIO_MAPPING, Callable[[int], None]] = {
+            pin: controller.pin_writer(pin) for pin in pins
+        }
+        # NOTE: the last written state, so toggling never needs a read
+        self.states: dict[GPIO_MAPPING, Optional[PORT_STATE]] = {
+            pin: None for pin in pins
+        }
+        # NOTE: writes from the caller and the worker go through this lock so
+        # a pin's state always matches the last write to it
+        self.lock = threading.Lock()
+        # INFO: seconds from a schedule being submitted to its first edge
+        self.latencies: deque[float] = deque(maxlen=latency_history)
+        self.queue: queue.Queue = queue.Queue()
+        self.stop_event = threading.Event()
+        self.worker = threading.Thread(
+            target=self.__run, name="GateActuator", daemon=True
+        )
+        self.worker.start()
+
+    @staticmethod
+    def pulse_schedule(open_ms: float) -> Schedule:
+        """
+        Opens the gate for `open_ms` milliseconds, then closes it.
+        """
+        return [(PORT_STATE.HIGH, open_ms / 1000), (PORT_STATE.LOW, 0)]
+
+    @staticmethod
+    def blink_schedule(count: int, period: float) -> Schedule:
+        """
+        Alternates HIGH and LOW `count` times, holding each for `period` seconds, and ends LOW.
+        """
+        steps = [
+            (PORT_STATE.HIGH if x % 2 == 0 else PORT_STATE.LOW, period)
+            for x in range(count)
+        ]
+        steps.append((PORT_STATE.LOW, 0))
+        return steps
+
+    def write(self, pin: GPIO_MAPPING, state: PORT_STATE) -> None:
+        """
+        Sets the pin right away on the caller's thread.
+        """
+        with self.lock:
+            self.writers[pin](state.value)
+            self.states[pin] = state
+
+    def state(self, pin: GPIO_MAPPING) -> Optional[PORT_STATE]:
+        return self.states[pin]
+
+    def schedule(self, pin: GPIO_MAPPING, steps: Schedule) -> Future:
+        """
+        Runs the steps on the worker thread, the future resolves once the last step is written.
+        """
+        if pin not in self.writers:
+            raise ValueError(f"{pin} was not prepared for the actuator")
+        future: Future = Future()
+        self.queue.put((time.perf_counter(), pin, steps, future))
+        return future
+
+    def pulse(self, pin: GPIO_MAPPING, open_ms: float) -> Future:
+        return self.schedule(pin, self.pulse_schedule(open_ms))
+
+    def __execute(self, submitted: float, pin: GPIO_MAPPING, steps: Schedule) -> None:
+        write = self.writers[pin]
+        completed = False
+        # NOTE: deadlines are absolute so the hold times do not drift with the writes
+        deadline = time.perf_counter()
+        try:
+            for index, (state, hold) in enumerate(steps):
+                with self.lock:
+                    write(state.value)
+                    self.states[pin] = state
+                if index == 0:
+                    self.latencies.append(time.perf_counter() - submitted)
+                deadline += hold
+                remaining = deadline - time.perf_counter()
+                if remaining > 0 and self.stop_event.wait(remaining):
+                    return
+            completed = True
+        finally:
+            if not completed and steps:
+                # NOTE: a schedule cut short by a shutdown still ends in its final
+                # state, so stopping during a pulse never leaves the gate open
+                final = steps[-1][0]
+                with self.lock:
+                    write(final.value)
+                    self.states[pin] = final
+
+    def __run(self) -> None:
+        while not self.stop_event.is_set():
+            try:
+                submitted, pin, steps, future = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self.__execute(submitted, pin, steps)
+                future.set_result(self.states[pin])
+            except Exception as e:
+                print(f":: [ACTUATOR] schedule on {pin} failed: {e}")
+                future.set_exception(e)
+        # NOTE: whatever was still queued will never run
+        while True:
+            try:
+                *_, future = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            future.cancel()
+
+    def latency_ms(self) -> tuple[float, float, float]:
+        """
+        Returns the (p50, p99, max) command-to-edge latency in milliseconds.
+        """
+        if not self.latencies:
+            return 0.0, 0.0, 0.0
+        import numpy as np
+
+        latencies = np.array(self.latencies) * 1000
+        p50, p99 = np.percentile(latencies, [50, 99])
+        return float(p50), float(p99), float(latencies.max())
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.worker.join()
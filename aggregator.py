@@ -0,0 +1,186 @@
+import json
+import math
+import threading
+import time
+from typing import Any, Callable, Optional
+
+
+class P2Quantile:
+    """
+    Streaming estimate of one quantile with the P² algorithm,
+    five markers are kept no matter how many values were added.
+    """
+
+    def __init__(self, p: float) -> None:
+        self.p = p
+        self.heights: list[float] = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, value: float) -> None:
+        heights = self.heights
+        if len(heights) < 5:
+            heights.append(value)
+            heights.sort()
+            return
+
+        if value < heights[0]:
+            heights[0] = value
+            k = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            k = 3
+        else:
+            k = 0
+            while value >= heights[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            self.positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # INFO: move the middle markers towards their desired positions
+        for i in range(1, 4):
+            d = self.desired[i] - self.positions[i]
+            if (d >= 1 and self.positions[i + 1] - self.positions[i] > 1) or (
+                d <= -1 and self.positions[i - 1] - self.positions[i] < -1
+            ):
+                step = 1 if d > 0 else -1
+                height = self.__parabolic(i, step)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = self.__linear(i, step)
+                heights[i] = height
+                self.positions[i] += step
+
+    def __parabolic(self, i: int, step: int) -> float:
+        n, q = self.positions, self.heights
+        return q[i] + step / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + step) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - step) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def __linear(self, i: int, step: int) -> float:
+        n, q = self.positions, self.heights
+        return q[i] + step * (q[i + step] - q[i]) / (n[i + step] - n[i])
+
+    def value(self) -> Optional[float]:
+        if not self.heights:
+            return None
+        if len(self.heights) < 5:
+            # NOTE: too few values for the markers, use the exact quantile
+            index = min(int(self.p * len(self.heights)), len(self.heights) - 1)
+            return self.heights[index]
+        return self.heights[2]
+
+
+class SizeAggregator:
+    """
+    Running statistics of the sized fish in constant memory: counts,
+    a histogram of size buckets, Welford's mean and variance and P²
+    quantile estimates.
+    """
+
+    def __init__(
+        self, bucket_size: float = 5.0, quantiles: tuple[float, ...] = (0.5, 0.9)
+    ) -> None:
+        self.bucket_size = bucket_size
+        self.quantile_ps = quantiles
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.started = time.time()
+        self.count = 0
+        self.big = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        # INFO: bucket index -> count, bounded by the range of fish sizes
+        self.histogram: dict[int, int] = {}
+        self.quantiles = [P2Quantile(p) for p in self.quantile_ps]
+
+    def add(self, est_size: float, is_big: bool) -> None:
+        with self.lock:
+            self.count += 1
+            self.big += int(is_big)
+            delta = est_size - self.mean
+            self.mean += delta / self.count
+            self.m2 += delta * (est_size - self.mean)
+            self.min = min(self.min, est_size)
+            self.max = max(self.max, est_size)
+            bucket = int(est_size // self.bucket_size)
+            self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+            for quantile in self.quantiles:
+                quantile.add(est_size)
+
+    def variance(self) -> float:
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def summary(self, reset: bool = False) -> dict[str, Any]:
+        """
+        Returns the statistics since the last reset, optionally starting a new window.
+        """
+        with self.lock:
+            summary = {
+                "start": self.started,
+                "end": time.time(),
+                "count": self.count,
+                "big": self.big,
+                "mean": self.mean if self.count else None,
+                "variance": self.variance(),
+                "min": self.min if self.count else None,
+                "max": self.max if self.count else None,
+                "histogram": {
+                    str(bucket * self.bucket_size): count
+                    for bucket, count in sorted(self.histogram.items())
+                },
+                "quantiles": {
+                    str(quantile.p): quantile.value() for quantile in self.quantiles
+                },
+            }
+            if reset:
+                self.reset()
+        return summary
+
+
+class SummaryPublisher(threading.Thread):
+    """
+    Publishes the aggregator's summary once per interval and starts a new window,
+    so the broker gets one message per interval no matter how many fish passed.
+    """
+
+    TOPIC = "FISHERYNET|SUMMARY"
+
+    def __init__(
+        self,
+        aggregator: SizeAggregator,
+        publish: Callable[[str, str], Any],
+        interval: float = 60.0,
+    ) -> None:
+        super().__init__(name="SummaryPublisher", daemon=True)
+        self.aggregator = aggregator
+        self.publish = publish
+        self.interval = interval
+        self.stop_event = threading.Event()
+
+    def __publish(self) -> None:
+        summary = self.aggregator.summary(reset=True)
+        # NOTE: nothing to say about an empty window
+        if not summary["count"]:
+            return
+        try:
+            self.publish(self.TOPIC, json.dumps(summary, separators=(",", ":")))
+        except Exception as e:
+            print(f":: [SUMMARY] failed to publish the summary: {e}")
+
+    def run(self) -> None:
+        while not self.stop_event.wait(self.interval):
+            self.__publish()
+        # NOTE: send the last partial window on shutdown
+        self.__publish()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.join()
@@ -0,0 +1,424 @@
+import argparse
+import glob
+import os
+import queue
+import resource
+import threading
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import codec
+from actuator import GateActuator
+from controller import GPIO_MAPPING, Controller
+from detector import MEASUREMENT_ENGINE, Detector
+from gpio_backend import SimulatedBackend
+from multi_chute import CONTEXT, SharedFrameSlots, detect_worker
+
+# INFO: the resolutions our cameras are run at
+RESOLUTIONS = ["640x480", "1280x720", "1920x1080"]
+# INFO: standard deviation of the gaussian noise added to the synthetic images
+NOISE_LEVELS = [0.0, 8.0, 24.0]
+# INFO: reports per message compared by the codec benchmark
+BATCH_SIZES = [1, 8, 32]
+
+
+def load_sample_images(directory: str = "imgs") -> list[tuple[str, np.ndarray]]:
+    """
+    Loads every png/jpg in the directory as a decoded BGR frame.
+    """
+    images = []
+    for path in sorted(glob.glob(os.path.join(directory, "*"))):
+        if not path.lower().endswith((".png", ".jpg", ".jpeg")):
+            continue
+        frame = cv2.imread(path, cv2.IMREAD_COLOR)
+        if frame is None:
+            print(f":: [BENCHMARK] failed to read {path}")
+            continue
+        images.append((os.path.basename(path), frame))
+    return images
+
+
+def synthetic_fish(
+    resolution: str, noise: float, seed: int = 0
+) -> tuple[np.ndarray, float]:
+    """
+    Draws a dark fish (body ellipse plus tail) on a light, uneven background.
+
+    Returns:
+        tuple: The BGR frame and the drawn fish area in pixels.
+    """
+    width, height = [int(x) for x in resolution.split("x")]
+    rng = np.random.default_rng(seed)
+    # INFO: a horizontal lighting gradient like the one in the chute
+    gradient = np.linspace(170, 230, width, dtype=np.float32)
+    frame = np.repeat(np.tile(gradient, (height, 1))[:, :, None], 3, axis=2)
+
+    mask = np.zeros((height, width), np.uint8)
+    center = (width // 2, height // 2)
+    axes = (width // 5, height // 7)
+    cv2.ellipse(mask, center, axes, 0, 0, 360, 255, -1)
+    tail_x = center[0] + axes[0]
+    tail = np.array(
+        [
+            [tail_x - axes[0] // 8, center[1]],
+            [tail_x + axes[0] // 3, center[1] - axes[1]],
+            [tail_x + axes[0] // 3, center[1] + axes[1]],
+        ],
+        np.int32,
+    )
+    cv2.fillPoly(mask, [tail], 255)
+    frame[mask > 0] = (60, 70, 65)
+
+    if noise:
+        frame += rng.normal(0, noise, frame.shape).astype(np.float32)
+    frame = np.clip(frame, 0, 255).astype(np.uint8)
+    return frame, float(cv2.countNonZero(mask))
+
+
+def build_cases(
+    resolutions: list[str], noise_levels: list[float], sample_dir: str
+) -> list[tuple[str, np.ndarray, float]]:
+    """
+    Returns (name, frame, true area) for every synthetic image and sample image,
+    the true area of a sample image is unknown and reported as 0.
+    """
+    cases = []
+    for resolution in resolutions:
+        for noise in noise_levels:
+            frame, area = synthetic_fish(resolution, noise)
+            cases.append((f"synthetic {resolution} noise {noise:g}", frame, area))
+    for name, frame in load_sample_images(sample_dir):
+        cases.append((name, frame, 0.0))
+    return cases
+
+
+def time_engine(detector: Detector, frame: np.ndarray, runs: int) -> np.ndarray:
+    """
+    Returns the wall time of each `largest_object` call in seconds.
+    """
+    # NOTE: warm up so the buffers are allocated before timing
+    detector.largest_object(frame)
+    timings = np.empty(runs)
+    for run in range(runs):
+        start = time.perf_counter()
+        detector.largest_object(frame)
+        timings[run] = time.perf_counter() - start
+    return timings
+
+
+def time_detect_size(detector: Detector, image, runs: int) -> tuple[np.ndarray, int]:
+    """
+    Returns the wall time of each `detect_size` call in seconds
+    and the peak memory traced by one extra, untimed call.
+    """
+    detector.detect_size(image, 1.0)
+    timings = np.empty(runs)
+    for run in range(runs):
+        start = time.perf_counter()
+        detector.detect_size(image, 1.0)
+        timings[run] = time.perf_counter() - start
+    # NOTE: traced separately, the allocation hooks would slow the timed calls down
+    tracemalloc.start()
+    detector.detect_size(image, 1.0)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return timings, peak
+
+
+def compare_engines(
+    images: list[tuple[str, np.ndarray]], runs: int = 20, min_area: float = 1000
+) -> None:
+    """
+    Times every measurement engine on each image and prints the largest object
+    each of them found, so a faster engine can be checked for agreement.
+    """
+    detectors = {
+        engine: Detector(engine=engine, min_area=min_area)
+        for engine in MEASUREMENT_ENGINE
+    }
+    for name, frame in images:
+        print(f":: [BENCHMARK] {name} {frame.shape[1]}x{frame.shape[0]}")
+        for engine, detector in detectors.items():
+            area, box = detector.largest_object(frame)
+            timings = time_engine(detector, frame, runs) * 1000
+            print(
+                f"::   {engine.value:<10} mean: {timings.mean():7.2f} ms min: {timings.min():7.2f} ms area: {area:.0f} box: {box}"
+            )
+
+
+def run_suite(
+    cases: list[tuple[str, np.ndarray, float]], runs: int, min_area: float
+) -> None:
+    """
+    Runs `detect_size` for every engine on every case, plus the encoded
+    bytes path, and prints latency percentiles, throughput and peak memory.
+    """
+    variants = {
+        engine.value: Detector(engine=engine, min_area=min_area)
+        for engine in MEASUREMENT_ENGINE
+    }
+    for name, frame, true_area in cases:
+        print(f":: [BENCHMARK] {name} {frame.shape[1]}x{frame.shape[0]}")
+        encoded = bytearray(cv2.imencode(".png", frame)[1].tobytes())
+        paths = [(label, detector, frame) for label, detector in variants.items()]
+        # NOTE: the legacy path decodes the PNG on every call like fswebcam mode
+        paths.append(("png bytes", variants["contours"], encoded))
+        for label, detector, image in paths:
+            timings, peak = time_detect_size(detector, image, runs)
+            p50, p95, p99 = np.percentile(timings * 1000, [50, 95, 99])
+            area, _ = detector.largest_object(frame)
+            error = (
+                f" area error: {(area - true_area) / true_area:+.1%}"
+                if true_area
+                else ""
+            )
+            print(
+                f"::   {label:<10} p50: {p50:7.2f} ms p95: {p95:7.2f} ms p99: {p99:7.2f} ms "
+                f"throughput: {1 / timings.mean():6.1f} fps peak: {peak / 1024:8.1f} KiB{error}"
+            )
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f":: [BENCHMARK] max resident memory: {max_rss / 1024:.1f} MiB")
+
+
+def synthetic_records(count: int, seed: int = 0) -> list[codec.MeasurementRecord]:
+    rng = np.random.default_rng(seed)
+    start = time.time()
+    return [
+        codec.MeasurementRecord(
+            round(float(rng.uniform(5, 60)), 2),
+            timestamp=start + i * 0.5,
+            distance=round(float(rng.uniform(20, 80)), 1),
+            area_px=int(rng.integers(1_000, 200_000)),
+            confidence=round(float(rng.uniform(0.5, 1)), 3),
+            device_id=1,
+        )
+        for i in range(count)
+    ]
+
+
+def full_text(records: list[codec.MeasurementRecord]) -> str:
+    """
+    What every field would cost as `key=value` text, one record per line.
+    """
+    return "\n".join(
+        ";".join(f"{name}={getattr(record, name)}" for name in record.__slots__)
+        for record in records
+    )
+
+
+def time_codec(encode, decode, records, runs: int) -> tuple[int, float, float]:
+    """
+    Returns the payload size in bytes and the mean encode and decode time in microseconds.
+    """
+    payload = encode(records)
+    started = time.perf_counter()
+    for _ in range(runs):
+        encode(records)
+    encode_us = (time.perf_counter() - started) / runs * 1e6
+    started = time.perf_counter()
+    for _ in range(runs):
+        decode(payload)
+    decode_us = (time.perf_counter() - started) / runs * 1e6
+    size = len(payload.encode()) if isinstance(payload, str) else len(payload)
+    return size, encode_us, decode_us
+
+
+def compare_codecs(batch_sizes: list[int], runs: int) -> None:
+    """
+    Compares the text report format with the binary batches, per message and per record.
+    """
+    formats = {
+        # NOTE: the current format only carries the size
+        "text": (lambda r: codec.encode(r, codec.PAYLOAD_FORMAT.TEXT), codec.decode),
+        "text all": (
+            full_text,
+            lambda payload: [
+                dict(field.split("=") for field in line.split(";"))
+                for line in payload.splitlines()
+            ],
+        ),
+        "binary": (
+            lambda r: codec.encode(r, codec.PAYLOAD_FORMAT.BINARY),
+            codec.decode,
+        ),
+    }
+    for batch_size in batch_sizes:
+        records = synthetic_records(batch_size)
+        print(f":: [BENCHMARK] codec, {batch_size} records per message")
+        for label, (encode, decode) in formats.items():
+            size, encode_us, decode_us = time_codec(encode, decode, records, runs)
+            print(
+                f"::   {label:<10} size: {size:6d} B ({size / batch_size:6.1f} B/record) "
+                f"encode: {encode_us:8.2f} us decode: {decode_us:8.2f} us"
+            )
+
+
+def gate_throughput(
+    count: int, rate: float, open_ms: float, write_latency: float
+) -> None:
+    """
+    Fires `count` gate pulses at `rate` fish per second on the simulated pins
+    and prints the achieved rate, the command-to-edge latency and the pulse widths.
+    """
+    backend = SimulatedBackend(write_latency=write_latency)
+    actuator = GateActuator(Controller(backend))
+    pin = GPIO_MAPPING.GATE_TRIGGER
+    futures = []
+    started = time.perf_counter()
+    for i in range(count):
+        # NOTE: submit on a fixed clock like fish arriving at the gate
+        delay = started + i / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        futures.append(actuator.pulse(pin, open_ms))
+    for future in futures:
+        future.result()
+    elapsed = time.perf_counter() - started
+    actuator.stop()
+
+    edges = backend.edge_log(pin.value)
+    widths = np.array(
+        [(low[0] - high[0]) * 1000 for high, low in zip(edges[::2], edges[1::2])]
+    )
+    p50, p99, worst = actuator.latency_ms()
+    print(
+        f":: [BENCHMARK] gate, {count} pulses of {open_ms:g} ms at {rate:g}/s, write latency {write_latency * 1e6:g} us"
+    )
+    print(
+        f"::   throughput: {count / elapsed:7.1f} pulses/s command-to-edge p50: {p50:.3f} ms "
+        f"p99: {p99:.3f} ms max: {worst:.3f} ms pulse width p50: {np.median(widths):.2f} ms"
+    )
+
+
+def chute_scaling(max_chutes: int, resolution: str, seconds: float) -> None:
+    """
+    Feeds synthetic fish to 1..max_chutes detector processes through shared
+    memory and prints the total fish per second, which should grow with the
+    chutes up to the number of cores.
+    """
+    frame, _ = synthetic_fish(resolution, 8.0)
+    slot_count = 4
+    for chutes in range(1, max_chutes + 1):
+        stop_event = CONTEXT.Event()
+        results = CONTEXT.Queue()
+        calibration_factor = CONTEXT.Value("d", 1.0)
+        workers, feeders, all_slots = [], [], []
+        for chute_idx in range(chutes):
+            slots = SharedFrameSlots(frame.shape, slot_count)
+            slots.frames[:] = frame
+            all_slots.append(slots)
+            free_slots, fish_queue = CONTEXT.Queue(), CONTEXT.Queue()
+            for index in range(slot_count):
+                free_slots.put(index)
+            workers.append(
+                CONTEXT.Process(
+                    target=detect_worker,
+                    args=(
+                        chute_idx,
+                        frame.shape,
+                        slots.name,
+                        slot_count,
+                        free_slots,
+                        fish_queue,
+                        results,
+                        calibration_factor,
+                        stop_event,
+                    ),
+                    daemon=True,
+                )
+            )
+
+            # NOTE: stands in for the capture process, only slot indexes are sent
+            def feed(free_slots=free_slots, fish_queue=fish_queue) -> None:
+                while not stop_event.is_set():
+                    try:
+                        index = free_slots.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                    fish_queue.put((index, time.monotonic(), 40.0, 1.0))
+
+            feeders.append(threading.Thread(target=feed, daemon=True))
+        for worker in workers + feeders:
+            worker.start()
+        # NOTE: wait for the first result so the process startup is not timed
+        results.get()
+        sized = 0
+        started = time.perf_counter()
+        while time.perf_counter() - started < seconds:
+            try:
+                results.get(timeout=0.1)
+                sized += 1
+            except queue.Empty:
+                pass
+        elapsed = time.perf_counter() - started
+        stop_event.set()
+        for worker in workers + feeders:
+            worker.join()
+        for slots in all_slots:
+            slots.close()
+        print(
+            f":: [BENCHMARK] {chutes} chutes {resolution}: {sized / elapsed:7.1f} fish/s "
+            f"({sized / elapsed / chutes:6.1f} per chute, {os.cpu_count()} cores)"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Offline detector benchmark, no camera or network needed"
+    )
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--resolutions", nargs="*", default=RESOLUTIONS)
+    parser.add_argument("--noise", nargs="*", type=float, default=NOISE_LEVELS)
+    parser.add_argument("--samples", default="imgs", help="directory of sample images")
+    parser.add_argument("--min-area", type=float, default=1000)
+    parser.add_argument(
+        "--compare",
+        action="store_true",
+        help="only compare the engines' largest object on the sample images",
+    )
+    parser.add_argument(
+        "--codec",
+        action="store_true",
+        help="only compare the report payload formats",
+    )
+    parser.add_argument("--batch-sizes", nargs="*", type=int, default=BATCH_SIZES)
+    parser.add_argument(
+        "--gate",
+        action="store_true",
+        help="only fire gate pulses on the simulated GPIO backend",
+    )
+    parser.add_argument("--fish-rate", type=float, default=20, help="pulses per second")
+    parser.add_argument("--open-ms", type=float, default=20)
+    parser.add_argument(
+        "--write-latency", type=float, default=0.0, help="seconds per simulated write"
+    )
+    parser.add_argument(
+        "--chutes",
+        type=int,
+        default=0,
+        help="only measure detector throughput for 1 to N chute processes",
+    )
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    if args.chutes:
+        chute_scaling(args.chutes, args.resolutions[0], args.seconds)
+    elif args.gate:
+        gate_throughput(args.runs * 4, args.fish_rate, args.open_ms, args.write_latency)
+    elif args.codec:
+        compare_codecs(args.batch_sizes, args.runs * 20)
+    elif args.compare:
+        images = load_sample_images(args.samples)
+        if not images:
+            print(f":: [BENCHMARK] no sample images found in {args.samples}/")
+        else:
+            compare_engines(images, min_area=args.min_area)
+    else:
+        run_suite(
+            build_cases(args.resolutions, args.noise, args.samples),
+            args.runs,
+            args.min_area,
+        )
@@ -1,14 +1,41 @@
+import time
+from typing import Any, Optional
+
+import numpy as np
+
+from acquisition import AcquisitionCoordinator, Measurement
+from codec import MeasurementRecord
 from controller import Controller
+from debug_sink import DebugArtifactSink
 from detector import Detector
 from reader import Camera, UltrasonicSensor
+from threaded_reader import SensorReaderThread
 
 
 class Calibrator:
+    # NOTE: frames measured per calibration, their median is the estimated size
+    batch_frames: int = 5
+    # NOTE: the last acquisition, it also holds the configs fetched with it
+    last_measurement: Optional[Measurement] = None
+    # NOTE: the result of the last calibration as it is reported
+    last_record: Optional[MeasurementRecord] = None
 
-    def __init__(self) -> None:
-        from config_handler import ConfigHandler
+    def __init__(self, config_handler: Any = None) -> None:
+        if config_handler is None:
+            from config_handler import ConfigHandler
 
-        self.config_handler = ConfigHandler(Controller())
+            config_handler = ConfigHandler(Controller())
+        # NOTE: pass the connector's config handler to share its config cache
+        self.config_handler = config_handler
+        # NOTE: start streaming the sensor now so detections never wait on it
+        SensorReaderThread.shared("/dev/ttyUSB0", 115_200)
+        # NOTE: calibration runs are rare, keep the image of every one of them
+        self.debug_sink = DebugArtifactSink(every_nth=1)
+        # NOTE: kept between calibrations so its buffers are reused
+        self.detector = Detector(debug_sink=self.debug_sink)
+        self.acquisition = AcquisitionCoordinator(
+            Camera(), UltrasonicSensor("/dev/ttyUSB0", 115_200), self.config_handler
+        )
         return
 
     def calibrate_detection(self):
@@ -17,25 +44,46 @@ class Calibrator:
         # controller.toggle_pin(port.GATE_TRIGGER,state.HIGH);
         # gate_trigger_state = controller.read_pin(port.GATE_TRIGGER)
         # print(f":: [GATE_TRIGGER] : {gate_trigger_state}")
-        reader = UltrasonicSensor("/dev/ttyUSB0", 115_200)
-        reader.read()
-        distance = reader.get_reading()
-        print(f":: [DISTANCE] : {distance}")
-
-        camera = Camera()
-        camera.read()
-        image = camera.get_reading()
+
         # NOTE: import localy to avoid circular imports
         from connector import CONFIGS
 
-        calibration_factor = self.config_handler.get_config(CONFIGS.CALIBRATION_FACTOR)
+        # INFO: the frames, the distance and the configs are acquired concurrently
+        # MIN_FISH_SIZE is fetched here too so the caller does not wait for it again
+        measurements = self.acquisition.acquire_batch(
+            self.batch_frames, [CONFIGS.CALIBRATION_FACTOR, CONFIGS.MIN_FISH_SIZE]
+        )
+        measurement = measurements[-1]
+        self.last_measurement = measurement
+        print(f":: [DISTANCE] : {[m.distance for m in measurements]}")
+        calibration_factor = measurement.configs[CONFIGS.CALIBRATION_FACTOR]
         print(
             f":: [CALIBRATOR] initialized with calibration_factor of {calibration_factor}"
         )
-        detector = Detector(calibration_factor)
-        # NOTE: we know that image is indeed a bytearray
-        # we will make pyright shut up
-        # This issue with types kinda tells me that I should do some refactoring
-        est_size = detector.detect_size(image, float(distance))  # pyright: ignore
+        self.detector.CF = calibration_factor
+        if len(measurements) == 1:
+            # NOTE: the fswebcam fallback only gives a single encoded image
+            est_size = self.detector.detect_size(
+                measurement.frame, measurement.distance
+            )
+            area_px = 0
+        else:
+            estimate = self.detector.detect_size_batch(
+                [m.frame for m in measurements], [m.distance for m in measurements]
+            )
+            print(f":: [DETECTOR] Batch Estimate: {estimate}")
+            est_size = estimate.median
+            area_px = int(np.median(estimate.areas))
         print(f":: [DETECTOR] Estimated Size: {est_size}")
+        confidence, _ = SensorReaderThread.shared(
+            "/dev/ttyUSB0", 115_200
+        ).get_confidence()
+        self.last_record = MeasurementRecord(
+            est_size,
+            distance=measurement.distance,
+            area_px=area_px,
+            confidence=confidence,
+        )
+        latency_ms = (time.monotonic() - measurement.frame_ts) * 1000
+        print(f":: [LATENCY] capture-to-detection: {latency_ms:.1f} ms")
         return est_size
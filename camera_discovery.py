@@ -0,0 +1,347 @@
+import glob
+import json
+import os
+import re
+import subprocess
+import threading
+import time
+from typing import Optional
+
+# NOTE: the formats we can stream cheapest first, MJPG keeps the USB bus free at high
+# resolutions and YUYV needs no decoding, anything else is converted by the driver
+FORMAT_PREFERENCE = ["MJPG", "YUYV"]
+
+
+class VideoMode:
+    """
+    One pixel format, resolution and frame rate a device can capture at.
+    """
+
+    def __init__(self, pixel_format: str, width: int, height: int, fps: float) -> None:
+        self.pixel_format = pixel_format
+        self.width = width
+        self.height = height
+        self.fps = fps
+
+    def resolution(self) -> str:
+        return f"{self.width}x{self.height}"
+
+    def rank(self) -> int:
+        if self.pixel_format in FORMAT_PREFERENCE:
+            return FORMAT_PREFERENCE.index(self.pixel_format)
+        return len(FORMAT_PREFERENCE)
+
+    def to_dict(self) -> dict:
+        return {
+            "pixel_format": self.pixel_format,
+            "width": self.width,
+            "height": self.height,
+            "fps": self.fps,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "VideoMode":
+        return cls(data["pixel_format"], data["width"], data["height"], data["fps"])
+
+    def __str__(self) -> str:
+        return f"{self.pixel_format} {self.resolution()} @ {self.fps:g} fps"
+
+
+class CameraDevice:
+    """
+    A capture capable /dev/videoN and the mode picked for it.
+    `card` is the driver's name of the device, it tells a cached index
+    apart from another camera that was plugged in at the same index.
+    """
+
+    def __init__(self, index: int, card: str, mode: Optional[VideoMode]) -> None:
+        self.index = index
+        self.card = card
+        self.mode = mode
+
+    def path(self) -> str:
+        return f"/dev/video{self.index}"
+
+    def to_dict(self) -> dict:
+        return {
+            "index": self.index,
+            "card": self.card,
+            "mode": self.mode.to_dict() if self.mode else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "CameraDevice":
+        mode = VideoMode.from_dict(data["mode"]) if data.get("mode") else None
+        return cls(data["index"], data["card"], mode)
+
+    def __str__(self) -> str:
+        return (
+            f"{self.path()} ({self.card}) {self.mode if self.mode else 'default mode'}"
+        )
+
+
+def list_devices() -> list[int]:
+    """
+    Returns the indexes of the /dev/videoN nodes, lowest first.
+    """
+    indexes = []
+    for device in glob.glob("/dev/video*"):
+        suffix = device[len("/dev/video") :]
+        if suffix.isdigit():
+            indexes.append(int(suffix))
+    return sorted(indexes)
+
+
+def card_name(index: int) -> str:
+    """
+    Reads the device's name from sysfs, this needs no ioctl and no subprocess.
+    """
+    try:
+        with open(f"/sys/class/video4linux/video{index}/name") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def parse_formats(output: str) -> list[VideoMode]:
+    """
+    Parses the `v4l2-ctl --list-formats-ext` output into the capture modes,
+    a size without frame intervals is listed with 0 fps.
+    """
+    modes = []
+    capture = True
+    pixel_format = None
+    size = None
+    for line in output.splitlines():
+        line = line.strip()
+        if line.startswith("Type:"):
+            # NOTE: metadata nodes list formats too, those can not capture frames
+            capture = line == "Type: Video Capture"
+            continue
+        if not capture:
+            continue
+        match = re.match(r"\[\d+\]: '(\w+)'", line)
+        if match:
+            pixel_format = match.group(1)
+            size = None
+            continue
+        match = re.match(r"Size: \w+ (\d+)x(\d+)", line)
+        if match and pixel_format:
+            size = (int(match.group(1)), int(match.group(2)))
+            modes.append(VideoMode(pixel_format, *size, 0.0))
+            continue
+        match = re.search(r"\(([\d.]+) fps\)", line)
+        if match and pixel_format and size:
+            fps = float(match.group(1))
+            last = modes[-1]
+            if last.fps == 0.0 and last.resolution() == f"{size[0]}x{size[1]}":
+                last.fps = fps
+            else:
+                modes.append(VideoMode(pixel_format, *size, fps))
+    return modes
+
+
+def best_mode(modes: list[VideoMode], resolution: str) -> Optional[VideoMode]:
+    """
+    Picks the preferred format at the resolution, the highest frame rate breaks ties.
+    Falls back to the smallest mode larger than the resolution when it is not supported.
+    """
+    width, height = [int(x) for x in resolution.split("x")]
+    exact = [mode for mode in modes if (mode.width, mode.height) == (width, height)]
+    if exact:
+        return min(exact, key=lambda mode: (mode.rank(), -mode.fps))
+    larger = [mode for mode in modes if mode.width >= width and mode.height >= height]
+    if larger:
+        return min(
+            larger,
+            key=lambda mode: (mode.width * mode.height, mode.rank(), -mode.fps),
+        )
+    return None
+
+
+class CameraDiscovery:
+    """
+    Finds the camera once and remembers it.
+    The chosen device and mode are cached on disk, on startup the cache is
+    only checked against sysfs, the devices are probed when it is missing or
+    stale. A failed capture re-probes in the background, the camera keeps
+    using the cached device until a new one is found.
+    """
+
+    # NOTE: seconds between two background re-probes, a dead camera fails every capture
+    reprobe_interval: float = 30
+    # NOTE: seconds v4l2-ctl may take per device
+    probe_timeout: float = 5
+
+    __instance: Optional["CameraDiscovery"] = None
+    __instance_lock = threading.Lock()
+
+    def __init__(
+        self, cache_path: str = "camera_cache.json", resolution: str = "1280x720"
+    ) -> None:
+        self.cache_path = cache_path
+        self.resolution = resolution
+        self.device: Optional[CameraDevice] = None
+        self.lock = threading.Lock()
+        self.probe_lock = threading.Lock()
+        self.prober: Optional[threading.Thread] = None
+        self.last_probe = float("-inf")
+
+    @classmethod
+    def shared(cls) -> "CameraDiscovery":
+        """
+        Returns the discovery of this process, nothing is probed until it is used.
+        """
+        with cls.__instance_lock:
+            if cls.__instance is None:
+                cls.__instance = cls()
+            return cls.__instance
+
+    def __load_cache(self) -> Optional[CameraDevice]:
+        if not os.path.exists(self.cache_path):
+            return None
+        try:
+            with open(self.cache_path) as f:
+                cache = json.load(f)
+            device = CameraDevice.from_dict(cache["device"])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f":: [CAMERA_DISCOVERY] ignoring unreadable cache: {e}")
+            return None
+        if cache.get("resolution") != self.resolution:
+            return None
+        # NOTE: the index is only trusted while the same camera sits at it
+        if not os.path.exists(device.path()) or card_name(device.index) != device.card:
+            print(f":: [CAMERA_DISCOVERY] cached {device.path()} is stale")
+            return None
+        return device
+
+    def __save_cache(self, device: CameraDevice) -> None:
+        tmp_path = f"{self.cache_path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(
+                    {"resolution": self.resolution, "device": device.to_dict()}, f
+                )
+            # NOTE: replace atomically so a power cut never leaves half a cache
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            print(f":: [CAMERA_DISCOVERY] failed to save cache: {e}")
+
+    def __probe_v4l2(self, index: int) -> Optional[list[VideoMode]]:
+        """
+        Lists the device's capture modes, None when v4l2-ctl is not available.
+        """
+        try:
+            result = subprocess.run(
+                ["v4l2-ctl", "-d", f"/dev/video{index}", "--list-formats-ext"],
+                capture_output=True,
+                text=True,
+                timeout=self.probe_timeout,
+            )
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+        if result.returncode != 0:
+            return []
+        return parse_formats(result.stdout)
+
+    def __probe_opencv(self, index: int) -> list[VideoMode]:
+        """
+        Opens the device to see what it delivers at the resolution, used without v4l2-ctl.
+        """
+        import cv2
+
+        width, height = [int(x) for x in self.resolution.split("x")]
+        capture = cv2.VideoCapture(index, cv2.CAP_V4L2)
+        try:
+            if not capture.isOpened():
+                return []
+            capture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+            capture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+            ok, _ = capture.read()
+            if not ok:
+                return []
+            fourcc = int(capture.get(cv2.CAP_PROP_FOURCC))
+            pixel_format = "".join(chr((fourcc >> 8 * i) & 0xFF) for i in range(4))
+            return [
+                VideoMode(
+                    pixel_format.strip("\x00"),
+                    int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                    int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                    capture.get(cv2.CAP_PROP_FPS),
+                )
+            ]
+        finally:
+            capture.release()
+
+    def probe(self) -> Optional[CameraDevice]:
+        """
+        Probes every video device and returns the first one that can capture,
+        preferring one that supports the resolution natively.
+        """
+        started = time.perf_counter()
+        self.last_probe = time.monotonic()
+        fallback = None
+        for index in list_devices():
+            modes = self.__probe_v4l2(index)
+            if modes is None:
+                modes = self.__probe_opencv(index)
+            if not modes:
+                # INFO: metadata and output nodes have no capture modes
+                continue
+            device = CameraDevice(
+                index, card_name(index), best_mode(modes, self.resolution)
+            )
+            if device.mode is not None and device.mode.resolution() == self.resolution:
+                fallback = device
+                break
+            if fallback is None:
+                fallback = device
+        elapsed = (time.perf_counter() - started) * 1000
+        if fallback is None:
+            print(f":: [CAMERA_DISCOVERY] no camera found after {elapsed:.0f} ms")
+            return None
+        print(f":: [CAMERA_DISCOVERY] found {fallback} in {elapsed:.0f} ms")
+        self.__save_cache(fallback)
+        return fallback
+
+    def discover(self) -> Optional[CameraDevice]:
+        """
+        Returns the camera, from the cache when it is still valid.
+        """
+        # NOTE: probing can take seconds, only `probe_lock` is held meanwhile so
+        # a capture thread reporting a failure never waits on it
+        with self.probe_lock:
+            with self.lock:
+                if self.device is not None:
+                    return self.device
+            device = self.__load_cache()
+            if device is None:
+                device = self.probe()
+            else:
+                print(f":: [CAMERA_DISCOVERY] using cached {device}")
+            with self.lock:
+                if self.device is None:
+                    self.device = device
+                return self.device
+
+    def report_failure(self) -> None:
+        """
+        Called when a capture failed, re-probes in the background at most once per `reprobe_interval`.
+        """
+        with self.lock:
+            if self.prober and self.prober.is_alive():
+                return
+            if time.monotonic() - self.last_probe < self.reprobe_interval:
+                return
+            self.last_probe = time.monotonic()
+            self.prober = threading.Thread(
+                target=self.__reprobe, name="CameraDiscovery", daemon=True
+            )
+            self.prober.start()
+
+    def __reprobe(self) -> None:
+        device = self.probe()
+        if device is None:
+            return
+        with self.lock:
+            self.device = device
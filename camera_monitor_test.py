@@ -1,54 +1,35 @@
-from datetime import datetime
+from time import sleep
 
-import cv2
+from detector import Detector
+from frame_grabber import FrameGrabber
+from presence import PresenceMonitor
+from reader import UltrasonicSensor
 
+grabber = FrameGrabber.shared(4)
+if grabber is None:
+    raise SystemExit(":: [ERROR] failed to open /dev/video4")
 
-def __get_area_px(image) -> float:
+detector = Detector(1.5)
+sensor = UltrasonicSensor("/dev/ttyUSB0", 115_200)
 
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
-    _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+def on_presence(frame, timestamp) -> None:
+    # INFO: only frames with something in the chute reach the detector
+    print("Possible Fish Detected")
+    sensor.read()
+    distance = float(sensor.get_reading())  # pyright: ignore
+    est_size = detector.detect_size(frame, distance)
+    print(f":: [DETECTOR] Estimated Size: {est_size}")
 
-    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
-    largest_countour = max(contours, key=cv2.contourArea)
+monitor = PresenceMonitor(grabber, on_presence)
+# NOTE: print the trigger's fps and cpu/frame often while testing
+monitor.report_interval = 2.0
+monitor.start()
 
-    for cnt in contours:
-        area = cv2.contourArea(cnt)
-        if area < 100_000:
-            continue
-        x, y, w, h = cv2.boundingRect(cnt)
-        cv2.rectangle(image, (x, y), (x + w, y + h), (0, 255, 0), 2)
-        cv2.putText(
-            image, str(area), (x, y), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2
-        )
-
-    area = cv2.contourArea(largest_countour)
-    return area
-
-
-video_capture = cv2.VideoCapture(4)
-
-while True:
-    result, video_frame = video_capture.read()
-    if result is False:
-        break
-
-    area = __get_area_px(video_frame)
-    print(f"Area: {area}")
-
-    cv2.imshow("My Face Detection Project", video_frame)
-
-    if area > 140_000:
-        print("Possible Fish Detected")
-        print("Send notification")
-        print("Do something useful")
-        print("Took a photo")
-        cv2.imwrite(f"sized_{datetime.now()}.png", video_frame)
-        break
-
-    if cv2.waitKey(1) & 0xFF == ord("q"):
-        break
-
-video_capture.release()
-cv2.destroyAllWindows()
+try:
+    while True:
+        sleep(1)
+except KeyboardInterrupt:
+    monitor.stop()
+    grabber.stop()
@@ -0,0 +1,169 @@
+import struct
+import time
+from enum import Enum
+from typing import Iterable, Optional, Union
+
+
+class PAYLOAD_FORMAT(Enum):
+    # INFO: one `est_size=x.y` line per report, what the dashboard understands
+    TEXT = "text"
+    BINARY = "binary"
+
+
+# INFO: every binary batch starts with the magic, the schema version and the record count
+MAGIC = b"FN"
+VERSION = 1
+HEADER = struct.Struct("<2sBH")
+# INFO: timestamp, est_size, distance, confidence, area_px, device_id
+RECORD_V1 = struct.Struct("<dfffIH")
+RECORD_FORMATS = {1: RECORD_V1}
+RECORD = RECORD_FORMATS[VERSION]
+
+
+class CodecError(ValueError):
+    pass
+
+
+class MeasurementRecord:
+    """
+    One sized fish as it is reported, shared by the Reporter and the Connector.
+    """
+
+    __slots__ = (
+        "timestamp",
+        "est_size",
+        "distance",
+        "area_px",
+        "confidence",
+        "device_id",
+    )
+
+    def __init__(
+        self,
+        est_size: float,
+        timestamp: Optional[float] = None,
+        distance: float = 0.0,
+        area_px: int = 0,
+        confidence: float = 0.0,
+        device_id: int = 0,
+    ) -> None:
+        self.est_size = est_size
+        # NOTE: wall clock seconds, the dashboard has no use for our monotonic clock
+        self.timestamp = timestamp if timestamp is not None else time.time()
+        self.distance = distance
+        self.area_px = area_px
+        self.confidence = confidence
+        self.device_id = device_id
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, MeasurementRecord):
+            return NotImplemented
+        return all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={getattr(self, name)}" for name in self.__slots__)
+        return f"MeasurementRecord({fields})"
+
+
+def encode_record(record: MeasurementRecord) -> bytes:
+    try:
+        return RECORD.pack(
+            record.timestamp,
+            record.est_size,
+            record.distance,
+            record.confidence,
+            record.area_px,
+            record.device_id,
+        )
+    except struct.error as e:
+        raise CodecError(f"can not encode {record}: {e}") from e
+
+
+def decode_record(
+    data: Union[bytes, memoryview], version: int = VERSION
+) -> MeasurementRecord:
+    record_format = RECORD_FORMATS.get(version)
+    if record_format is None:
+        raise CodecError(f"unsupported record version {version}")
+    timestamp, est_size, distance, confidence, area_px, device_id = (
+        record_format.unpack(data)
+    )
+    return MeasurementRecord(
+        est_size, timestamp, distance, area_px, confidence, device_id
+    )
+
+
+def encode_batch(records: list[MeasurementRecord]) -> bytes:
+    """
+    Frames the records as one message, a header followed by fixed size records.
+    """
+    if len(records) > 0xFFFF:
+        raise CodecError(f"a batch holds at most {0xFFFF} records, got {len(records)}")
+    return HEADER.pack(MAGIC, VERSION, len(records)) + b"".join(
+        encode_record(record) for record in records
+    )
+
+
+def decode_batch(data: Union[bytes, bytearray]) -> list[MeasurementRecord]:
+    if len(data) < HEADER.size:
+        raise CodecError("batch is shorter than its header")
+    magic, version, count = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise CodecError(f"not a binary batch, magic {magic!r}")
+    record_format = RECORD_FORMATS.get(version)
+    if record_format is None:
+        raise CodecError(f"unsupported batch version {version}")
+    body = memoryview(data)[HEADER.size :]
+    if len(body) != count * record_format.size:
+        raise CodecError(
+            f"batch of {count} records has {len(body)} bytes, expected {count * record_format.size}"
+        )
+    return [
+        decode_record(body[offset : offset + record_format.size], version)
+        for offset in range(0, len(body), record_format.size)
+    ]
+
+
+def encode_text(record: MeasurementRecord) -> str:
+    # NOTE: rounded so a size that went through float32 prints like the original
+    return f"est_size={round(record.est_size, 3)}"
+
+
+def decode_text(payload: Union[str, bytes]) -> list[MeasurementRecord]:
+    """
+    Parses one `est_size=x.y` report per line, only the size is known for these.
+    """
+    if isinstance(payload, bytes):
+        payload = payload.decode()
+    records = []
+    for line in payload.splitlines():
+        if not line.strip():
+            continue
+        key, _, value = line.partition("=")
+        if key.strip() != "est_size":
+            raise CodecError(f"invalid report format {line!r}")
+        try:
+            records.append(MeasurementRecord(float(value)))
+        except ValueError as e:
+            raise CodecError(f"invalid report size {line!r}") from e
+    return records
+
+
+def encode(
+    records: Iterable[MeasurementRecord], payload_format: PAYLOAD_FORMAT
+) -> Union[str, bytes]:
+    records = list(records)
+    if payload_format == PAYLOAD_FORMAT.BINARY:
+        return encode_batch(records)
+    return "\n".join(encode_text(record) for record in records)
+
+
+def decode(payload: Union[str, bytes]) -> list[MeasurementRecord]:
+    """
+    Decodes a batch in either format, binary batches are told apart by their magic.
+    """
+    if isinstance(payload, (bytes, bytearray)) and payload[:2] == MAGIC:
+        return decode_batch(payload)
+    return decode_text(payload)
@@ -0,0 +1,161 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Optional
+
+
+class CommandStats:
+    """
+    Counters of the command pool, wait is the time a command spent queued.
+    """
+
+    def __init__(self) -> None:
+        self.submitted = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.max_depth = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_wait(self, wait: float) -> None:
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+
+    def wait_ms(self) -> float:
+        started = self.completed + self.failed
+        return self.wait_total / started * 1000 if started else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"submitted: {self.submitted} coalesced: {self.coalesced} rejected: {self.rejected} "
+            f"completed: {self.completed} failed: {self.failed} max depth: {self.max_depth} "
+            f"wait mean: {self.wait_ms():.1f} ms max: {self.wait_max * 1000:.1f} ms"
+        )
+
+
+class Command:
+    def __init__(self, name: str, run: Callable[[], Any]) -> None:
+        self.name = name
+        self.run = run
+        self.future: Future = Future()
+        self.submitted = time.monotonic()
+
+
+class CommandPool:
+    """
+    Runs the MQTT commands on a few worker threads so the network thread
+    only dispatches. Each command name has a concurrency limit, a command
+    arriving while the same one is queued or running shares its result
+    instead of running again, and the queue is bounded.
+    """
+
+    def __init__(
+        self,
+        workers: int = 2,
+        queue_size: int = 8,
+        limits: Optional[dict[str, int]] = None,
+        default_limit: int = 1,
+    ) -> None:
+        """
+        Args:
+            workers (int): Threads running commands.
+            queue_size (int): Commands waiting to run, more are rejected.
+            limits (dict, optional): Command name -> how many may run at once.
+            default_limit (int): Limit of the commands missing from `limits`.
+        """
+        self.queue_size = queue_size
+        self.limits = limits if limits else {}
+        self.default_limit = default_limit
+        self.pending: deque[Command] = deque()
+        self.running: dict[str, int] = {}
+        # INFO: name -> the queued or running command new duplicates join
+        self.active: dict[str, Command] = {}
+        self.stats = CommandStats()
+        self.cond = threading.Condition()
+        self.stopped = False
+        self.workers = [
+            threading.Thread(target=self.__run, name=f"CommandPool-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(
+        self, name: str, run: Callable[[], Any], coalesce: bool = True
+    ) -> Optional[Future]:
+        """
+        Queues the command without blocking, returns None when the queue is full.
+        """
+        with self.cond:
+            self.stats.submitted += 1
+            if coalesce and name in self.active:
+                self.stats.coalesced += 1
+                return self.active[name].future
+            if self.stopped or len(self.pending) >= self.queue_size:
+                self.stats.rejected += 1
+                print(f":: [COMMAND_POOL] queue full, rejected {name}")
+                return None
+            command = Command(name, run)
+            self.pending.append(command)
+            if coalesce:
+                self.active[name] = command
+            self.stats.max_depth = max(self.stats.max_depth, len(self.pending))
+            self.cond.notify()
+            return command.future
+
+    def depth(self) -> int:
+        with self.cond:
+            return len(self.pending)
+
+    def __next(self) -> Optional[Command]:
+        """
+        Takes the oldest queued command that is under its limit.
+        """
+        for command in self.pending:
+            limit = self.limits.get(command.name, self.default_limit)
+            if self.running.get(command.name, 0) < limit:
+                self.pending.remove(command)
+                self.running[command.name] = self.running.get(command.name, 0) + 1
+                return command
+        return None
+
+    def __run(self) -> None:
+        while True:
+            with self.cond:
+                command = self.__next()
+                while command is None and not self.stopped:
+                    self.cond.wait()
+                    command = self.__next()
+                if command is None:
+                    return
+                self.stats.record_wait(time.monotonic() - command.submitted)
+            try:
+                command.future.set_result(command.run())
+                failed = False
+            except Exception as e:
+                print(f":: [COMMAND_POOL] {command.name} failed: {e}")
+                command.future.set_exception(e)
+                failed = True
+            with self.cond:
+                self.running[command.name] -= 1
+                if self.active.get(command.name) is command:
+                    del self.active[command.name]
+                if failed:
+                    self.stats.failed += 1
+                else:
+                    self.stats.completed += 1
+                # NOTE: a command held back by its limit may run now
+                self.cond.notify_all()
+
+    def stop(self) -> None:
+        """
+        Rejects new commands, finishes the queued ones and waits for the workers.
+        """
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+        for worker in self.workers:
+            worker.join()
@@ -5,9 +5,9 @@ from controller import Controller
 class ConfigHandler(Connector):
     """
     Just a clone of the Connector Class
-    We will use this to get configurations
-    we are having issues with the network loop.
-    If this works I would punch myself
+    We will use this to get configurations.
+    It shares the MQTT connection with the Connector,
+    it only registers for CONFIG_RESPONSE instead.
     """
 
     def __init__(self, controller: Controller) -> None:
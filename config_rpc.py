@@ -0,0 +1,132 @@
+import threading
+import uuid
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Any, Callable, Optional
+
+
+class ConfigRPC:
+    """
+    Request/response layer for the dashboard configs over MQTT.
+    Every request gets a correlation ID and a future that is resolved from
+    the CONFIG_RESPONSE handler, so many requests can be in flight at once
+    and a caller only waits for the broker round trip.
+
+    The dashboard answers `key=value` to a `key` request. With
+    `use_correlation_ids` the request is `cid:key` and a `cid:key=value`
+    response only resolves that request. A plain `key=value` response resolves
+    every pending request for the key, so concurrent requests for the same key
+    share one publish instead of racing.
+    """
+
+    REQUEST_TOPIC = "FISHERYNET|CONFIG_REQUEST"
+    # NOTE: how long the first attempt waits, each retry waits `backoff` times longer
+    timeout: float = 1.0
+    backoff: float = 2.0
+    max_attempts: int = 4
+
+    def __init__(
+        self, publish: Callable[[str, str], Any], use_correlation_ids: bool = False
+    ) -> None:
+        self.publish = publish
+        self.use_correlation_ids = use_correlation_ids
+        # INFO: key -> correlation id -> future
+        self.pending: dict[str, dict[str, Future]] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def parse_response(payload: bytes) -> tuple[Optional[str], str, str]:
+        """
+        Splits a `key=value` or `cid:key=value` response into (cid, key, value).
+        """
+        head, value = payload.decode().split("=", 1)
+        cid = None
+        if ":" in head:
+            cid, head = head.split(":", 1)
+        return cid, head, value
+
+    def __publish(self, key: str, cid: str) -> None:
+        payload = f"{cid}:{key}" if self.use_correlation_ids else key
+        self.publish(self.REQUEST_TOPIC, payload)
+
+    def request(self, key: str) -> tuple[str, Future]:
+        """
+        Sends the request without waiting and returns its (correlation id, future).
+        """
+        cid = uuid.uuid4().hex[:8]
+        future: Future = Future()
+        with self.lock:
+            waiting = self.pending.setdefault(key, {})
+            # NOTE: without correlation ids one publish answers every waiter
+            needs_publish = self.use_correlation_ids or not waiting
+            waiting[cid] = future
+        if needs_publish:
+            self.__publish(key, cid)
+        return cid, future
+
+    def resolve(self, key: str, value: Any, cid: Optional[str] = None) -> int:
+        """
+        Resolves the matching pending requests and returns how many were resolved.
+        """
+        with self.lock:
+            waiting = self.pending.get(key)
+            if not waiting:
+                return 0
+            if cid is not None and cid in waiting:
+                futures = [waiting.pop(cid)]
+            else:
+                futures = list(waiting.values())
+                waiting.clear()
+            if not waiting:
+                self.pending.pop(key, None)
+        for future in futures:
+            future.set_result(value)
+        return len(futures)
+
+    def __cancel(self, key: str, cid: str) -> None:
+        with self.lock:
+            waiting = self.pending.get(key)
+            if waiting:
+                waiting.pop(cid, None)
+                if not waiting:
+                    self.pending.pop(key, None)
+
+    def wait(self, key: str, cid: str, future: Future) -> Any:
+        """
+        Waits for the future, re-sending the request with backoff on timeouts.
+        """
+        timeout = self.timeout
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return future.result(timeout)
+            except FutureTimeout:
+                if attempt == self.max_attempts:
+                    break
+                print(
+                    f":: [CONFIG_RPC] no response for {key} after {timeout:.1f}s, retrying..."
+                )
+                self.__publish(key, cid)
+                timeout *= self.backoff
+        self.__cancel(key, cid)
+        print(f":: [CONFIG_RPC] Maximum retries reached for {key}")
+        raise TimeoutError(f"Maximum retries reached for {key}")
+
+    def call(self, key: str) -> Any:
+        """
+        Requests one config and blocks until it is resolved.
+        """
+        cid, future = self.request(key)
+        return self.wait(key, cid, future)
+
+    def call_many(self, keys: list[str]) -> dict[str, Any]:
+        """
+        Requests every config at once, so the total wait is the slowest response.
+        """
+        requests = {key: self.request(key) for key in keys}
+        return {
+            key: self.wait(key, cid, future) for key, (cid, future) in requests.items()
+        }
+
+    def in_flight(self) -> int:
+        with self.lock:
+            return sum(len(waiting) for waiting in self.pending.values())
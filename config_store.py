@@ -0,0 +1,169 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Optional
+
+
+class ConfigStore:
+    """
+    Local cache of the dashboard configs.
+    Values are served from memory and refreshed in the background once they
+    are older than the TTL, pushed CONFIG_RESPONSE messages replace them
+    right away, and every change is saved to a snapshot on disk so the
+    controller can sort with the last known configs after a reboot or
+    while the broker is unreachable.
+    """
+
+    # NOTE: seconds a value is served before it is refreshed
+    ttl: float = 300
+    # NOTE: seconds between checks for values that need a refresh
+    refresh_interval: float = 30
+    # NOTE: seconds changes are collected before the snapshot is written
+    save_delay: float = 1.0
+
+    def __init__(
+        self,
+        fetch_many: Callable[[list[str]], dict[str, Any]],
+        snapshot_path: str = "config_snapshot.json",
+        ttl: Optional[float] = None,
+    ) -> None:
+        self.fetch_many = fetch_many
+        self.snapshot_path = snapshot_path
+        if ttl is not None:
+            self.ttl = ttl
+        # INFO: key -> (value, monotonic time it was fetched)
+        self.values: dict[str, tuple[Any, float]] = {}
+        # NOTE: keys peeked before they were ever fetched, the refresher fetches them
+        self.wanted: set[str] = set()
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.dirty = threading.Event()
+        self.__load_snapshot()
+        self.refresher = threading.Thread(
+            target=self.__run, name="ConfigStoreRefresher", daemon=True
+        )
+        self.refresher.start()
+        # NOTE: the snapshot is written off the MQTT network thread
+        self.saver = threading.Thread(
+            target=self.__save_loop, name="ConfigStoreSaver", daemon=True
+        )
+        self.saver.start()
+
+    def __load_snapshot(self) -> None:
+        if not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f":: [CONFIG_STORE] ignoring unreadable snapshot: {e}")
+            return
+        # NOTE: snapshot values are usable right away but are refreshed first thing
+        for key, value in snapshot.items():
+            self.values[key] = (value, float("-inf"))
+        print(
+            f":: [CONFIG_STORE] loaded {len(snapshot)} configs from {self.snapshot_path}"
+        )
+
+    def __save_snapshot(self) -> None:
+        with self.lock:
+            snapshot = {key: value for key, (value, _) in self.values.items()}
+        tmp_path = f"{self.snapshot_path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(snapshot, f)
+            # NOTE: replace atomically so a power cut never leaves half a snapshot
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            print(f":: [CONFIG_STORE] failed to save snapshot: {e}")
+
+    def __is_stale(self, fetched_at: float) -> bool:
+        return time.monotonic() - fetched_at >= self.ttl
+
+    def __save_loop(self) -> None:
+        while True:
+            self.dirty.wait()
+            # NOTE: a burst of changes is written by a single save
+            time.sleep(self.save_delay)
+            self.dirty.clear()
+            self.__save_snapshot()
+
+    def put(self, key: str, value: Any) -> None:
+        """
+        Stores a fetched or pushed value, the snapshot is saved in the background if it changed.
+        """
+        with self.lock:
+            previous = self.values.get(key)
+            self.values[key] = (value, time.monotonic())
+        if previous is None or previous[0] != value:
+            self.dirty.set()
+
+    def get_many(self, keys: list[str]) -> dict[str, Any]:
+        """
+        Returns the cached values, only keys never seen before are fetched
+        while the caller waits. Stale values are returned and refreshed in the background.
+        """
+        result = {}
+        missing = []
+        stale = False
+        with self.lock:
+            for key in keys:
+                entry = self.values.get(key)
+                if entry is None:
+                    missing.append(key)
+                    continue
+                result[key] = entry[0]
+                stale = stale or self.__is_stale(entry[1])
+        if stale:
+            self.wake.set()
+        if missing:
+            fetched = self.fetch_many(missing)
+            for key, value in fetched.items():
+                self.put(key, value)
+            result.update(fetched)
+        return result
+
+    def get(self, key: str) -> Any:
+        return self.get_many([key])[key]
+
+    def peek(self, key: str, default: Any = None) -> Any:
+        """
+        Returns the cached value or `default` without ever waiting on the broker,
+        a missing or stale value is fetched in the background.
+        """
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                self.wanted.add(key)
+        if entry is None or self.__is_stale(entry[1]):
+            self.wake.set()
+        return entry[0] if entry is not None else default
+
+    def __refresh(self) -> None:
+        with self.lock:
+            stale = [
+                key
+                for key, (_, fetched_at) in self.values.items()
+                if self.__is_stale(fetched_at)
+            ]
+            stale += [key for key in self.wanted if key not in self.values]
+            self.wanted.clear()
+        if not stale:
+            return
+        try:
+            fetched = self.fetch_many(stale)
+        except Exception as e:
+            # NOTE: keep serving the old values until the broker is back
+            print(f":: [CONFIG_STORE] refresh failed, keeping cached values: {e}")
+            with self.lock:
+                self.wanted.update(key for key in stale if key not in self.values)
+            return
+        for key, value in fetched.items():
+            self.put(key, value)
+
+    def __run(self) -> None:
+        while True:
+            self.wake.wait(self.refresh_interval)
+            self.wake.clear()
+            self.__refresh()
@@ -1,13 +1,28 @@
+import threading
+import time
+from concurrent.futures import Future
 from enum import Enum
-from time import sleep
-from typing import Any
+from typing import TYPE_CHECKING, Any, Optional, Union
 
 import paho.mqtt.client as mqtt
 
-from calibrator import Calibrator
+from actuator import GateActuator
+from aggregator import SizeAggregator, SummaryPublisher
+from command_pool import CommandPool
+from codec import MeasurementRecord
+from config_rpc import ConfigRPC
+from config_store import ConfigStore
 from controller import GPIO_MAPPING, PORT_STATE, Controller
+from history import MeasurementHistory
+from mqtt_bus import MQTTBus
 from reporter import Reporter
 
+# NOTE: the detection stack pulls in cv2 and numpy, it is imported when first used
+if TYPE_CHECKING:
+    from calibrator import Calibrator
+    from multi_chute import ChuteConfig, MultiChuteSorter
+    from pipeline import SortPipeline
+
 
 class CONFIGS(Enum):
     MIN_FISH_SIZE = "min_fish_size"
@@ -16,66 +31,85 @@ class CONFIGS(Enum):
 
 class Connector:
     is_config_handler = False
-    broker = "mqtt.eclipseprojects.io"
-    port = 1883
-    keepalive = 60
+    # NOTE: the connection is shared with every other connector and the reporter
+    bus: MQTTBus
     client: mqtt.Client
-    calibrator: Calibrator
+    calibrator: "Calibrator"
     controller: Controller
+    # NOTE: when set, toggles go through its pre-resolved pins and tracked states
+    actuator: Optional[GateActuator] = None
+    # NOTE: the startup blink of the gate, sorting waits for it so it never toggles under a fish
+    gate_self_test: Optional[Future] = None
     # NOTE: making this Any to avoid circular imports
     config_handler: Any
-    # NOTE: we store the config here because I think having `config`
-    config: dict = {}
-    stopped: bool = False
+    # NOTE: config requests in flight, resolved from CONFIG_RESPONSE
+    rpc: ConfigRPC
+    # NOTE: cached configs, fetched through `rpc` only when missing or stale
+    config_store: ConfigStore
+    # NOTE: commands run here, off the MQTT network thread
+    command_pool: Optional[CommandPool] = None
+    # NOTE: the continuous sort, started and stopped with commands
+    sort_pipeline: Optional[Union["SortPipeline", "MultiChuteSorter"]] = None
+    # NOTE: every sized fish and its gate decision, only kept by the generic connector
+    history: Optional[MeasurementHistory] = None
+    # NOTE: running statistics published on FISHERYNET|SUMMARY every `summary_interval` seconds
+    aggregator: Optional[SizeAggregator] = None
+    summary_publisher: Optional[SummaryPublisher] = None
+    summary_interval: float = 60
+    # NOTE: also report every big fish on its own, the summary covers them otherwise
+    per_fish_reports: bool = True
+    # NOTE: how often the listener prints its CPU usage, in seconds
+    cpu_report_interval: float = 300
 
     def __init__(self, controller: Controller, config_handler: Any) -> None:
-        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)  # pyright: ignore
-        self.client.on_connect = self.__on_connect
-        self.client.on_message = self.__on_message
-        self.client.connect(self.broker, self.port, self.keepalive)
+        self.bus = MQTTBus.shared()
+        self.client = self.bus.client
         self.controller = controller
         self.config_handler = config_handler
-
-    def __on_message(self, client, userdata, msg) -> None:
-        # INFO: call the internal message handler
-        self.__message_handler(msg.topic, msg.payload)
-
-    def __on_connect(self, client, userdata, flags, reason_code, properties) -> None:
-        print(
-            f":: [{'GENERIC' if not self.is_config_handler else 'CONFIG_HANDLER'}_CONNECTOR] Connected with result code {reason_code}"
-        )
+        self.stop_event = threading.Event()
+        # NOTE: START_SORTING and STOP_SORTING run on different pool workers, a stop
+        # arriving while the pipeline starts waits for it and then stops it
+        self.sort_lock = threading.Lock()
+        # NOTE: with chutes configured every chute is sorted in its own processes,
+        # their devices must not be the ones the calibrator streams in this process
+        self.chutes: list["ChuteConfig"] = []
         if not self.is_config_handler:
             print(
                 ":: [GENERIC_CONNECTOR] Subscribing to COMMANDS and TOGGLE_PORT topic..."
             )
-            self.client.subscribe("FISHERYNET|COMMANDS")
-            self.client.subscribe("FISHERYNET|TOGGLE_PORT")
+            self.bus.register("FISHERYNET|COMMANDS", self.__dispatch_command)
+            # NOTE: one calibration at a time, the camera and the sensor are shared
+            self.command_pool = CommandPool(limits={"START_DETECTION_CALIBRATION": 1})
+            self.bus.register("FISHERYNET|TOGGLE_PORT", self.__toggle_handler)
+            self.history = MeasurementHistory()
+            self.aggregator = SizeAggregator()
+            self.summary_publisher = SummaryPublisher(
+                self.aggregator, self.bus.publish, self.summary_interval
+            )
+            self.summary_publisher.start()
             # NOTE: if connector is not a config_hanlder we won't subscribe to CONFIG_RESPONSE
             # early return
             return
+        self.rpc = ConfigRPC(self.bus.publish)
+        self.config_store = ConfigStore(self.rpc.call_many)
         print(":: [CONFIG_HANDLER_CONNECTOR] Subscribing to CONFIG_RESPONSE")
-        self.client.subscribe("FISHERYNET|CONFIG_RESPONSE")
+        self.bus.register("FISHERYNET|CONFIG_RESPONSE", self.__config_handler)
+        # NOTE: keep the network loop running so responses resolve as they arrive
+        self.bus.start()
 
-    def __message_handler(self, topic: bytes, payload: bytes) -> None:
+    def __dispatch_command(self, command: bytes):
         """
-        Handle the massage according to the topic in which they are sent
+        Hands the command to the pool, the network thread never runs a command itself.
+        Config lookups made by a command wait on responses that this thread delivers.
         """
-        match str(topic):
-            case "FISHERYNET|COMMANDS":
-                self.__command_handler(payload)
-
-            case "FISHERYNET|CONFIG_RESPONSE":
-                print(f":: [MESSAGE_HANDER] Configuration Response: {payload}")
-                self.__config_handler(payload)
-
-            case "FISHERYNET|TOGGLE_PORT":
-                print(f":: [TOGGLE_HANDLER] {payload}")
-                self.__toggle_handler(payload)
-
-            case _:
-                print(
-                    f":: [MESSAGE_HANDER] handler for topic {topic} is not yet implemented."
-                )
+        if self.command_pool is None:
+            return
+        print(
+            f":: [COMMAND_HANDLER] dispatching {command}, queued: {self.command_pool.depth()}"
+        )
+        self.command_pool.submit(
+            command.decode(errors="replace"), lambda: self.__command_handler(command)
+        )
 
     def __command_handler(self, command: bytes):
         match command:
@@ -86,8 +120,10 @@ class Connector:
             case b"START_DETECTION_CALIBRATION":
                 print(f":: [COMMAND_HANDLER]  detection calibration started")
                 est_size = self.calibrator.calibrate_detection()
-                # call the get config to compare the estimated size with the minimum fish size
-                min_fish_size = self.config_handler.get_config(CONFIGS.MIN_FISH_SIZE)
+                # NOTE: the calibrator fetched the minimum fish size alongside the measurement
+                min_fish_size = self.calibrator.last_measurement.configs[  # pyright: ignore
+                    CONFIGS.MIN_FISH_SIZE
+                ]
                 is_big = est_size >= min_fish_size
                 print(
                     f":: [COMMAND_HANDLER]  estimated size: {est_size}, minimum fish size: {min_fish_size}"
@@ -95,23 +131,128 @@ class Connector:
                 print(
                     f":: [COMMAND_HANDLER]  the fish is {'big' if is_big else 'small'}"
                 )
-                # NOTE: we only send the report if the connector is not a config_handler
-                # weird this should not be hit since we're not subscribe to COMMANDS
-                if is_big:
-                    Reporter.send_report(f"est_size={est_size}")  # pyright: ignore
-                self.client.publish(
+                # NOTE: the record carries the distance, area and confidence along with the size
+                record = self.calibrator.last_record
+                self.__on_fish(
+                    record if record else MeasurementRecord(est_size), is_big
+                )
+                self.bus.publish(
                     "FISHERYNET|CALIBRATION_RESPONSE", f"est_size={est_size}"
                 )
+            case b"START_SORTING":
+                print(f":: [COMMAND_HANDLER]  starting the sort pipeline")
+                with self.sort_lock:
+                    self.__start_sorting()
+
+            case b"STOP_SORTING":
+                print(f":: [COMMAND_HANDLER]  stopping the sort pipeline")
+                with self.sort_lock:
+                    if self.sort_pipeline:
+                        self.sort_pipeline.stop()
+                        self.sort_pipeline = None
+
             case _:
                 print(
                     f":: [COMMAND_HANDLER] handler for command {str(command)} is not yet implemented."
                 )
 
+    def __on_fish(self, record: MeasurementRecord, is_big: bool) -> None:
+        """
+        Keeps and reports one sized fish, from a calibration or from the sort pipeline.
+        """
+        if self.history:
+            self.history.record(record, is_big)
+        if self.aggregator:
+            self.aggregator.add(record.est_size, is_big)
+        if is_big and self.per_fish_reports:
+            Reporter.send_record(record)
+
+    def __start_sorting(self) -> None:
+        if self.sort_pipeline:
+            print(":: [COMMAND_HANDLER]  the sort pipeline is already running")
+            return
+        from frame_grabber import FrameGrabber
+        from multi_chute import MultiChuteSorter
+        from pipeline import SortPipeline
+        from threaded_reader import SensorReaderThread
+
+        if self.gate_self_test and not self.gate_self_test.done():
+            print(":: [COMMAND_HANDLER]  waiting for the gate self-test to end")
+            try:
+                self.gate_self_test.result()
+            except Exception as e:
+                print(f":: [COMMAND_HANDLER]  gate self-test failed: {e}")
+        # NOTE: the configs come from the cache, a fish never waits on the broker
+        config_store = self.config_handler.config_store
+        if self.chutes:
+            conflicts = self.chute_conflicts()
+            if conflicts:
+                for conflict in conflicts:
+                    print(f":: [COMMAND_HANDLER]  {conflict}, can not sort")
+                return
+            for chute in self.chutes:
+                # NOTE: the capture workers open the chute's devices themselves,
+                # a stream this process still holds on them would steal the frames
+                FrameGrabber.release(chute.device_idx)
+                SensorReaderThread.release(chute.serial_port)
+            pins = tuple({chute.gate_pin for chute in self.chutes})
+            if self.actuator is None or any(
+                pin not in self.actuator.writers for pin in pins
+            ):
+                self.actuator = GateActuator(self.controller, pins)
+            self.sort_pipeline = MultiChuteSorter(
+                self.chutes, self.actuator, config_store.peek, self.__on_fish
+            )
+            self.sort_pipeline.start()
+            return
+        grabber = FrameGrabber.shared(self.calibrator.acquisition.camera.device_idx)
+        if grabber is None:
+            print(":: [COMMAND_HANDLER]  no camera stream, can not sort")
+            return
+        if self.actuator is None:
+            self.actuator = GateActuator(self.controller)
+        # NOTE: the sensor the calibrator was set up with
+        sensor = self.calibrator.acquisition.sensor
+        self.sort_pipeline = SortPipeline(
+            grabber,
+            SensorReaderThread.shared(sensor.port, sensor.baud_rate),  # pyright: ignore
+            self.actuator,
+            config_store.peek,
+            self.__on_fish,
+        )
+        self.sort_pipeline.start()
+
+    def chute_conflicts(self) -> list[str]:
+        """
+        Describes every chute that would open a device the calibrator streams.
+        """
+        camera = self.calibrator.acquisition.camera
+        sensor = self.calibrator.acquisition.sensor
+        conflicts = []
+        for chute_idx, chute in enumerate(self.chutes):
+            if chute.device_idx == camera.device_idx:
+                conflicts.append(
+                    f"chute {chute_idx} uses the calibrator's camera /dev/video{chute.device_idx}"
+                )
+            if chute.serial_port == sensor.port:  # pyright: ignore
+                conflicts.append(
+                    f"chute {chute_idx} uses the calibrator's sensor {chute.serial_port}"
+                )
+        return conflicts
+
     def __toggle_handler(self, port: bytes):
+        print(f":: [TOGGLE_HANDLER] {port}")
         port_str = port.decode()
         if not hasattr(GPIO_MAPPING, port_str):
             return
         target_port = getattr(GPIO_MAPPING, port_str)
+        if self.actuator and target_port in self.actuator.writers:
+            current = self.actuator.state(target_port)
+            # NOTE: a pin never written since startup is LOW
+            target = PORT_STATE.LOW if current == PORT_STATE.HIGH else PORT_STATE.HIGH
+            self.actuator.write(target_port, target)
+            print(f":: [TOGGLE_HANDLER] toggled {target_port} to {target}")
+            return
         state = self.controller.read_pin(target_port)
         if state == None:
             print(f":: [TOGGLE_HANDLER] failed to read {target_port}")
@@ -121,49 +262,94 @@ class Connector:
         self.controller.toggle_pin(target_port, state)
 
     def __config_handler(self, config: bytes):
-        key, value = config.decode().split("=")
+        print(f":: [MESSAGE_HANDER] Configuration Response: {config}")
+        cid, key, value = ConfigRPC.parse_response(config)
         match key:
             case "min_fish_size":
                 print(f":: [CONFIG_HANDLER] Minimum fish size: {value}")
-                self.config["min_fish_size"] = int(value)
+                self.__on_config(key, int(value), cid)
             case "calibration_factor":
                 print(f":: [CONFIG_HANDLER] Calibration factor: {value}")
-                self.config["calibration_factor"] = float(value)
+                self.__on_config(key, float(value), cid)
             case _:
                 pass
                 # print(f":: [CONFIG_HANDLER] handler for config {config} is not yet implemented.")
 
+    def __on_config(self, key: str, value: Any, cid: Optional[str]) -> None:
+        # NOTE: every response updates the cache, pushed ones included
+        self.config_store.put(key, value)
+        self.rpc.resolve(key, value, cid)
+
     def get_config(self, config_name: CONFIGS):
+        if not self.is_config_handler:
+            # NOTE: only the config handler listens to CONFIG_RESPONSE
+            return self.config_handler.get_config(config_name)
         print(f":: [GET_CONFIG] Requesting configuration: {config_name.value}")
-        self.client.loop_start()
-        # NOTE: we subscribe because we wil only be interested in CONFIG_RESPONSE
-        # when we actually request for a configuration
-        self.client.publish("FISHERYNET|CONFIG_REQUEST", f"{config_name.value}")
-
-        retry_count = 0
-        while not config_name.value in self.config:
-            if retry_count > 10:
-                print(":: [GET_CONFIG] Maximum retries reached")
-                raise Exception("Maximum retries reached")
-            print(":: [GET_CONFIG] Waiting for response...")
-            retry_count += 1
-            sleep(1)
-
-        self.client.loop_stop()
-        config_value = self.config[config_name.value]
+        config_value = self.config_store.get(config_name.value)
         print(f":: [GET_CONFIG_SUCCESS] Configuration: {config_value}")
-        self.config.pop(config_name.value)
         return config_value
 
+    def get_configs(self, config_names: list[CONFIGS]) -> dict:
+        """
+        Requests every config at once and waits for all of them.
+        """
+        if not self.is_config_handler:
+            return self.config_handler.get_configs(config_names)
+        print(
+            f":: [GET_CONFIG] Requesting configurations: {[c.value for c in config_names]}"
+        )
+        values = self.config_store.get_many(
+            [config_name.value for config_name in config_names]
+        )
+        return {config_name: values[config_name.value] for config_name in config_names}
+
     def start(self) -> None:
+        """
+        Runs the listener until `stop` is called.
+        The calling thread sleeps on an event while paho's network thread
+        handles the messages, so an idle listener uses no CPU.
+        """
         print(":: [MQTT_LISTENER] main listener started! ")
-        self.client.loop_start()
-        while True:
-            if self.stopped:
-                print(":: [MQTT_LISTENER] main listener stopped! ")
-                self.client.disconnect()
-                break
-        self.client.loop_stop()
+        self.bus.start()
+        started = time.monotonic()
+        cpu_started = time.process_time()
+        try:
+            while not self.stop_event.wait(self.cpu_report_interval):
+                self.__report_cpu(started, cpu_started)
+        except KeyboardInterrupt:
+            self.stop_event.set()
+        print(":: [MQTT_LISTENER] main listener stopped! ")
+        self.__report_cpu(started, cpu_started)
+        if self.command_pool:
+            self.command_pool.stop()
+        with self.sort_lock:
+            if self.sort_pipeline:
+                self.sort_pipeline.stop()
+        # NOTE: after the pipeline so no fish schedules a move on a stopped actuator
+        if self.actuator:
+            self.actuator.stop()
+        if self.summary_publisher:
+            self.summary_publisher.stop()
+        # NOTE: publish or spool the queued reports while still connected
+        Reporter.close()
+        if self.history:
+            self.history.stop()
+        # NOTE: waits for the network thread to flush the disconnect
+        self.bus.stop()
+
+    def __report_cpu(self, started: float, cpu_started: float) -> None:
+        """
+        Prints the CPU used by the whole process while the listener ran.
+        """
+        elapsed = time.monotonic() - started
+        if elapsed <= 0:
+            return
+        usage = (time.process_time() - cpu_started) / elapsed
+        print(
+            f":: [MQTT_LISTENER] CPU usage since start: {usage:.1%} over {elapsed:.0f} s"
+        )
+        if self.command_pool:
+            print(f":: [COMMAND_POOL] {self.command_pool.stats}")
 
     def stop(self) -> None:
-        self.stopped = True
+        self.stop_event.set()
@@ -1,7 +1,10 @@
 from enum import Enum
-from typing import Optional
+from functools import partial
+from typing import Callable, Optional
 
-from pyA20.gpio import gpio, port  # pyright: ignore
+from pyA20.gpio import port  # pyright: ignore
+
+from gpio_backend import GPIOBackend, PyA20Backend, SimulatedBackend
 
 
 class GPIO_MAPPING(Enum):
@@ -28,11 +31,19 @@ class PORT_PULL_MODE(Enum):
 
 
 class Controller:
-    def __init__(self) -> None:
+    def __init__(self, backend: Optional[GPIOBackend] = None) -> None:
+        """
+        Args:
+            backend (GPIOBackend, optional): Defaults to the real pins on Armbian
+                and to the simulated pins anywhere else.
+        """
         self.prod = self.__on_armbian()
         print(f":: [ENV] {'PROD' if self.prod else 'TEST'}")
-        if self.prod:
-            gpio.init()
+        if backend is None:
+            backend = PyA20Backend() if self.prod else SimulatedBackend()
+        self.backend = backend
+        print(f":: [GPIO] using the {backend.name} backend")
+        self.backend.init()
         self.__prepare_pins()
 
     def __on_armbian(self) -> bool:
@@ -56,71 +67,51 @@ class Controller:
         """
         print(f":: [INIT] Preparing pins...")
         # TODO: implement the configuration needed
-        if self.prod:
-            self.__set_pin_mode(GPIO_MAPPING.GATE_TRIGGER, PORT_MODE.OUTPUT)
-            self.__set_pin_mode(GPIO_MAPPING.EXTRA_1, PORT_MODE.OUTPUT)
-            self.__set_pin_mode(GPIO_MAPPING.EXTRA_2, PORT_MODE.OUTPUT)
-            return
-        # NOTE: a dummy setup
         self.__set_pin_mode(GPIO_MAPPING.GATE_TRIGGER, PORT_MODE.OUTPUT)
+        self.__set_pin_mode(GPIO_MAPPING.EXTRA_1, PORT_MODE.OUTPUT)
+        self.__set_pin_mode(GPIO_MAPPING.EXTRA_2, PORT_MODE.OUTPUT)
 
     def __check_pin_mode(self, port: GPIO_MAPPING) -> Optional[int]:
         """
         Returns the current mode of the pin
         """
-        if self.prod:
-            status = gpio.getcfg(port.value)
-            return status
-        print(f":: [PIN_CHECK] ...")
+        return self.backend.getcfg(port.value)
 
     def __set_pin_mode(self, pin: GPIO_MAPPING, mode: PORT_MODE) -> None:
         """
         This function is for setting the PIN MODE not STATUS conveniently.
         This will wrap the function provided by the module.
         """
-        if self.prod:
-            gpio.setcfg(pin.value, mode.value)
-            return
-        print(f":: [PORT_MODE_SET] port: {pin}|{pin.value} mode: {mode}|{mode.value}")
+        self.backend.setcfg(pin.value, mode.value)
 
     def __set_pin_status(self, pin: GPIO_MAPPING, state: PORT_STATE) -> None:
         """
         This function is for setting the PIN STATUS not MODE conveniently.
         This will wrap the function provided by the module.
         """
-        if self.prod:
-            gpio.output(pin.value, state.value)
-            return
-        print(
-            f":: [PORT_STATUS_SET] port: {pin}|{pin.value} state: {state}|{state.value}"
-        )
+        self.backend.output(pin.value, state.value)
 
     def __get_pin_status(self, pin: GPIO_MAPPING) -> Optional[int]:
-        if self.prod:
-            status = gpio.input(pin.value)
-            return status
-        print(f":: [PORT_STATUS_GET] port: {pin}|{pin.value}")
+        return self.backend.input(pin.value)
 
     def check_pins(self, pins: list[GPIO_MAPPING]) -> None:
         """
         Checks the current mode of each pins
         """
-        if self.prod:
-            for pin in pins:
-                status = self.__check_pin_mode(pin)
-                print(f":: [PIN_CHECK] port: {pin}|{pin.value} status: {status}")
-            return
-        print(f":: [PIN_CHECK] Checking all pins...")
+        for pin in pins:
+            status = self.__check_pin_mode(pin)
+            print(f":: [PIN_CHECK] port: {pin}|{pin.value} status: {status}")
 
     def toggle_pin(self, pin: GPIO_MAPPING, state: PORT_STATE) -> None:
-        if self.prod:
-            self.__set_pin_status(pin, state)
-            print(f":: [TOGGLE] port: {pin}|{pin.value} mode: {state}|{state.value}")
-            return
+        self.__set_pin_status(pin, state)
         print(f":: [TOGGLE] port: {pin}|{pin.value} mode: {state}|{state.value}")
 
     def read_pin(self, pin: GPIO_MAPPING) -> Optional[int]:
-        if self.prod:
-            status = self.__get_pin_status(pin)
-            return status
-        print(f":: [READ] port: {pin}|{pin.value}")
+        return self.__get_pin_status(pin)
+
+    def pin_writer(self, pin: GPIO_MAPPING) -> Callable[[int], None]:
+        """
+        Returns a function that sets the pin to a raw state value.
+        It skips the enum lookups and the logging of `toggle_pin`, for the actuation path.
+        """
+        return partial(self.backend.output, pin.value)
@@ -0,0 +1,156 @@
+import os
+import queue
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Optional
+
+import cv2
+import numpy as np
+
+
+class DebugArtifactSink:
+    """
+    Writes the annotated `sized_*` images used for visualizing how a detection went.
+    Only sampled detections are kept, they are annotated, encoded and written
+    on a background worker, and the oldest images are evicted once the
+    directory goes over its quota.
+    """
+
+    # INFO: encoder parameter used for `quality` by each format
+    QUALITY_PARAMS = {
+        "jpg": cv2.IMWRITE_JPEG_QUALITY,
+        "webp": cv2.IMWRITE_WEBP_QUALITY,
+        # NOTE: for png the quality is the compression level 0-9
+        "png": cv2.IMWRITE_PNG_COMPRESSION,
+    }
+
+    def __init__(
+        self,
+        directory: str = "imgs/sized",
+        every_nth: int = 10,
+        borderline: Optional[tuple[float, float]] = None,
+        image_format: str = "jpg",
+        quality: int = 80,
+        quota_bytes: int = 200 * 1024 * 1024,
+        queue_size: int = 4,
+    ) -> None:
+        """
+        Args:
+            directory (str): Where the images are written.
+            every_nth (int): Keep every Nth detection, 0 keeps none of them.
+            borderline (tuple, optional): (low, high) estimated sizes that are always kept.
+            image_format (str): One of jpg, webp or png.
+            quality (int): Encoder quality, or compression level for png.
+            quota_bytes (int): Disk space the images may take.
+            queue_size (int): Images waiting to be written, more are dropped.
+        """
+        if image_format not in self.QUALITY_PARAMS:
+            raise ValueError(f"unsupported debug image format {image_format}")
+        self.directory = directory
+        self.every_nth = every_nth
+        self.borderline = borderline
+        self.image_format = image_format
+        self.params = [self.QUALITY_PARAMS[image_format], quality]
+        self.quota_bytes = quota_bytes
+        self.detections = 0
+        self.dropped = 0
+        self.written = 0
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        os.makedirs(directory, exist_ok=True)
+        # INFO: (path, size) oldest first, seeded with what is already on disk
+        self.files: deque[tuple[str, int]] = deque(self.__scan())
+        self.used_bytes = sum(size for _, size in self.files)
+        self.worker = threading.Thread(
+            target=self.__run, name="DebugArtifactSink", daemon=True
+        )
+        self.worker.start()
+
+    def __scan(self) -> list[tuple[str, int]]:
+        entries = [
+            entry
+            for entry in os.scandir(self.directory)
+            if entry.is_file() and entry.name.startswith("sized_")
+        ]
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        return [(entry.path, entry.stat().st_size) for entry in entries]
+
+    def should_capture(self, est_size: Optional[float] = None) -> bool:
+        """
+        Counts the detection and checks if its image should be kept.
+        """
+        self.detections += 1
+        if self.borderline and est_size is not None:
+            low, high = self.borderline
+            if low <= est_size <= high:
+                return True
+        return self.every_nth > 0 and self.detections % self.every_nth == 0
+
+    def submit(self, img: np.ndarray, objects: list) -> bool:
+        """
+        Queues the image and its (area, contour or bounding box) pairs without blocking.
+        The image must not be modified afterwards, pass a copy of shared frames.
+        """
+        try:
+            self.queue.put_nowait((datetime.now(), img, objects))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def __annotate(self, img: np.ndarray, objects: list) -> None:
+        # INFO: Loop through the objects and draw the area of each of them
+        for area, contour_or_box in objects:
+            if area < 1000:
+                continue
+            if isinstance(contour_or_box, tuple):
+                x, y, w, h = contour_or_box
+            else:
+                x, y, w, h = cv2.boundingRect(contour_or_box)
+            cv2.rectangle(img, (x, y), (x + w, y + h), (0, 255, 0), 2)
+            cv2.putText(
+                img, str(area), (x, y), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2
+            )
+
+    def __evict(self) -> None:
+        while self.used_bytes > self.quota_bytes and self.files:
+            path, size = self.files.popleft()
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.used_bytes -= size
+
+    def __write(self, timestamp: datetime, img: np.ndarray, objects: list) -> None:
+        if img.ndim == 2:
+            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+        self.__annotate(img, objects)
+        ok, encoded = cv2.imencode(f".{self.image_format}", img, self.params)
+        if not ok:
+            print(":: [DEBUG_SINK] failed to encode debug image")
+            return
+        path = os.path.join(
+            self.directory, f"sized_{timestamp:%Y%m%d_%H%M%S_%f}.{self.image_format}"
+        )
+        with open(path, "wb") as f:
+            f.write(encoded.tobytes())
+        self.files.append((path, encoded.size))
+        self.used_bytes += encoded.size
+        self.written += 1
+        self.__evict()
+
+    def __run(self) -> None:
+        while True:
+            timestamp, img, objects = self.queue.get()
+            try:
+                self.__write(timestamp, img, objects)
+            except Exception as e:
+                print(f":: [DEBUG_SINK] failed to write debug image: {e}")
+            finally:
+                self.queue.task_done()
+
+    def flush(self) -> None:
+        """
+        Blocks until every queued image is written.
+        """
+        self.queue.join()
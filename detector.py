@@ -1,54 +1,321 @@
-from datetime import datetime
-from typing import Optional
+from enum import Enum
+from typing import Optional, Union
 
 import cv2
 import numpy as np
 
+from debug_sink import DebugArtifactSink
+
+# INFO: anything the detector can measure without decoding
+Frame = Union[np.ndarray, memoryview]
+
+
+class MEASUREMENT_ENGINE(Enum):
+    # INFO: area enclosed by the largest external contour, holes included
+    CONTOURS = "contours"
+    # INFO: pixel count of the largest connected blob, a single labelling pass
+    COMPONENTS = "components"
+
+
+class SizeEstimate:
+    """
+    Robust size of one fish measured over several frames.
+    `spread` is the median absolute deviation scaled to a standard deviation.
+    """
+
+    # NOTE: scales the MAD to a standard deviation for normal noise
+    MAD_SCALE = 1.4826
+
+    def __init__(self, sizes: np.ndarray, areas: np.ndarray) -> None:
+        self.sizes = sizes
+        self.areas = areas
+        self.count = len(sizes)
+        self.median = float(np.median(sizes))
+        self.spread = float(np.median(np.abs(sizes - self.median)) * self.MAD_SCALE)
+        q1, q3 = np.percentile(sizes, [25, 75])
+        self.iqr = float(q3 - q1)
+
+    def __str__(self) -> str:
+        return f"{self.median:.2f} ± {self.spread:.2f} over {self.count} frames"
+
 
 class Detector:
     # TODO: add actual CF
     CF: float = 69
 
-    def __init__(self, cf: Optional[float] = None) -> None:
+    def __init__(
+        self,
+        cf: Optional[float] = None,
+        debug_sink: Optional[DebugArtifactSink] = None,
+        engine: MEASUREMENT_ENGINE = MEASUREMENT_ENGINE.CONTOURS,
+        min_area: float = 0,
+    ) -> None:
         if cf:
             self.CF = cf
-        print(f":: [DETECTOR] initialized with CF {self.CF}")
+        self.engine = engine
+        # NOTE: objects smaller than this are noise and never measured
+        self.min_area = min_area
+        # NOTE: without a sink no debug images are written
+        self.debug_sink = debug_sink
+        # NOTE: reused between frames of the same size
+        self.gray_buf: Optional[np.ndarray] = None
+        self.thresh_buf: Optional[np.ndarray] = None
+        self.labels_buf: Optional[np.ndarray] = None
+        # NOTE: reused between batches of the same size
+        self.batch_gray: Optional[np.ndarray] = None
+        self.batch_thresh: Optional[np.ndarray] = None
+        print(f":: [DETECTOR] initialized with CF {self.CF} engine {self.engine.value}")
         return
 
-    def __get_area_px(self, image: bytearray) -> float:
-        # Load the image
-        image_buf = np.asarray(image, dtype="uint8")
-        img = cv2.imdecode(image_buf, cv2.IMREAD_COLOR)
+    def __as_array(
+        self,
+        frame: Frame,
+        roi: Optional[tuple[int, int, int, int]],
+        shape: Optional[tuple[int, ...]],
+    ) -> np.ndarray:
+        """
+        Wraps the frame as an ndarray view, cropped to the (x, y, w, h) roi.
+        Neither the wrap nor the crop copies the pixels.
+        """
+        if isinstance(frame, memoryview):
+            # NOTE: a flat capture buffer needs its shape, a shaped one keeps it
+            frame = np.frombuffer(frame, np.uint8) if shape else np.asarray(frame)
+        if shape:
+            frame = frame.reshape(shape)
+        if roi:
+            x, y, w, h = roi
+            frame = frame[y : y + h, x : x + w]
+        return frame
+
+    def __to_gray(self, frame: np.ndarray) -> np.ndarray:
+        if frame.ndim == 2:
+            # INFO: already grayscale, use it as is
+            return frame
+        if self.gray_buf is None or self.gray_buf.shape != frame.shape[:2]:
+            self.gray_buf = np.empty(frame.shape[:2], np.uint8)
         # Convert the image to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self.gray_buf)
+
+    def __threshold(
+        self, gray: np.ndarray, thresh: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        if thresh is None:
+            if self.thresh_buf is None or self.thresh_buf.shape != gray.shape:
+                self.thresh_buf = np.empty(gray.shape, np.uint8)
+            thresh = self.thresh_buf
         # Apply a threshold to the image to
         # separate the objects from the background
-        _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        cv2.threshold(
+            gray,
+            0,
+            255,
+            cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU,
+            dst=thresh,
+        )
+        return thresh
 
+    def __contour_objects(self, thresh: np.ndarray) -> list:
         # Find the contours of the objects in the image
         contours, _ = cv2.findContours(
             thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
         )
-
-        largest_countour = max(contours, key=cv2.contourArea)
-        # INFO: Loop through the contours and calculate the area of each object
-        # NOTE: only used for debugging
+        objects = []
         for cnt in contours:
             area = cv2.contourArea(cnt)
-            if area < 1000:
-                continue
-            x, y, w, h = cv2.boundingRect(cnt)
-            cv2.rectangle(img, (x, y), (x + w, y + h), (0, 255, 0), 2)
-            cv2.putText(
-                img, str(area), (x, y), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2
-            )
-        # INFO: write the image to a file
-        # used for visualizing how the detection went
-        cv2.imwrite(f"sized_{datetime.now()}.png", img)
-        area = cv2.contourArea(largest_countour)
-        return area
+            if area >= self.min_area:
+                objects.append((area, cnt))
+        return objects
+
+    def __component_objects(self, thresh: np.ndarray) -> list:
+        if self.labels_buf is None or self.labels_buf.shape != thresh.shape:
+            self.labels_buf = np.empty(thresh.shape, np.int32)
+        # INFO: one labelling pass gives the area and bounding box of every blob
+        _, _, stats, _ = cv2.connectedComponentsWithStats(
+            thresh, labels=self.labels_buf, connectivity=8, ltype=cv2.CV_32S
+        )
+        # NOTE: label 0 is the background
+        stats = stats[1:]
+        stats = stats[stats[:, cv2.CC_STAT_AREA] >= self.min_area]
+        return [
+            (float(area), (int(x), int(y), int(w), int(h)))
+            for x, y, w, h, area in stats
+        ]
 
-    def detect_size(self, image: bytearray, distance: float) -> float:
-        area_px: float = self.__get_area_px(image)
+    def __objects(self, thresh: np.ndarray) -> list:
+        """
+        Returns the (area, contour or bounding box) of every object
+        of at least `min_area` pixels, found by the selected engine.
+        """
+        if self.engine == MEASUREMENT_ENGINE.COMPONENTS:
+            return self.__component_objects(thresh)
+        return self.__contour_objects(thresh)
+
+    def __measure(self, frame: np.ndarray) -> tuple[float, list]:
+        """
+        Returns the area of the largest object and every object found.
+        """
+        objects = self.__objects(self.__threshold(self.__to_gray(frame)))
+        if not objects:
+            return 0.0, []
+        return max(area for area, _ in objects), objects
+
+    def __record(
+        self, img: np.ndarray, objects: list, est_size: float, owned: bool
+    ) -> None:
+        """
+        Hands the image to the debug sink if this detection is sampled.
+        Images the detector does not own are copied, only when sampled.
+        """
+        if self.debug_sink is None or not self.debug_sink.should_capture(est_size):
+            return
+        self.debug_sink.submit(img if owned else img.copy(), objects)
+
+    def __detect(
+        self, img: np.ndarray, distance: float, owned: bool = False
+    ) -> tuple[float, float]:
+        area_px, objects = self.__measure(img)
         area_est: float = (area_px * self.CF) / distance
-        return area_est
+        self.__record(img, objects, area_est, owned)
+        return area_est, area_px
+
+    def get_area_px(
+        self,
+        frame: Frame,
+        roi: Optional[tuple[int, int, int, int]] = None,
+        shape: Optional[tuple[int, ...]] = None,
+    ) -> float:
+        """
+        Measures the largest object in a decoded frame.
+
+        Args:
+            frame (np.ndarray | memoryview): BGR or grayscale frame, or a buffer over one.
+            roi (tuple, optional): (x, y, w, h) region to measure, in frame pixels.
+            shape (tuple, optional): (h, w) or (h, w, 3) of a flat buffer.
+
+        Returns:
+            float: The area of the largest object in pixels.
+        """
+        area, _ = self.__measure(self.__as_array(frame, roi, shape))
+        return area
+
+    def largest_object(
+        self,
+        frame: Frame,
+        roi: Optional[tuple[int, int, int, int]] = None,
+        shape: Optional[tuple[int, ...]] = None,
+    ) -> tuple[float, Optional[tuple[int, int, int, int]]]:
+        """
+        Returns the area and (x, y, w, h) bounding box of the largest object,
+        the box is relative to the roi and None if nothing was found.
+        """
+        _, objects = self.__measure(self.__as_array(frame, roi, shape))
+        if not objects:
+            return 0.0, None
+        area, shape_or_box = max(objects, key=lambda obj: obj[0])
+        if isinstance(shape_or_box, tuple):
+            return area, shape_or_box
+        return area, cv2.boundingRect(shape_or_box)
+
+    def detect_size_frame(
+        self,
+        frame: Frame,
+        distance: float,
+        roi: Optional[tuple[int, int, int, int]] = None,
+        shape: Optional[tuple[int, ...]] = None,
+    ) -> float:
+        est_size, _ = self.detect_frame(frame, distance, roi, shape)
+        return est_size
+
+    def detect_frame(
+        self,
+        frame: Frame,
+        distance: float,
+        roi: Optional[tuple[int, int, int, int]] = None,
+        shape: Optional[tuple[int, ...]] = None,
+    ) -> tuple[float, float]:
+        """
+        Returns the estimated size and the pixel area it was estimated from.
+        """
+        return self.__detect(self.__as_array(frame, roi, shape), distance)
+
+    def detect_size(
+        self, image: Union[bytearray, np.ndarray], distance: float
+    ) -> float:
+        if isinstance(image, np.ndarray):
+            return self.detect_size_frame(image, distance)
+        # Load the image
+        image_buf = np.frombuffer(image, dtype=np.uint8)
+        img = cv2.imdecode(image_buf, cv2.IMREAD_COLOR)
+        # NOTE: the decoded image is ours so the debug sink can take it as is
+        est_size, _ = self.__detect(img, distance, owned=True)
+        return est_size
+
+    def __batch_buffers(self, count: int, shape: tuple[int, ...]) -> None:
+        batch_shape = (count, *shape[:2])
+        if self.batch_gray is None or self.batch_gray.shape != batch_shape:
+            self.batch_gray = np.empty(batch_shape, np.uint8)
+            self.batch_thresh = np.empty(batch_shape, np.uint8)
+
+    def __batch_gray(self, frames) -> np.ndarray:
+        """
+        Converts the frames into the preallocated (N, H, W) gray buffer.
+        A stacked (N, H, W, 3) array is converted with a single cvtColor.
+        """
+        count = len(frames)
+        self.__batch_buffers(count, frames[0].shape)
+        gray: np.ndarray = self.batch_gray  # pyright: ignore
+        height, width = gray.shape[1:]
+        if isinstance(frames, np.ndarray) and frames.ndim == 4:
+            cv2.cvtColor(
+                frames.reshape(count * height, width, 3),
+                cv2.COLOR_BGR2GRAY,
+                dst=gray.reshape(count * height, width),
+            )
+            return gray
+        for idx, frame in enumerate(frames):
+            if frame.ndim == 2:
+                gray[idx] = frame
+            else:
+                cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=gray[idx])
+        return gray
+
+    def detect_size_batch(
+        self,
+        frames: Union[np.ndarray, list[np.ndarray]],
+        distances: Union[np.ndarray, list[float]],
+        roi: Optional[tuple[int, int, int, int]] = None,
+    ) -> SizeEstimate:
+        """
+        Estimates the size of one fish from several frames of it.
+
+        Args:
+            frames (np.ndarray | list): Same sized BGR or grayscale frames, or one stacked array.
+            distances (np.ndarray | list): The distance paired with each frame.
+            roi (tuple, optional): (x, y, w, h) region to measure, in frame pixels.
+
+        Returns:
+            SizeEstimate: The median size and its spread over the frames.
+        """
+        if roi:
+            x, y, w, h = roi
+            if isinstance(frames, np.ndarray):
+                frames = frames[:, y : y + h, x : x + w]
+            else:
+                frames = [frame[y : y + h, x : x + w] for frame in frames]
+        gray = self.__batch_gray(frames)
+        thresh: np.ndarray = self.batch_thresh  # pyright: ignore
+        areas = np.zeros(len(gray), np.float64)
+        found = []
+        # NOTE: Otsu and the object search stay per frame, OpenCV has no batched form
+        # of them and running them over the stacked frames measured no faster
+        for idx in range(len(gray)):
+            objects = self.__objects(self.__threshold(gray[idx], thresh[idx]))
+            found.append(objects)
+            if objects:
+                areas[idx] = max(area for area, _ in objects)
+        sizes = areas * self.CF / np.asarray(distances, np.float64)
+        estimate = SizeEstimate(sizes, areas)
+        # INFO: the frame closest to the median stands for the batch in the debug sink
+        idx = int(np.argmin(np.abs(sizes - estimate.median)))
+        self.__record(frames[idx], found[idx], float(sizes[idx]), owned=False)
+        return estimate
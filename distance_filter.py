@@ -0,0 +1,285 @@
+import heapq
+import math
+from abc import ABC, abstractmethod
+from typing import Optional
+
+
+class DistanceFilter(ABC):
+    """
+    Base class of the incremental distance filters.
+    Every filter takes one sample at a time through `update` and keeps
+    a stable value alongside a variance so callers can tell when it settled.
+    """
+
+    value: Optional[float] = None
+    count: int = 0
+
+    @abstractmethod
+    def update(self, distance: float) -> Optional[float]:
+        """
+        Feeds one sample and returns the filtered value,
+        None means the sample was rejected.
+        """
+
+    @abstractmethod
+    def variance(self) -> float: ...
+
+    @abstractmethod
+    def reset(self) -> None: ...
+
+    def std(self) -> float:
+        return math.sqrt(max(self.variance(), 0.0))
+
+    def confidence(self) -> float:
+        """
+        Returns how much the samples agree with the value, 1 means every
+        sample agreed and 0 means the spread is as large as the value.
+        """
+        if self.value is None or self.value == 0:
+            return 0.0
+        return max(0.0, 1.0 - self.std() / abs(self.value))
+
+    def is_settled(self, tolerance: float, min_samples: int = 5) -> bool:
+        """
+        Checks if enough samples were seen and their spread is within `tolerance`.
+        """
+        return self.count >= min_samples and self.std() <= tolerance
+
+
+class RollingMedianFilter(DistanceFilter):
+    """
+    Median of the last `window` samples.
+    Uses two heaps with lazy deletion so each sample costs O(log n),
+    the samples themselves live in a fixed ring buffer.
+    Stale heap entries are dropped once they outnumber the live ones,
+    which keeps memory bounded at an amortized O(1) per sample.
+    """
+
+    def __init__(self, window: int = 9) -> None:
+        self.window = window
+        self.reset()
+
+    def reset(self) -> None:
+        self.ring: list[float] = [0.0] * self.window
+        self.head = 0
+        self.count = 0
+        # NOTE: `low` is a max heap stored negated, `high` is a min heap
+        self.low: list[float] = []
+        self.high: list[float] = []
+        self.low_size = 0
+        self.high_size = 0
+        self.delayed: dict[float, int] = {}
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.value = None
+
+    def __prune(self, heap: list[float], negated: bool) -> None:
+        while heap:
+            top = -heap[0] if negated else heap[0]
+            if not self.delayed.get(top):
+                return
+            self.delayed[top] -= 1
+            heapq.heappop(heap)
+
+    def __rebalance(self) -> None:
+        if self.low_size > self.high_size + 1:
+            heapq.heappush(self.high, -heapq.heappop(self.low))
+            self.low_size -= 1
+            self.high_size += 1
+            self.__prune(self.low, True)
+        elif self.low_size < self.high_size:
+            heapq.heappush(self.low, -heapq.heappop(self.high))
+            self.high_size -= 1
+            self.low_size += 1
+            self.__prune(self.high, False)
+
+    def __insert(self, distance: float) -> None:
+        if not self.low or distance <= -self.low[0]:
+            heapq.heappush(self.low, -distance)
+            self.low_size += 1
+        else:
+            heapq.heappush(self.high, distance)
+            self.high_size += 1
+        self.__rebalance()
+
+    def __erase(self, distance: float) -> None:
+        self.delayed[distance] = self.delayed.get(distance, 0) + 1
+        if distance <= -self.low[0]:
+            self.low_size -= 1
+            if distance == -self.low[0]:
+                self.__prune(self.low, True)
+        else:
+            self.high_size -= 1
+            if self.high and distance == self.high[0]:
+                self.__prune(self.high, False)
+        self.__rebalance()
+
+    def __compact(self) -> None:
+        live = sorted(self.ring[: self.count])
+        self.low_size = (len(live) + 1) // 2
+        self.high_size = len(live) - self.low_size
+        self.low = [-distance for distance in live[: self.low_size]]
+        self.high = live[self.low_size :]
+        heapq.heapify(self.low)
+        self.delayed.clear()
+
+    def median(self) -> Optional[float]:
+        if self.low_size == 0:
+            return None
+        if self.low_size > self.high_size:
+            return -self.low[0]
+        return (-self.low[0] + self.high[0]) / 2
+
+    def update(self, distance: float) -> Optional[float]:
+        if self.count == self.window:
+            oldest = self.ring[self.head]
+            self.__erase(oldest)
+            self.total -= oldest
+            self.total_sq -= oldest * oldest
+        else:
+            self.count += 1
+        self.ring[self.head] = distance
+        self.head = (self.head + 1) % self.window
+        self.total += distance
+        self.total_sq += distance * distance
+        self.__insert(distance)
+        if len(self.low) + len(self.high) > 2 * self.window + 8:
+            self.__compact()
+        self.value = self.median()
+        return self.value
+
+    def variance(self) -> float:
+        if self.count < 2:
+            return 0.0
+        mean = self.total / self.count
+        return (self.total_sq - self.count * mean * mean) / (self.count - 1)
+
+
+class EWMAFilter(DistanceFilter):
+    """
+    Exponentially weighted moving average with its exponentially weighted variance.
+    Each sample costs O(1), a higher `alpha` follows changes faster.
+    """
+
+    def __init__(self, alpha: float = 0.3) -> None:
+        self.alpha = alpha
+        self.reset()
+
+    def reset(self) -> None:
+        self.value = None
+        self.ew_variance = 0.0
+        self.count = 0
+
+    def update(self, distance: float) -> Optional[float]:
+        self.count += 1
+        if self.value is None:
+            self.value = float(distance)
+            return self.value
+        diff = distance - self.value
+        increment = self.alpha * diff
+        self.value += increment
+        self.ew_variance = (1 - self.alpha) * (self.ew_variance + diff * increment)
+        return self.value
+
+    def variance(self) -> float:
+        return self.ew_variance
+
+
+class HampelFilter(DistanceFilter):
+    """
+    Hampel style outlier rejection.
+    A sample is rejected when it is more than `n_sigmas` robust deviations
+    away from the rolling median. The deviation is the median absolute deviation
+    tracked as an exponentially weighted average to keep each sample O(log n).
+    Rejected samples still enter the window, so a real change in distance
+    is accepted once it fills half of the window.
+    """
+
+    # NOTE: scales the MAD to a standard deviation for normal noise
+    MAD_SCALE = 1.4826
+
+    def __init__(
+        self,
+        window: int = 9,
+        n_sigmas: float = 3.0,
+        alpha: float = 0.2,
+        min_deviation: float = 1.0,
+    ) -> None:
+        self.median_filter = RollingMedianFilter(window)
+        self.n_sigmas = n_sigmas
+        self.alpha = alpha
+        # NOTE: the sensor reports whole units, a zero MAD would reject everything
+        self.min_deviation = min_deviation
+        self.reset()
+
+    def reset(self) -> None:
+        self.median_filter.reset()
+        self.mad: Optional[float] = None
+        self.value = None
+        self.count = 0
+        self.rejected = 0
+
+    def update(self, distance: float) -> Optional[float]:
+        median: float = self.median_filter.update(distance)  # pyright: ignore
+        deviation = abs(distance - median)
+        if self.mad is None:
+            self.mad = deviation
+        sigma = self.MAD_SCALE * max(self.mad, self.min_deviation)
+        is_outlier = (
+            self.median_filter.count >= self.median_filter.window // 2
+            and deviation > self.n_sigmas * sigma
+        )
+        # NOTE: outliers do not widen the deviation estimate
+        if not is_outlier:
+            self.mad += self.alpha * (deviation - self.mad)
+        if is_outlier:
+            self.rejected += 1
+            return None
+        self.count += 1
+        self.value = float(distance)
+        return self.value
+
+    def variance(self) -> float:
+        if self.mad is None:
+            return 0.0
+        return (self.MAD_SCALE * self.mad) ** 2
+
+
+class FilterChain(DistanceFilter):
+    """
+    Runs the filters one after another, the value and variance are the
+    last filter's. A sample rejected by any filter stops the chain.
+    """
+
+    def __init__(self, *filters: DistanceFilter) -> None:
+        self.filters = filters
+
+    @property
+    def value(self) -> Optional[float]:  # pyright: ignore
+        return self.filters[-1].value
+
+    @property
+    def count(self) -> int:  # pyright: ignore
+        return self.filters[-1].count
+
+    def reset(self) -> None:
+        for distance_filter in self.filters:
+            distance_filter.reset()
+
+    def update(self, distance: float) -> Optional[float]:
+        value: Optional[float] = distance
+        for distance_filter in self.filters:
+            value = distance_filter.update(value)
+            if value is None:
+                return None
+        return value
+
+    def variance(self) -> float:
+        return self.filters[-1].variance()
+
+
+def default_filter() -> DistanceFilter:
+    """
+    Rejects bad echoes then takes the median of the accepted readings.
+    """
+    return FilterChain(HampelFilter(window=9), RollingMedianFilter(window=7))
@@ -0,0 +1,179 @@
+import threading
+import time
+from typing import Optional
+
+import cv2
+import numpy as np
+
+
+class FrameRing:
+    """
+    Fixed size ring of preallocated frame slots.
+    The grabber decodes straight into the slots so no frame is
+    allocated per capture, readers get the newest slot back.
+    """
+
+    def __init__(self, size: int = 4) -> None:
+        self.size = size
+        self.slots: list[Optional[np.ndarray]] = [None] * size
+        self.timestamps: list[float] = [0.0] * size
+        # NOTE: seq counts every frame ever written, -1 means empty
+        self.seq = -1
+        self.lock = threading.Lock()
+        self.fresh = threading.Condition(self.lock)
+
+    def slot_for_write(self) -> Optional[np.ndarray]:
+        """
+        Returns the slot the next frame will be written into.
+        This is never the newest slot so readers are not overwritten mid-read.
+        """
+        return self.slots[(self.seq + 1) % self.size]
+
+    def commit(self, frame: np.ndarray, timestamp: float) -> None:
+        with self.lock:
+            idx = (self.seq + 1) % self.size
+            self.slots[idx] = frame
+            self.timestamps[idx] = timestamp
+            self.seq += 1
+            self.fresh.notify_all()
+
+    def latest(
+        self, after_seq: int = -1, timeout: float = 1.0
+    ) -> Optional[tuple[int, float, np.ndarray]]:
+        """
+        Returns (seq, timestamp, frame) of the newest frame newer than `after_seq`.
+        The frame is a view into the ring, it stays valid until the grabber
+        wraps around the ring so copy it if you need to hold on to it.
+        """
+        with self.lock:
+            if not self.fresh.wait_for(lambda: self.seq > after_seq, timeout):
+                return None
+            idx = self.seq % self.size
+            return self.seq, self.timestamps[idx], self.slots[idx]  # pyright: ignore
+
+    def is_intact(self, seq: int) -> bool:
+        """
+        Checks that the frame of `seq` has not been overwritten yet, check it
+        after copying a frame out of the ring to know the copy is whole.
+        """
+        # NOTE: the slot of `seq` is written again once the grabber commits seq + size - 1
+        return self.seq - seq < self.size - 1
+
+
+class FrameGrabber(threading.Thread):
+    """
+    Keeps a /dev/videoN device open and continuously grabs raw BGR frames
+    into a FrameRing. This replaces forking fswebcam for every shot.
+    """
+
+    # NOTE: one grabber per device, the device can only be opened once
+    __instances: dict[int, "FrameGrabber"] = {}
+    __instances_lock = threading.Lock()
+
+    def __init__(
+        self,
+        device_idx: int,
+        resolution: str = "1280x720",
+        ring_size: int = 4,
+        pixel_format: Optional[str] = None,
+        fps: float = 0.0,
+    ) -> None:
+        super().__init__(name=f"FrameGrabber-{device_idx}", daemon=True)
+        self.device_idx = device_idx
+        self.width, self.height = [int(x) for x in resolution.split("x")]
+        # NOTE: the mode picked by camera discovery, the driver's default when not given
+        self.pixel_format = pixel_format
+        self.fps = fps
+        self.ring = FrameRing(ring_size)
+        self.capture: Optional[cv2.VideoCapture] = None
+        self.stop_event = threading.Event()
+        self.opened = threading.Event()
+        self.failed = False
+
+    @classmethod
+    def shared(
+        cls,
+        device_idx: int,
+        resolution: str = "1280x720",
+        pixel_format: Optional[str] = None,
+        fps: float = 0.0,
+    ) -> Optional["FrameGrabber"]:
+        """
+        Returns the running grabber for the device, starting it if needed.
+        Returns None if the device could not be opened.
+        """
+        with cls.__instances_lock:
+            grabber = cls.__instances.get(device_idx)
+            if grabber is None or grabber.failed or not grabber.is_alive():
+                grabber = cls(
+                    device_idx, resolution, pixel_format=pixel_format, fps=fps
+                )
+                grabber.start()
+                cls.__instances[device_idx] = grabber
+        grabber.opened.wait(5)
+        if grabber.failed or not grabber.opened.is_set():
+            return None
+        return grabber
+
+    @classmethod
+    def release(cls, device_idx: int) -> None:
+        """
+        Stops the device's grabber if one is running, so the device is closed.
+        """
+        with cls.__instances_lock:
+            grabber = cls.__instances.pop(device_idx, None)
+        if grabber is not None and grabber.is_alive():
+            grabber.stop()
+
+    def __open(self) -> bool:
+        self.capture = cv2.VideoCapture(self.device_idx, cv2.CAP_V4L2)
+        if not self.capture.isOpened():
+            print(f":: [FRAME_GRABBER] failed to open /dev/video{self.device_idx}")
+            return False
+        if self.pixel_format:
+            # NOTE: the format has to be set before the size for the driver to accept both
+            fourcc = cv2.VideoWriter_fourcc(*self.pixel_format)  # pyright: ignore
+            self.capture.set(cv2.CAP_PROP_FOURCC, fourcc)
+        self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        if self.fps:
+            self.capture.set(cv2.CAP_PROP_FPS, self.fps)
+        # INFO: keep the driver queue short so we always get a fresh frame
+        self.capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        print(
+            f":: [FRAME_GRABBER] streaming /dev/video{self.device_idx} at {self.width}x{self.height}"
+        )
+        return True
+
+    def run(self) -> None:
+        if not self.__open():
+            self.failed = True
+            self.opened.set()
+            return
+        self.opened.set()
+        capture: cv2.VideoCapture = self.capture  # pyright: ignore
+        try:
+            while not self.stop_event.is_set():
+                slot = self.ring.slot_for_write()
+                # NOTE: passing the slot makes OpenCV decode in place
+                # when the shape matches, otherwise it allocates once
+                ok, frame = capture.read(slot) if slot is not None else capture.read()
+                if not ok or frame is None:
+                    print(":: [FRAME_GRABBER] failed to read frame")
+                    self.failed = True
+                    break
+                self.ring.commit(frame, time.monotonic())
+        finally:
+            capture.release()
+
+    def latest(
+        self, after_seq: int = -1, timeout: float = 1.0
+    ) -> Optional[tuple[int, float, np.ndarray]]:
+        return self.ring.latest(after_seq, timeout)
+
+    def is_intact(self, seq: int) -> bool:
+        return self.ring.is_intact(seq)
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.join()
@@ -0,0 +1,132 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Optional
+
+
+class GPIOBackend(ABC):
+    """
+    The GPIO calls the Controller relies on, pins, modes and states are the raw ints.
+    """
+
+    name = "base"
+
+    def init(self) -> None:
+        pass
+
+    @abstractmethod
+    def setcfg(self, pin: int, mode: int) -> None: ...
+
+    @abstractmethod
+    def getcfg(self, pin: int) -> int: ...
+
+    @abstractmethod
+    def output(self, pin: int, value: int) -> None: ...
+
+    @abstractmethod
+    def input(self, pin: int) -> int: ...
+
+
+class PyA20Backend(GPIOBackend):
+    """
+    The real pins of the board through pyA20.
+    """
+
+    name = "pyA20"
+
+    def __init__(self) -> None:
+        from pyA20.gpio import gpio  # pyright: ignore
+
+        self.gpio = gpio
+
+    def init(self) -> None:
+        self.gpio.init()
+
+    def setcfg(self, pin: int, mode: int) -> None:
+        self.gpio.setcfg(pin, mode)
+
+    def getcfg(self, pin: int) -> int:
+        return self.gpio.getcfg(pin)
+
+    def output(self, pin: int, value: int) -> None:
+        self.gpio.output(pin, value)
+
+    def input(self, pin: int) -> int:
+        return self.gpio.input(pin)
+
+
+class SimulatedBackend(GPIOBackend):
+    """
+    Pins kept in memory so the controller can run off-device.
+    Modes and states are remembered, every change of an output is logged
+    with a timestamp, and each write can be delayed to model a slow bus.
+    """
+
+    name = "simulated"
+
+    def __init__(
+        self,
+        write_latency: float = 0.0,
+        read_latency: float = 0.0,
+        max_edges: int = 10_000,
+    ) -> None:
+        """
+        Args:
+            write_latency (float): Seconds each `output` takes.
+            read_latency (float): Seconds each `input` takes.
+            max_edges (int): Edges kept in the log, the oldest are dropped.
+        """
+        self.write_latency = write_latency
+        self.read_latency = read_latency
+        self.modes: dict[int, int] = {}
+        self.states: dict[int, int] = {}
+        # INFO: (perf_counter timestamp, pin, new state)
+        self.edges: deque[tuple[float, int, int]] = deque(maxlen=max_edges)
+        self.writes = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def __delay(seconds: float) -> None:
+        if seconds <= 0:
+            return
+        # NOTE: sleep is too coarse below a millisecond, spin for short delays
+        if seconds < 0.001:
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                pass
+            return
+        time.sleep(seconds)
+
+    def setcfg(self, pin: int, mode: int) -> None:
+        with self.lock:
+            self.modes[pin] = mode
+            self.states.setdefault(pin, 0)
+
+    def getcfg(self, pin: int) -> int:
+        with self.lock:
+            return self.modes.get(pin, 0)
+
+    def output(self, pin: int, value: int) -> None:
+        self.__delay(self.write_latency)
+        with self.lock:
+            self.writes += 1
+            if self.states.get(pin, 0) != value:
+                self.edges.append((time.perf_counter(), pin, value))
+            self.states[pin] = value
+
+    def input(self, pin: int) -> int:
+        self.__delay(self.read_latency)
+        with self.lock:
+            return self.states.get(pin, 0)
+
+    def edge_log(self, pin: Optional[int] = None) -> list[tuple[float, int, int]]:
+        """
+        Returns the logged edges, only the ones of `pin` if it is given.
+        """
+        with self.lock:
+            return [edge for edge in self.edges if pin is None or edge[1] == pin]
+
+    def clear_edges(self) -> None:
+        with self.lock:
+            self.edges.clear()
@@ -0,0 +1,191 @@
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from datetime import datetime
+from typing import Optional
+
+from codec import MeasurementRecord
+
+
+class MeasurementHistory:
+    """
+    Local log of every sized fish, kept in SQLite in WAL mode.
+    Records are queued without blocking and written in batches by a worker
+    thread, so logging never delays the gate decision. The time and size
+    bucket indexes keep the summary queries cheap on the controller.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS measurements (
+            id INTEGER PRIMARY KEY,
+            timestamp REAL NOT NULL,
+            distance REAL NOT NULL,
+            area_px INTEGER NOT NULL,
+            est_size REAL NOT NULL,
+            size_bucket INTEGER NOT NULL,
+            is_big INTEGER NOT NULL,
+            device_id INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS measurements_time ON measurements (timestamp);
+        CREATE INDEX IF NOT EXISTS measurements_bucket_time
+            ON measurements (size_bucket, timestamp);
+    """
+
+    # NOTE: a batch is written once it is this old or this big, whichever comes first
+    flush_interval: float = 1.0
+    batch_size: int = 64
+    queue_size: int = 1024
+
+    def __init__(self, path: str = "history.db", bucket_size: float = 5.0) -> None:
+        """
+        Args:
+            path (str): The SQLite database, created if missing.
+            bucket_size (float): Width of the size buckets used by `histogram`, in cm.
+        """
+        self.path = path
+        self.bucket_size = bucket_size
+        self.queue: queue.Queue[tuple[MeasurementRecord, bool]] = queue.Queue(
+            maxsize=self.queue_size
+        )
+        self.dropped = 0
+        self.written = 0
+        # NOTE: a connection used as a context manager only commits, closing() closes it
+        with closing(self.__connect()) as db:
+            db.executescript(self.SCHEMA)
+        # NOTE: queries run on the caller's thread, WAL lets them read while the worker writes
+        self.reader = self.__connect(check_same_thread=False)
+        self.reader_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.worker = threading.Thread(
+            target=self.__run, name="MeasurementHistory", daemon=True
+        )
+        self.worker.start()
+
+    def __connect(self, check_same_thread: bool = True) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, check_same_thread=check_same_thread)
+        db.execute("PRAGMA journal_mode=WAL")
+        # NOTE: WAL keeps the database consistent on a power cut without a sync per commit
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def bucket(self, est_size: float) -> int:
+        return int(est_size // self.bucket_size)
+
+    def record(self, record: MeasurementRecord, is_big: bool) -> bool:
+        """
+        Queues the fish and the gate decision made for it without blocking.
+        """
+        try:
+            self.queue.put_nowait((record, is_big))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def __collect(self) -> list[tuple[MeasurementRecord, bool]]:
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def __write(
+        self, db: sqlite3.Connection, batch: list[tuple[MeasurementRecord, bool]]
+    ) -> None:
+        rows = [
+            (
+                record.timestamp,
+                record.distance,
+                record.area_px,
+                record.est_size,
+                self.bucket(record.est_size),
+                int(is_big),
+                record.device_id,
+            )
+            for record, is_big in batch
+        ]
+        # INFO: one transaction per batch instead of one per fish
+        with db:
+            db.executemany(
+                "INSERT INTO measurements "
+                "(timestamp, distance, area_px, est_size, size_bucket, is_big, device_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        self.written += len(rows)
+
+    def __run(self) -> None:
+        db = self.__connect()
+        while not self.stop_event.is_set() or not self.queue.empty():
+            batch = self.__collect()
+            if not batch:
+                continue
+            try:
+                self.__write(db, batch)
+            except sqlite3.Error as e:
+                print(f":: [HISTORY] failed to write {len(batch)} measurements: {e}")
+                self.dropped += len(batch)
+        db.close()
+
+    def __query(self, sql: str, params: tuple) -> list:
+        with self.reader_lock:
+            return self.reader.execute(sql, params).fetchall()
+
+    def histogram(
+        self, since: float, until: Optional[float] = None
+    ) -> dict[float, int]:
+        """
+        Returns the fish count per size bucket, keyed by the bucket's lower bound in cm.
+        """
+        until = until if until is not None else time.time()
+        rows = self.__query(
+            "SELECT size_bucket, COUNT(*) FROM measurements "
+            "WHERE timestamp >= ? AND timestamp < ? "
+            "GROUP BY size_bucket ORDER BY size_bucket",
+            (since, until),
+        )
+        return {bucket * self.bucket_size: count for bucket, count in rows}
+
+    def count(
+        self,
+        since: float,
+        until: Optional[float] = None,
+        is_big: Optional[bool] = None,
+    ) -> int:
+        """
+        Returns how many fish were sized in the time range, only big or small ones if `is_big` is set.
+        """
+        until = until if until is not None else time.time()
+        sql = "SELECT COUNT(*) FROM measurements WHERE timestamp >= ? AND timestamp < ?"
+        params: tuple = (since, until)
+        if is_big is not None:
+            sql += " AND is_big = ?"
+            params += (int(is_big),)
+        return self.__query(sql, params)[0][0]
+
+    def last_hour_histogram(self) -> dict[float, int]:
+        return self.histogram(time.time() - 3600)
+
+    def big_fish_today(self) -> int:
+        midnight = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        return self.count(midnight.timestamp(), is_big=True)
+
+    def stop(self) -> None:
+        """
+        Writes whatever is still queued and closes the database.
+        """
+        self.stop_event.set()
+        self.worker.join()
+        with self.reader_lock:
+            self.reader.close()
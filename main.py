@@ -1,54 +1,164 @@
-from time import sleep
-
-from calibrator import Calibrator
-from config_handler import ConfigHandler
-from connector import CONFIGS, Connector
-from controller import GPIO_MAPPING as port
-from controller import PORT_MODE as mode
-from controller import PORT_STATE as state
-from controller import Controller
-from detector import Detector
-from reader import Camera, UltrasonicSensor
+import time
+
+# NOTE: taken before anything else is imported so the imports show up in the startup report
+STARTED = time.perf_counter()
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from startup import StartupTimer
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="FisheryNet sorting controller")
+    parser.add_argument(
+        "--skip-blink", action="store_true", help="skip the gate blink self-test"
+    )
+    parser.add_argument(
+        "--skip-detection-test",
+        action="store_true",
+        help="skip the capture and detection self-test",
+    )
+    parser.add_argument(
+        "--chute",
+        action="append",
+        default=[],
+        metavar="DEVICE_IDX:SERIAL_PORT[:GATE_PIN]",
+        help="a chute to sort in its own processes, give it once per chute",
+    )
+    args = parser.parse_args()
+    args.chutes = []
+    if args.chute:
+        # NOTE: only imported with chutes, it pulls in numpy
+        from multi_chute import ChuteConfig
+
+        try:
+            args.chutes = [ChuteConfig.parse(spec) for spec in args.chute]
+        except ValueError as e:
+            parser.error(str(e))
+    return args
+
+
+def open_camera():
+    from frame_grabber import FrameGrabber
+    from reader import Camera
+
+    return FrameGrabber.shared(Camera().device_idx)
+
+
+def open_sensor():
+    from threaded_reader import SensorReaderThread
+
+    return SensorReaderThread.shared("/dev/ttyUSB0", 115_200)
+
+
+def connect_broker(timeout: float = 5.0):
+    from mqtt_bus import MQTTBus
+
+    bus = MQTTBus.shared()
+    bus.start()
+    # NOTE: sorting does not need the broker, a late connection is made in the background
+    return bus if bus.connected.wait(timeout) else None
+
+
+def detection_test() -> None:
+    from acquisition import AcquisitionCoordinator
+    from detector import Detector
+    from reader import Camera, UltrasonicSensor
+
+    # INFO: the distance and the frame are acquired concurrently
+    acquisition = AcquisitionCoordinator(
+        Camera(), UltrasonicSensor("/dev/ttyUSB0", 115_200)
+    )
+    measurement = acquisition.acquire()
+    print(f":: [DISTANCE] : {measurement.distance}")
+
+    detector = Detector(1.5)
+    est_size = detector.detect_size(measurement.frame, measurement.distance)
+    print(f":: [DETECTOR] Estimated Size: {est_size}")
+    latency_ms = (time.monotonic() - measurement.frame_ts) * 1000
+    print(f":: [LATENCY] capture-to-detection: {latency_ms:.1f} ms")
+
 
 if __name__ == "__main__":
-    controller = Controller()
-    controller.check_pins([port.GATE_TRIGGER])
+    args = parse_args()
+    timer = StartupTimer(STARTED)
+
+    with timer.step("controller"):
+        from actuator import GateActuator
+        from controller import GPIO_MAPPING as port
+        from controller import PORT_STATE as state
+        from controller import Controller
+
+        controller = Controller()
+        controller.check_pins([port.GATE_TRIGGER])
+        # INFO: the gate pins are resolved once, pulses run on the actuator's thread
+        actuator = GateActuator(controller)
+        actuator.write(port.GATE_TRIGGER, state.LOW)
+        # controller.toggle_pin(port.EXTRA_1,state.LOW);
+        # controller.toggle_pin(port.EXTRA_2,state.LOW);
 
-    if controller.prod:
+    blink_test = None
+    if controller.prod and not args.skip_blink:
         print(f":: [BLINK_TEST] performing a blink test...")
-        for x in range(5):
-            controller.toggle_pin(
-                port.GATE_TRIGGER, state.HIGH if x % 2 == 0 else state.LOW
-            )
-            # controller.toggle_pin(port.EXTRA_1,state.HIGH if x%2==0 else state.LOW);
-            # controller.toggle_pin(port.EXTRA_2,state.HIGH if x%2==0 else state.LOW);
-            sleep(1)
-
-    controller.toggle_pin(port.GATE_TRIGGER, state.LOW)
-    # controller.toggle_pin(port.EXTRA_1,state.LOW);
-    # controller.toggle_pin(port.EXTRA_2,state.LOW);
+        # NOTE: the blink runs on the actuator's thread while the rest starts up,
+        # sorting does not start before it ended LOW
+        blink = GateActuator.blink_schedule(5, 1.0)
+        blink_test = actuator.schedule(port.GATE_TRIGGER, blink)
+        # actuator.schedule(port.EXTRA_1, blink);
+        # actuator.schedule(port.EXTRA_2, blink);
 
     gate_trigger_state = controller.read_pin(port.GATE_TRIGGER)
     print(f":: [GATE_TRIGGER] : {gate_trigger_state}")
 
-    reader = UltrasonicSensor("/dev/ttyUSB0", 115_200)
-    reader.read()
-    distance = reader.get_reading()
-    print(f":: [DISTANCE] : {distance}")
+    # INFO: the broker, the camera and the serial port are opened at the same time
+    pool = ThreadPoolExecutor(3, thread_name_prefix="startup")
+    broker = pool.submit(timer.timed, "broker", connect_broker)
+    streams = []
+    # NOTE: with chutes every chute's processes open their own devices, the
+    # sort streams of this process would only hold devices open
+    if not args.chutes:
+        streams = [
+            ("camera", pool.submit(timer.timed, "camera", open_camera)),
+            ("serial", pool.submit(timer.timed, "serial", open_sensor)),
+        ]
 
-    camera = Camera()
-    camera.read()
-    image = camera.get_reading()
+    with timer.step("connector"):
+        from config_handler import ConfigHandler
+        from connector import Connector
 
-    detector = Detector(1.5)
-    # NOTE: we know that image is indeed a bytearray
-    # we will make pyright shut up
-    # This issue with types kinda tells me that I should do some refactoring
-    est_size = detector.detect_size(image, float(distance))  # pyright: ignore
-    print(f":: [DETECTOR] Estimated Size: {est_size}")
-    config_handler = ConfigHandler(controller)
-    connector = Connector(controller, config_handler)  # pyright: ignore shut up pyright
-    connector.calibrator = Calibrator()
+        config_handler = ConfigHandler(controller)
+        connector = Connector(controller, config_handler)  # pyright: ignore
+        connector.actuator = actuator
+        connector.gate_self_test = blink_test
+        connector.chutes = args.chutes
+
+    with timer.step("calibrator"):
+        from calibrator import Calibrator
+
+        connector.calibrator = Calibrator(config_handler)
+
+    conflicts = connector.chute_conflicts()
+    if conflicts:
+        for conflict in conflicts:
+            print(f":: [STARTUP] {conflict}")
+        raise SystemExit(2)
+
+    for name, future in streams:
+        try:
+            if future.result() is None:
+                print(f":: [STARTUP] {name} is not available yet")
+        except Exception as e:
+            print(f":: [STARTUP] {name} failed: {e}")
+    # NOTE: sorting does not wait for the broker, it keeps connecting in the background
+    if not broker.done():
+        print(":: [STARTUP] broker is still connecting in the background")
+    pool.shutdown(wait=False)
+
+    if not args.skip_detection_test and not args.chutes:
+        timer.timed("detection test", detection_test)
+
+    print(timer.report())
     # min_fish_size = connector.get_config(CONFIGS.MIN_FISH_SIZE);
     # print(f":: [CONFIG] Min Fish Size: {min_fish_size} we made it to main")
     connector.start()
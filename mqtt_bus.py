@@ -0,0 +1,121 @@
+import threading
+from typing import Callable, Optional
+
+import paho.mqtt.client as mqtt
+
+
+class MQTTBus:
+    """
+    Owns the single MQTT connection of the controller.
+    Connector, ConfigHandler and Reporter register a handler per topic and
+    publish through it, so a board only keeps one socket, one keepalive and
+    one network thread to the broker.
+    """
+
+    broker = "mqtt.eclipseprojects.io"
+    port = 1883
+    keepalive = 60
+
+    __instance: Optional["MQTTBus"] = None
+    __instance_lock = threading.Lock()
+
+    def __init__(self) -> None:
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)  # pyright: ignore
+        self.client.on_connect = self.__on_connect
+        self.client.on_message = self.__on_message
+        self.client.on_disconnect = self.__on_disconnect
+        # INFO: topic -> (qos, handlers) every handler gets the payload
+        self.handlers: dict[str, tuple[int, list[Callable[[bytes], None]]]] = {}
+        self.lock = threading.Lock()
+        self.connected = threading.Event()
+        self.started = False
+        # NOTE: the connection is made by the network thread once started,
+        # so an unreachable broker never blocks or breaks the startup
+        self.client.connect_async(self.broker, self.port, self.keepalive)
+
+    @classmethod
+    def shared(cls) -> "MQTTBus":
+        """
+        Returns the connection of this process, it connects once `start` is called.
+        """
+        with cls.__instance_lock:
+            if cls.__instance is None:
+                cls.__instance = cls()
+            return cls.__instance
+
+    def __on_connect(self, client, userdata, flags, reason_code, properties) -> None:
+        print(f":: [MQTT_BUS] Connected with result code {reason_code}")
+        with self.lock:
+            subscriptions = [(topic, qos) for topic, (qos, _) in self.handlers.items()]
+            # NOTE: set with the snapshot taken, a topic registered from now on
+            # subscribes itself and every earlier one is in the snapshot
+            self.connected.set()
+        # NOTE: subscriptions are lost on reconnect, so they are all sent again
+        if subscriptions:
+            print(
+                f":: [MQTT_BUS] Subscribing to {[topic for topic, _ in subscriptions]}"
+            )
+            self.client.subscribe(subscriptions)
+
+    def __on_disconnect(
+        self, client, userdata, disconnect_flags, reason_code, properties
+    ) -> None:
+        print(f":: [MQTT_BUS] Disconnected with result code {reason_code}")
+        self.connected.clear()
+
+    def __on_message(self, client, userdata, msg) -> None:
+        with self.lock:
+            entry = self.handlers.get(msg.topic)
+            handlers = list(entry[1]) if entry else []
+        if not handlers:
+            print(
+                f":: [MQTT_BUS] handler for topic {msg.topic} is not yet implemented."
+            )
+            return
+        for handler in handlers:
+            try:
+                handler(msg.payload)
+            except Exception as e:
+                # NOTE: one failing handler must not take the network thread down
+                print(f":: [MQTT_BUS] handler for {msg.topic} failed: {e}")
+
+    def register(
+        self, topic: str, handler: Callable[[bytes], None], qos: int = 0
+    ) -> None:
+        """
+        Calls `handler` with the payload of every message on `topic`.
+        """
+        with self.lock:
+            entry = self.handlers.get(topic)
+            is_new = entry is None
+            if entry is None:
+                entry = (qos, [])
+                self.handlers[topic] = entry
+            entry[1].append(handler)
+            subscribe = is_new and self.connected.is_set()
+        if subscribe:
+            self.client.subscribe(topic, qos)
+
+    def publish(self, topic: str, payload, qos: int = 0) -> mqtt.MQTTMessageInfo:
+        return self.client.publish(topic, payload, qos)
+
+    def start(self) -> None:
+        """
+        Starts the network thread, calling it again does nothing.
+        """
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        self.client.loop_start()
+
+    def stop(self) -> None:
+        """
+        Disconnects gracefully and waits for the network thread to finish.
+        """
+        with self.lock:
+            if not self.started:
+                return
+            self.started = False
+        self.client.disconnect()
+        self.client.loop_stop()
@@ -0,0 +1,346 @@
+import multiprocessing as mp
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Any, Callable, Optional
+
+import numpy as np
+
+from actuator import GateActuator
+from codec import MeasurementRecord
+from controller import GPIO_MAPPING
+
+# NOTE: spawn so the workers never inherit the MQTT and sensor threads of the parent
+CONTEXT = mp.get_context("spawn")
+
+
+class ChuteConfig:
+    """
+    The devices of one chute, each chute gets its own capture and detector process.
+    """
+
+    def __init__(
+        self,
+        device_idx: int,
+        serial_port: str,
+        gate_pin: GPIO_MAPPING = GPIO_MAPPING.GATE_TRIGGER,
+        resolution: str = "1280x720",
+        baud_rate: int = 115_200,
+    ) -> None:
+        self.device_idx = device_idx
+        self.serial_port = serial_port
+        self.gate_pin = gate_pin
+        self.resolution = resolution
+        self.baud_rate = baud_rate
+
+    @classmethod
+    def parse(cls, spec: str) -> "ChuteConfig":
+        """
+        Parses `DEVICE_IDX:SERIAL_PORT[:GATE_PIN]`, e.g. `2:/dev/ttyUSB1:EXTRA_1`.
+        """
+        parts = spec.split(":")
+        if len(parts) not in (2, 3) or not parts[0].isdigit():
+            raise ValueError(f"expected DEVICE_IDX:SERIAL_PORT[:GATE_PIN], got {spec}")
+        gate_pin = GPIO_MAPPING.GATE_TRIGGER
+        if len(parts) == 3:
+            if not hasattr(GPIO_MAPPING, parts[2]):
+                raise ValueError(f"unknown gate pin {parts[2]}")
+            gate_pin = getattr(GPIO_MAPPING, parts[2])
+        return cls(int(parts[0]), parts[1], gate_pin)
+
+    def shape(self) -> tuple[int, int, int]:
+        width, height = [int(x) for x in self.resolution.split("x")]
+        return height, width, 3
+
+
+class SharedFrameSlots:
+    """
+    A fixed number of frame sized slots in shared memory.
+    The capture process writes a fish's frame into a free slot and only
+    sends the slot index, the detector process reads the frame in place.
+    """
+
+    def __init__(
+        self,
+        shape: tuple[int, ...],
+        count: int,
+        name: Optional[str] = None,
+    ) -> None:
+        """
+        Args:
+            shape (tuple): Shape of one uint8 frame.
+            count (int): Number of slots.
+            name (str, optional): Attaches to existing slots instead of creating them.
+        """
+        self.shape = shape
+        self.count = count
+        self.owner = name is None
+        size = int(np.prod(shape)) * count
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size)
+        self.name = self.shm.name
+        self.frames = np.ndarray((count, *shape), np.uint8, buffer=self.shm.buf)
+
+    def slot(self, index: int) -> np.ndarray:
+        return self.frames[index]
+
+    def close(self) -> None:
+        # NOTE: the array holds an export of the buffer, drop it before closing
+        del self.frames
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def capture_worker(
+    chute_idx: int,
+    chute: ChuteConfig,
+    slots_name: str,
+    slot_count: int,
+    free_slots,
+    fish_queue,
+    stop_event,
+    max_skew: float = 0.5,
+) -> None:
+    """
+    Streams the chute's camera and sensor, and hands every fish that enters
+    the chute to the detector through a shared memory slot.
+    """
+    import cv2
+
+    from frame_grabber import FrameGrabber
+    from presence import PresenceTrigger
+    from threaded_reader import SensorReaderThread
+
+    grabber = FrameGrabber.shared(chute.device_idx, chute.resolution)
+    if grabber is None:
+        print(f":: [CHUTE_{chute_idx}] failed to open /dev/video{chute.device_idx}")
+        return
+    sensor = SensorReaderThread.shared(chute.serial_port, chute.baud_rate)
+    slots = SharedFrameSlots(chute.shape(), slot_count, slots_name)
+    trigger = PresenceTrigger()
+    height, width, _ = chute.shape()
+    seq = -1
+    dropped = 0
+    torn = 0
+    while not stop_event.is_set():
+        latest = grabber.latest(seq, timeout=0.5)
+        if latest is None:
+            continue
+        seq, frame_ts, frame = latest
+        if not trigger.update(frame):
+            continue
+        try:
+            index = free_slots.get_nowait()
+        except queue.Empty:
+            # NOTE: the detector is behind, a fish it can not take is skipped
+            dropped += 1
+            print(f":: [CHUTE_{chute_idx}] detector busy, skipped {dropped} fish")
+            continue
+        if frame.shape == slots.shape:
+            np.copyto(slots.slot(index), frame)
+        else:
+            cv2.resize(frame, (width, height), dst=slots.slot(index))
+        # NOTE: the copy only matches frame_ts if the grabber did not reuse the slot meanwhile
+        if not grabber.is_intact(seq):
+            free_slots.put(index)
+            torn += 1
+            print(
+                f":: [CHUTE_{chute_idx}] frame overwritten before it was copied, {torn} so far"
+            )
+            continue
+        # NOTE: paired by timestamp like the single chute pipeline
+        closest = sensor.filtered_at(frame_ts, max_skew)
+        distance = closest[1] if closest else sensor.get_latest_reading()
+        confidence, _ = sensor.get_confidence()
+        fish_queue.put((index, frame_ts, distance or 0.0, confidence))
+    slots.close()
+    grabber.stop()
+    sensor.stop()
+
+
+def detect_worker(
+    chute_idx: int,
+    shape: tuple[int, ...],
+    slots_name: str,
+    slot_count: int,
+    free_slots,
+    fish_queue,
+    results,
+    calibration_factor,
+    stop_event,
+) -> None:
+    """
+    Sizes the fish of one chute reading their frames from shared memory,
+    only the size and the area go back to the parent.
+    """
+    from detector import Detector
+
+    slots = SharedFrameSlots(shape, slot_count, slots_name)
+    detector = Detector()
+    while not stop_event.is_set():
+        try:
+            index, frame_ts, distance, confidence = fish_queue.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        try:
+            # NOTE: 0 until the parent has a calibration factor cached
+            if not distance or calibration_factor.value <= 0:
+                continue
+            detector.CF = calibration_factor.value
+            est_size, area_px = detector.detect_frame(slots.slot(index), distance)
+            results.put((chute_idx, est_size, area_px, distance, confidence, frame_ts))
+        except Exception as e:
+            print(f":: [CHUTE_{chute_idx}] detection failed: {e}")
+        finally:
+            # NOTE: the frame is no longer needed, the slot can be reused
+            free_slots.put(index)
+    slots.close()
+
+
+class MultiChuteSorter:
+    """
+    Sorts several chutes at once across the CPU cores.
+    Every chute has a capture process (camera, sensor, presence check) and
+    a detector process sharing its frames through SharedFrameSlots. The
+    sizes fan in to this process, which decides, fires the chute's gate
+    and reports, so there is still one MQTT connection and one GPIO owner.
+    """
+
+    # NOTE: fish frames a chute can have waiting for its detector
+    slot_count: int = 4
+    # NOTE: how often the calibration factor is pushed to the detectors, in seconds
+    config_interval: float = 5.0
+
+    def __init__(
+        self,
+        chutes: list[ChuteConfig],
+        actuator: GateActuator,
+        get_config: Callable[[str], Any],
+        on_fish: Callable[[MeasurementRecord, bool], None],
+        open_ms: float = 300,
+    ) -> None:
+        self.chutes = chutes
+        self.actuator = actuator
+        self.get_config = get_config
+        self.on_fish = on_fish
+        self.open_ms = open_ms
+        self.results = CONTEXT.Queue()
+        self.calibration_factor = CONTEXT.Value("d", 0.0)
+        self.stop_event = CONTEXT.Event()
+        self.processes: list = []
+        self.slots: list[SharedFrameSlots] = []
+        # NOTE: the parent keeps the queues alive until the workers have attached to them
+        self.queues: list = []
+        self.fish_counts = [0] * len(chutes)
+        self.started = 0.0
+        self.collector: Optional[threading.Thread] = None
+
+    def __push_config(self) -> None:
+        calibration_factor = self.get_config("calibration_factor")
+        # NOTE: the config is read without waiting, until it is cached the detectors skip fish
+        if calibration_factor is not None:
+            self.calibration_factor.value = calibration_factor
+
+    def start(self) -> None:
+        self.stop_event.clear()
+        self.__push_config()
+        self.started = time.monotonic()
+        for chute_idx, chute in enumerate(self.chutes):
+            slots = SharedFrameSlots(chute.shape(), self.slot_count)
+            self.slots.append(slots)
+            free_slots = CONTEXT.Queue()
+            for index in range(self.slot_count):
+                free_slots.put(index)
+            fish_queue = CONTEXT.Queue()
+            self.queues += [free_slots, fish_queue]
+            self.processes.append(
+                CONTEXT.Process(
+                    target=capture_worker,
+                    args=(
+                        chute_idx,
+                        chute,
+                        slots.name,
+                        self.slot_count,
+                        free_slots,
+                        fish_queue,
+                        self.stop_event,
+                    ),
+                    name=f"Chute-{chute_idx}-capture",
+                    daemon=True,
+                )
+            )
+            self.processes.append(
+                CONTEXT.Process(
+                    target=detect_worker,
+                    args=(
+                        chute_idx,
+                        chute.shape(),
+                        slots.name,
+                        self.slot_count,
+                        free_slots,
+                        fish_queue,
+                        self.results,
+                        self.calibration_factor,
+                        self.stop_event,
+                    ),
+                    name=f"Chute-{chute_idx}-detect",
+                    daemon=True,
+                )
+            )
+        for process in self.processes:
+            process.start()
+        self.collector = threading.Thread(
+            target=self.__collect, name="MultiChuteSorter", daemon=True
+        )
+        self.collector.start()
+        print(f":: [MULTI_CHUTE] sorting {len(self.chutes)} chutes")
+
+    def __collect(self) -> None:
+        last_config = time.monotonic()
+        while not self.stop_event.is_set():
+            if time.monotonic() - last_config >= self.config_interval:
+                self.__push_config()
+                last_config = time.monotonic()
+            try:
+                chute_idx, est_size, area_px, distance, confidence, _ = (
+                    self.results.get(timeout=0.5)
+                )
+            except queue.Empty:
+                continue
+            min_fish_size = self.get_config("min_fish_size")
+            # NOTE: without a cached minimum size the gate stays closed
+            is_big = min_fish_size is not None and est_size >= min_fish_size
+            if is_big:
+                self.actuator.pulse(self.chutes[chute_idx].gate_pin, self.open_ms)
+            self.fish_counts[chute_idx] += 1
+            record = MeasurementRecord(
+                est_size,
+                distance=distance,
+                confidence=confidence,
+                area_px=int(area_px),
+                device_id=chute_idx,
+            )
+            self.on_fish(record, is_big)
+
+    def report(self) -> str:
+        elapsed = time.monotonic() - self.started
+        return " ".join(
+            f"chute {chute_idx}: {count} fish ({count / elapsed * 60 if elapsed > 0 else 0:.1f}/min)"
+            for chute_idx, count in enumerate(self.fish_counts)
+        )
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        if self.collector:
+            self.collector.join()
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        for slots in self.slots:
+            slots.close()
+        self.processes = []
+        self.slots = []
+        self.queues = []
+        print(f":: [MULTI_CHUTE] stopped, {self.report()}")
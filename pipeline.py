@@ -0,0 +1,385 @@
+import threading
+import time
+from collections import deque
+from enum import Enum
+from typing import Any, Callable, Optional
+
+import numpy as np
+
+from actuator import GateActuator
+from codec import MeasurementRecord
+from controller import GPIO_MAPPING
+from detector import Detector
+from frame_grabber import FrameGrabber
+from presence import PresenceTrigger
+from threaded_reader import SensorReaderThread
+
+
+class DROP_POLICY(Enum):
+    # INFO: the producer waits for room
+    BLOCK = "block"
+    # INFO: the incoming item is discarded
+    DROP_NEWEST = "drop_newest"
+    # INFO: the oldest queued item is discarded, consumers always get the newest
+    LATEST_WINS = "latest_wins"
+
+
+class StageQueue:
+    """
+    Bounded queue between two stages, what happens when it is full depends on its policy.
+    """
+
+    def __init__(self, size: int = 1, policy: DROP_POLICY = DROP_POLICY.BLOCK) -> None:
+        self.size = size
+        self.policy = policy
+        self.items: deque = deque()
+        self.cond = threading.Condition()
+        self.dropped = 0
+        self.peak = 0
+
+    def put(self, item: Any, stop_event: threading.Event) -> bool:
+        """
+        Returns False when the item was dropped or the pipeline stopped while waiting.
+        """
+        with self.cond:
+            while len(self.items) >= self.size:
+                if self.policy == DROP_POLICY.DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                if self.policy == DROP_POLICY.LATEST_WINS:
+                    self.items.popleft()
+                    self.dropped += 1
+                    continue
+                if stop_event.is_set():
+                    return False
+                self.cond.wait(0.5)
+            self.items.append(item)
+            self.peak = max(self.peak, len(self.items))
+            self.cond.notify_all()
+            return True
+
+    def get(self, timeout: float) -> tuple[bool, Any]:
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.items, timeout):
+                return False, None
+            item = self.items.popleft()
+            self.cond.notify_all()
+            return True, item
+
+    def occupancy(self) -> int:
+        with self.cond:
+            return len(self.items)
+
+
+class StageStats:
+    """
+    Items a stage handled and the share of the time it was busy with them.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.started = time.monotonic()
+            self.processed = 0
+            self.emitted = 0
+            self.busy_total = 0.0
+
+    def record(self, work_started: float, emitted: bool) -> None:
+        """
+        Counts one item whose work began at `work_started` (time.monotonic) and just ended.
+        """
+        with self.lock:
+            # NOTE: an item still in work when the stats were reset only counts
+            # the part after the reset, busy never exceeds the time elapsed
+            busy = time.monotonic() - max(work_started, self.started)
+            self.processed += 1
+            self.emitted += int(emitted)
+            self.busy_total += max(busy, 0.0)
+
+    def rate(self) -> float:
+        with self.lock:
+            elapsed = time.monotonic() - self.started
+            return self.processed / elapsed if elapsed > 0 else 0.0
+
+    def utilization(self) -> float:
+        with self.lock:
+            elapsed = time.monotonic() - self.started
+            return self.busy_total / elapsed if elapsed > 0 else 0.0
+
+
+class Stage(threading.Thread):
+    """
+    Runs `work` on every item of its inbox and passes what it returns on,
+    None means the item stops here. A stage without an inbox is a source,
+    its `wait` blocks for the next item and returns None when none came.
+    Only `work` counts as busy, the time spent waiting for an item does not.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        work: Callable[[Any], Any],
+        inbox: Optional[StageQueue],
+        outbox: Optional[StageQueue],
+        stop_event: threading.Event,
+        wait: Optional[Callable[[], Any]] = None,
+    ) -> None:
+        super().__init__(name=f"Stage-{name}", daemon=True)
+        self.stage_name = name
+        self.work = work
+        self.wait = wait
+        self.inbox = inbox
+        self.outbox = outbox
+        self.stop_event = stop_event
+        self.stats = StageStats()
+
+    def run(self) -> None:
+        while not self.stop_event.is_set():
+            item = None
+            if self.inbox:
+                ok, item = self.inbox.get(timeout=0.5)
+                if not ok:
+                    continue
+            elif self.wait:
+                item = self.wait()
+                if item is None:
+                    continue
+            started = time.monotonic()
+            try:
+                result = self.work(item)
+            except Exception as e:
+                print(f":: [PIPELINE] {self.stage_name} failed: {e}")
+                result = None
+            self.stats.record(started, result is not None)
+            if result is not None and self.outbox:
+                self.outbox.put(result, self.stop_event)
+
+
+class Pipeline:
+    """
+    A chain of stages, each on its own thread, joined by bounded queues.
+    The occupancy of the queues and the utilization of the stages are
+    reported periodically, the busiest stage is the one limiting throughput.
+    """
+
+    # NOTE: how often the stage stats are printed, in seconds
+    report_interval: float = 30
+
+    def __init__(self, name: str = "PIPELINE") -> None:
+        self.name = name
+        # INFO: (name, work, queue feeding the stage or None for the source, wait of the source)
+        self.specs: list[
+            tuple[
+                str,
+                Callable[[Any], Any],
+                Optional[StageQueue],
+                Optional[Callable[[], Any]],
+            ]
+        ] = []
+        self.stages: list[Stage] = []
+        self.stop_event = threading.Event()
+        self.reporter: Optional[threading.Thread] = None
+
+    def add_stage(
+        self,
+        name: str,
+        work: Callable[[Any], Any],
+        queue_size: int = 1,
+        policy: DROP_POLICY = DROP_POLICY.BLOCK,
+        wait: Optional[Callable[[], Any]] = None,
+    ) -> "Pipeline":
+        """
+        Appends a stage, the queue arguments describe the queue feeding it
+        and are ignored for the first stage which is the source.
+        `wait` is only used by the source, it blocks until the next item.
+        """
+        inbox = StageQueue(queue_size, policy) if self.specs else None
+        self.specs.append((name, work, inbox, wait))
+        return self
+
+    def start(self) -> None:
+        self.stop_event = threading.Event()
+        self.stages = []
+        for index, (name, work, inbox, wait) in enumerate(self.specs):
+            outbox = self.specs[index + 1][2] if index + 1 < len(self.specs) else None
+            self.stages.append(Stage(name, work, inbox, outbox, self.stop_event, wait))
+        for stage in self.stages:
+            stage.start()
+        self.reporter = threading.Thread(
+            target=self.__report_loop, name=f"{self.name}-report", daemon=True
+        )
+        self.reporter.start()
+
+    def report(self) -> str:
+        lines = []
+        for stage in self.stages:
+            inbox = stage.inbox
+            queue = (
+                f"queue: {inbox.occupancy()}/{inbox.size} peak: {inbox.peak} dropped: {inbox.dropped}"
+                if inbox
+                else "source"
+            )
+            lines.append(
+                f"::   {stage.stage_name:<10} {stage.stats.rate():7.1f}/s busy: {stage.stats.utilization():6.1%} {queue}"
+            )
+        if self.stages:
+            bottleneck = max(self.stages, key=lambda stage: stage.stats.utilization())
+            lines.append(f"::   bottleneck: {bottleneck.stage_name}")
+        return "\n".join(lines)
+
+    def __report_loop(self) -> None:
+        while not self.stop_event.wait(self.report_interval):
+            print(f":: [{self.name}]\n{self.report()}")
+            for stage in self.stages:
+                stage.stats.reset()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        for stage in self.stages:
+            stage.join()
+        if self.reporter:
+            self.reporter.join()
+        print(f":: [{self.name}] stopped\n{self.report()}")
+
+
+class Fish:
+    """
+    One fish as it moves through the sort pipeline.
+    """
+
+    def __init__(self, frame: np.ndarray, frame_ts: float) -> None:
+        self.frame = frame
+        self.frame_ts = frame_ts
+        self.distance = 0.0
+        self.est_size = 0.0
+        self.area_px = 0.0
+        self.is_big = False
+        self.record: Optional[MeasurementRecord] = None
+
+
+class SortPipeline(Pipeline):
+    """
+    The continuous sort: acquire -> presence -> measure -> decide -> actuate -> report.
+    Only the newest frame is kept in front of the presence check so a slow
+    check skips frames instead of falling behind, and fish are never dropped
+    once they are detected.
+    """
+
+    # NOTE: samples further than this from the frame are not paired with it
+    max_skew: float = 0.5
+
+    def __init__(
+        self,
+        grabber: FrameGrabber,
+        sensor: SensorReaderThread,
+        actuator: GateActuator,
+        get_config: Callable[[str], Any],
+        on_fish: Callable[[MeasurementRecord, bool], None],
+        trigger: Optional[PresenceTrigger] = None,
+        open_ms: float = 300,
+        fish_queue: int = 8,
+    ) -> None:
+        """
+        Args:
+            grabber (FrameGrabber): The camera stream.
+            sensor (SensorReaderThread): The distance stream.
+            actuator (GateActuator): Fires GATE_TRIGGER for the big fish.
+            get_config (callable): Returns the cached config of a name or None, it must never wait.
+            on_fish (callable): Called with the record and the decision of every fish.
+            trigger (PresenceTrigger, optional): Decides when a fish entered the chute.
+            open_ms (float): How long the gate stays open for a big fish.
+            fish_queue (int): Detected fish waiting between the later stages.
+        """
+        super().__init__("SORT_PIPELINE")
+        self.grabber = grabber
+        self.sensor = sensor
+        self.actuator = actuator
+        self.get_config = get_config
+        self.on_fish = on_fish
+        self.trigger = trigger if trigger else PresenceTrigger()
+        self.open_ms = open_ms
+        self.detector = Detector()
+        self.seq = -1
+        # NOTE: fish whose frame the grabber overwrote before it was copied
+        self.torn = 0
+        # NOTE: ring views stay valid for a few frames, the presence check keeps up with that
+        self.add_stage("acquire", self.__acquire, wait=self.__next_frame)
+        self.add_stage("presence", self.__presence, 1, DROP_POLICY.LATEST_WINS)
+        self.add_stage("measure", self.__measure, fish_queue)
+        self.add_stage("decide", self.__decide, fish_queue)
+        self.add_stage("actuate", self.__actuate, fish_queue)
+        self.add_stage("report", self.__report, fish_queue)
+
+    def __next_frame(self) -> Optional[tuple[int, float, np.ndarray]]:
+        return self.grabber.latest(self.seq, timeout=0.5)
+
+    def __acquire(
+        self, latest: tuple[int, float, np.ndarray]
+    ) -> tuple[int, float, np.ndarray]:
+        self.seq, frame_ts, frame = latest
+        return self.seq, frame_ts, frame
+
+    def __presence(self, item: tuple[int, float, np.ndarray]) -> Optional[Fish]:
+        seq, frame_ts, frame = item
+        if not self.trigger.update(frame):
+            return None
+        # INFO: only the frames of detected fish are copied out of the ring
+        fish = Fish(frame.copy(), frame_ts)
+        # NOTE: the view may have waited in the queue, the copy only matches
+        # frame_ts if the grabber did not reuse the slot meanwhile
+        if not self.grabber.is_intact(seq):
+            self.torn += 1
+            print(
+                f":: [SORT_PIPELINE] frame overwritten before it was copied, {self.torn} so far"
+            )
+            return None
+        return fish
+
+    def __pair(self, frame_ts: float) -> float:
+        closest = self.sensor.filtered_at(frame_ts, self.max_skew)
+        if closest is not None:
+            return float(closest[1])
+        fallback = self.sensor.get_latest_reading()
+        return float(fallback) if fallback is not None else 0.0
+
+    def __measure(self, fish: Fish) -> Optional[Fish]:
+        fish.distance = self.__pair(fish.frame_ts)
+        if not fish.distance:
+            print(":: [SORT_PIPELINE] no distance for the fish, skipping it")
+            return None
+        calibration_factor = self.get_config("calibration_factor")
+        if calibration_factor is None:
+            print(
+                ":: [SORT_PIPELINE] no calibration factor cached yet, skipping the fish"
+            )
+            return None
+        self.detector.CF = calibration_factor
+        fish.est_size, fish.area_px = self.detector.detect_frame(
+            fish.frame, fish.distance
+        )
+        return fish
+
+    def __decide(self, fish: Fish) -> Fish:
+        min_fish_size = self.get_config("min_fish_size")
+        # NOTE: without a cached minimum size the gate stays closed
+        fish.is_big = min_fish_size is not None and fish.est_size >= min_fish_size
+        confidence, _ = self.sensor.get_confidence()
+        fish.record = MeasurementRecord(
+            fish.est_size,
+            distance=fish.distance,
+            confidence=confidence,
+            area_px=int(fish.area_px),
+        )
+        return fish
+
+    def __actuate(self, fish: Fish) -> Fish:
+        if fish.is_big:
+            self.actuator.pulse(GPIO_MAPPING.GATE_TRIGGER, self.open_ms)
+        return fish
+
+    def __report(self, fish: Fish) -> None:
+        self.on_fish(fish.record, fish.is_big)  # pyright: ignore
+        return None
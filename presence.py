@@ -0,0 +1,200 @@
+import threading
+import time
+from typing import Callable, Optional
+
+import cv2
+import numpy as np
+
+from frame_grabber import FrameGrabber
+
+
+class TriggerStats:
+    """
+    Running frame rate and per frame cost of the presence trigger.
+    CPU time is the thread's own time so other threads do not inflate it.
+    """
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.frames = 0
+        self.started = time.monotonic()
+        self.cpu_total = 0.0
+        self.wall_total = 0.0
+
+    def record(self, wall: float, cpu: float) -> None:
+        self.frames += 1
+        self.wall_total += wall
+        self.cpu_total += cpu
+
+    def fps(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.frames / elapsed if elapsed > 0 else 0.0
+
+    def cpu_ms(self) -> float:
+        return self.cpu_total / self.frames * 1000 if self.frames else 0.0
+
+    def wall_ms(self) -> float:
+        return self.wall_total / self.frames * 1000 if self.frames else 0.0
+
+    def __str__(self) -> str:
+        return f"fps: {self.fps():.1f} cpu/frame: {self.cpu_ms():.2f} ms wall/frame: {self.wall_ms():.2f} ms"
+
+
+class PresenceTrigger:
+    """
+    Decides if something is in the chute using background subtraction on a
+    downscaled, optionally cropped, grayscale copy of the frame.
+    Only the small frame is processed, the full resolution frame is untouched.
+    """
+
+    def __init__(
+        self,
+        scale_width: int = 160,
+        roi: Optional[tuple[int, int, int, int]] = None,
+        learning_rate: float = 0.05,
+        diff_threshold: int = 25,
+        min_fraction: float = 0.05,
+        enter_frames: int = 2,
+        exit_frames: int = 5,
+    ) -> None:
+        """
+        Args:
+            scale_width (int): Width the frame (or ROI) is downscaled to.
+            roi (tuple, optional): (x, y, w, h) region of the chute in the full frame.
+            learning_rate (float): How fast the background follows an empty chute.
+            diff_threshold (int): Gray level change that counts as a changed pixel.
+            min_fraction (float): Fraction of changed pixels that counts as presence.
+            enter_frames (int): Consecutive frames above the fraction to trigger.
+            exit_frames (int): Consecutive frames below the fraction to clear.
+        """
+        self.scale_width = scale_width
+        self.roi = roi
+        self.learning_rate = learning_rate
+        self.diff_threshold = diff_threshold
+        self.min_fraction = min_fraction
+        self.enter_frames = enter_frames
+        self.exit_frames = exit_frames
+        self.present = False
+        self.streak = 0
+        self.fraction = 0.0
+        self.stats = TriggerStats()
+        # NOTE: allocated on the first frame once the size is known
+        self.size: Optional[tuple[int, int]] = None
+        self.background: Optional[np.ndarray] = None
+
+    def __allocate(self, frame: np.ndarray) -> None:
+        height, width = frame.shape[:2]
+        scaled_height = max(1, round(height * self.scale_width / width))
+        self.size = (self.scale_width, scaled_height)
+        self.small = np.empty((scaled_height, self.scale_width, 3), np.uint8)
+        self.gray = np.empty((scaled_height, self.scale_width), np.uint8)
+        self.background_u8 = np.empty_like(self.gray)
+        self.diff = np.empty_like(self.gray)
+        self.mask = np.empty_like(self.gray)
+        self.background = None
+
+    def __preprocess(self, frame: np.ndarray) -> np.ndarray:
+        if self.roi:
+            x, y, w, h = self.roi
+            frame = frame[y : y + h, x : x + w]
+        if self.size is None:
+            self.__allocate(frame)
+        size: tuple[int, int] = self.size  # pyright: ignore
+        if frame.ndim == 2:
+            cv2.resize(frame, size, dst=self.gray, interpolation=cv2.INTER_AREA)
+            return self.gray
+        cv2.resize(frame, size, dst=self.small, interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(self.small, cv2.COLOR_BGR2GRAY, dst=self.gray)
+        return self.gray
+
+    def update(self, frame: np.ndarray) -> bool:
+        """
+        Feeds one frame and returns True only on the frame something entered the chute.
+        """
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        gray = self.__preprocess(frame)
+        triggered = False
+        if self.background is None:
+            self.background = gray.astype(np.float32)
+        else:
+            cv2.convertScaleAbs(self.background, dst=self.background_u8)
+            cv2.absdiff(gray, self.background_u8, dst=self.diff)
+            cv2.threshold(
+                self.diff, self.diff_threshold, 255, cv2.THRESH_BINARY, dst=self.mask
+            )
+            self.fraction = cv2.countNonZero(self.mask) / self.mask.size
+            triggered = self.__debounce(self.fraction >= self.min_fraction)
+            # NOTE: only learn an empty chute so a slow fish is not absorbed
+            if not self.present:
+                cv2.accumulateWeighted(gray, self.background, self.learning_rate)
+        self.stats.record(
+            time.perf_counter() - wall_start, time.thread_time() - cpu_start
+        )
+        return triggered
+
+    def __debounce(self, active: bool) -> bool:
+        if active == self.present:
+            self.streak = 0
+            return False
+        self.streak += 1
+        if active and self.streak >= self.enter_frames:
+            self.present = True
+            self.streak = 0
+            return True
+        if not active and self.streak >= self.exit_frames:
+            self.present = False
+            self.streak = 0
+        return False
+
+    def reset(self) -> None:
+        self.background = None
+        self.present = False
+        self.streak = 0
+
+
+class PresenceMonitor(threading.Thread):
+    """
+    Runs the presence trigger on every frame of a grabber and hands the
+    full resolution frame to `on_presence` only when something entered the chute.
+    """
+
+    # NOTE: how often the trigger stats are printed, in seconds
+    report_interval: float = 10.0
+
+    def __init__(
+        self,
+        grabber: FrameGrabber,
+        on_presence: Callable[[np.ndarray, float], None],
+        trigger: Optional[PresenceTrigger] = None,
+    ) -> None:
+        super().__init__(name="PresenceMonitor", daemon=True)
+        self.grabber = grabber
+        self.on_presence = on_presence
+        self.trigger = trigger if trigger else PresenceTrigger()
+        self.stop_event = threading.Event()
+
+    def run(self) -> None:
+        seq = -1
+        last_report = time.monotonic()
+        while not self.stop_event.is_set():
+            latest = self.grabber.latest(seq)
+            if latest is None:
+                continue
+            seq, timestamp, frame = latest
+            if self.trigger.update(frame):
+                print(
+                    f":: [PRESENCE] something entered the chute ({self.trigger.fraction:.0%} changed)"
+                )
+                # NOTE: copy, the ring slot is reused while the detector runs
+                self.on_presence(frame.copy(), timestamp)
+            if time.monotonic() - last_report >= self.report_interval:
+                print(f":: [PRESENCE] {self.trigger.stats}")
+                self.trigger.stats.reset()
+                last_report = time.monotonic()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.join()
@@ -2,16 +2,18 @@ import random
 import subprocess
 import time
 from datetime import timedelta
-from os import path, remove
-from typing import Union
+from enum import Enum
+from os import remove
+from typing import Any, Optional, Union
 
-import requests
-import serial
+from camera_discovery import CameraDiscovery, VideoMode
+from threaded_reader import SensorReaderThread
 
 
 class Reader:
 
-    reading: Union[int, float, bytearray]
+    # NOTE: Any because the camera can also hand out raw ndarray frames
+    reading: Union[int, float, bytearray, Any]
 
     def __init__(self, port: str | None = None, baud_rate: int = 0) -> None:
         self.port = port
@@ -26,31 +28,27 @@ class Reader:
 
 class UltrasonicSensor(Reader):
 
-    def __validate(self, distance: int) -> bool:
-        """
-        Checks if the distance is valid based on observed readings
-        """
-        if distance >= 500:
-            # INFO: this is a null or unreadable data
-            # or something is blocking the sensor
-            return False
-        # if distance in range(200,300):
-        #     # INFO: uneven surface detected
-        #     # and it's scattered
-        #     return False
-        # if distance in range(100,199):
-        #     # INFO: uneven surface detected
-        #     # and it's near with each other
-        #     return False
-        return True
+    # NOTE: how long a read may wait for the reading to settle
+    timeout: float = 2.0
+    # NOTE: the reading is settled once its standard deviation is within this
+    settle_tolerance: float = 2.0
 
     def read(self) -> None:
         print(":: [READER] Starting Ultrasonic Distance Sensor Reader")
-        # TODO: properly handle error
-        try:
-            ser = serial.Serial(self.port, self.baud_rate)
-        except:
-            print(":: [DEBUG_MODE] failed to connect to serial")
+        # NOTE: the background reader keeps the port open between reads
+        # so this only waits on the serial line right after startup
+        sensor = SensorReaderThread.shared(self.port, self.baud_rate)  # pyright: ignore
+        distance = sensor.get_latest_reading()
+        if sensor.connected and not sensor.is_settled(self.settle_tolerance):
+            # NOTE: stop sampling as soon as the reading settled
+            start = time.time()
+            distance = sensor.wait_until_settled(
+                self.settle_tolerance, timeout=self.timeout
+            )
+            print(f":: Got data after {timedelta(seconds=time.time() - start)}")
+
+        if distance is None:
+            print(":: [DEBUG_MODE] failed to read from serial")
             print(":: [DEBUG_MODE] dummy data ahead")
             data_list = []
             for _ in range(10):
@@ -58,45 +56,62 @@ class UltrasonicSensor(Reader):
             self.reading = sum(data_list) / len(data_list)
             return
 
-        print(":: [READER] Connected to serial port:", self.port)
-        start = time.time()
-        data_list = []
-
-        while True:
-            if len(data_list) == 20:
-                print(":: Process Completed")
-                print(data_list)
-                print(":: Average Distance:", sum(data_list) / len(data_list))
-                break
+        confidence, variance = sensor.get_confidence()
+        print(
+            f":: Filtered Distance: {distance} confidence: {confidence:.2f} variance: {variance:.2f}"
+        )
+        self.reading = distance
 
-            if ser.in_waiting <= 0:
-                continue
 
-            if len(data_list) <= 0:
-                end = time.time()
-                print(f":: Got data after {timedelta(seconds=int(end)-(start))}")
+class CAPTURE_MODE(Enum):
+    # INFO: keep the device open and hand out raw BGR frames
+    STREAM = "stream"
+    # INFO: fork fswebcam per shot and hand out PNG bytes
+    FSWEBCAM = "fswebcam"
 
-            # TODO: parse the data
-            data = ser.read(ser.in_waiting)
-            print(f":: [DEBUG] {data}")
-            distance = int(data.split(b":")[1].split(b"\r")[0].decode())
 
-            # WARN: this blindly accepts the reading,
-            # WARN: additional calibration must be added to normalize the readings
-            if self.__validate(distance):
-                data_list.append(distance)
-
-        ser.close()
-        self.reading = sum(data_list) / len(data_list)
+# INFO: fswebcam's palette names of the v4l2 pixel formats
+FSWEBCAM_PALETTES = {"MJPG": "MJPEG", "YUYV": "YUYV"}
 
 
 class Camera(Reader):
     device_idx: int = 0
+    # NOTE: the pixel format and frame rate picked by discovery, None means the driver's default
+    video_mode: Optional[VideoMode] = None
+    # NOTE: set once the camera took a device from discovery, until then device_idx is the default
+    discovered: bool = False
+    mode: CAPTURE_MODE = CAPTURE_MODE.STREAM
+    # NOTE: monotonic time of the current reading, used for latency reports
+    captured_at: float = 0.0
 
-    def __init__(self) -> None:
-        # TODO: load the cached device index
-        if path.exists("device_idx.txt"):
-            self.device_idx = int(open("device_idx.txt").read())
+    def __init__(self, mode: CAPTURE_MODE = CAPTURE_MODE.STREAM) -> None:
+        self.mode = mode
+        self.discovery = CameraDiscovery.shared()
+        # INFO: the device is probed once and cached, later cameras reuse it
+        self.discovery.discover()
+        self.__use_discovered()
+
+    def __use_discovered(self) -> None:
+        """
+        Switches to the device discovery currently knows, a background re-probe may have changed it.
+        """
+        device = self.discovery.device
+        if device is None:
+            return
+        if device.index != self.device_idx:
+            print(f":: [CAMERA] using {device}")
+            if self.discovered:
+                # NOTE: the camera moved, close the stream of the old index
+                from frame_grabber import FrameGrabber
+
+                FrameGrabber.release(self.device_idx)
+        self.discovered = True
+        self.device_idx = device.index
+        self.video_mode = device.mode
+
+    def __capture_failed(self) -> None:
+        # NOTE: the next capture keeps the current device, a re-probe replaces it if it is gone
+        self.discovery.report_failure()
 
     def capture_image(self, resolution: str = "1280x720"):
         """
@@ -109,6 +124,7 @@ class Camera(Reader):
             bytearray: The captured image data as a bytearray or None if an error occurs.
         """
 
+        self.__use_discovered()
         device = f"/dev/video{self.device_idx}"
         command = [
             "fswebcam",
@@ -116,37 +132,22 @@ class Camera(Reader):
             "--no-banner",
             "-r",
             resolution,
-            "--png",
-            "1",
-            "-d",
-            device,
-            "imgs/temp.png",
         ]
+        palette = FSWEBCAM_PALETTES.get(
+            self.video_mode.pixel_format if self.video_mode else ""
+        )
+        if palette:
+            command += ["-p", palette]
+        command += ["--png", "1", "-d", device, "imgs/temp.png"]
 
-        # NOTE: i don't understand a single thing below xD
         with subprocess.Popen(
             command, stdout=subprocess.PIPE, stderr=subprocess.PIPE
         ) as process:
             errors = process.stderr.read().decode("utf-8")  # pyright: ignore
             if not "Writing PNG" in errors:
-                if "Inappropriate ioctl for device" in errors:
-                    print(
-                        f":: [CAMERA_ERROR] {device} is not a valid device, trying another device..."
-                    )
-                    if self.device_idx == 3:
-                        print(":: [ERROR] No valid device found")
-                        return None
-                    self.device_idx += 1
-                    # NOTE: recursively call the function to try the next device
-                    return self.capture_image(resolution)
-                print(f":: [ERROR] fswebcam failed: {errors}")
+                print(f":: [ERROR] fswebcam failed on {device}: {errors}")
+                self.__capture_failed()
                 return None
-            # TODO: cache the working device_idx
-            if self.device_idx != 0 and not path.exists("device_idx.txt"):
-                print(
-                    f":: [CAMERA] Device {device} is working, caching the device index"
-                )
-                open("device_idx.txt", "w").write(str(self.device_idx))
 
             # INFO: read the image
             data = open("imgs/temp.png", "rb").read()
@@ -164,12 +165,93 @@ class Camera(Reader):
     def __random_image(self) -> bytearray:
         url = random.choice(self.urls)
         print(f":: [CAMERA] returning random image from {url}")
+        # NOTE: imported here, requests is slow to import and only used for dummy images
+        import requests
+
         data = requests.get(url).content
         return bytearray(data)
 
-    def read(self) -> None:
+    def __grabber(self, resolution: str):
+        # NOTE: import localy so fswebcam mode works without the stream deps
+        from frame_grabber import FrameGrabber
+
+        self.__use_discovered()
+        mode = self.video_mode
+        # NOTE: the discovered format only applies at the resolution it was picked for
+        if mode is not None and mode.resolution() == resolution:
+            grabber = FrameGrabber.shared(
+                self.device_idx, resolution, mode.pixel_format, mode.fps
+            )
+        else:
+            grabber = FrameGrabber.shared(self.device_idx, resolution)
+        if grabber is None:
+            self.__capture_failed()
+        return grabber
+
+    def capture_frame(self, resolution: str = "1280x720"):
+        """
+        Grabs the newest raw BGR frame from the long-lived stream.
+
+        Args:
+            resolution (str, optional): Resolution of the stream (default: "1280x720").
+
+        Returns:
+            np.ndarray: A view into the grabber's ring buffer or None if the stream is unavailable.
+        """
+        grabber = self.__grabber(resolution)
+        if grabber is None:
+            return None
+        latest = grabber.latest()
+        if latest is None:
+            print(":: [CAMERA_ERROR] stream did not produce a frame")
+            self.__capture_failed()
+            return None
+        _, self.captured_at, frame = latest
+        return frame
+
+    def capture_frames(self, count: int, resolution: str = "1280x720") -> list:
+        """
+        Grabs `count` consecutive raw BGR frames from the long-lived stream.
+
+        Args:
+            count (int): Number of frames to grab.
+            resolution (str, optional): Resolution of the stream (default: "1280x720").
+
+        Returns:
+            list: (timestamp, frame) copies oldest first, empty if the stream is unavailable.
+        """
+        grabber = self.__grabber(resolution)
+        if grabber is None:
+            return []
+        frames = []
+        seq = -1
+        while len(frames) < count:
+            latest = grabber.latest(seq)
+            if latest is None:
+                print(":: [CAMERA_ERROR] stream did not produce a frame")
+                self.__capture_failed()
+                break
+            seq, timestamp, frame = latest
+            # NOTE: copy, the ring slot is reused before the batch is complete
+            frames.append((timestamp, frame.copy()))
+        if frames:
+            self.captured_at = frames[-1][0]
+        return frames
+
+    def read(self, stream: bool = True) -> None:
+        """
+        Args:
+            stream (bool): Tries the stream first in STREAM mode, False goes straight to fswebcam.
+        """
         print(":: [READER] Starting Camera Reader")
+        if stream and self.mode == CAPTURE_MODE.STREAM:
+            frame = self.capture_frame()
+            if frame is not None:
+                self.reading = frame
+                return
+            print(":: [CAMERA] stream unavailable, falling back to fswebcam")
         img_buf = self.capture_image()
+        self.captured_at = time.monotonic()
         if not img_buf:
             print(":: [DEBUG_MODE] failed to connect to camera")
             print(":: [DEBUG_MODE] dummy data ahead")
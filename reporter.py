@@ -1,61 +1,352 @@
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from typing import Optional
+
 import paho.mqtt.client as mqtt
 
+from codec import (
+    PAYLOAD_FORMAT,
+    RECORD,
+    CodecError,
+    MeasurementRecord,
+    decode_record,
+    decode_text,
+    encode,
+    encode_record,
+)
+from mqtt_bus import MQTTBus
+
+# INFO: every spooled record is framed with its length and crc32, so a record
+# torn by a power cut is skipped on replay instead of misaligning the rest
+SPOOL_FRAME = struct.Struct("<HI")
+
+
+class ReporterStats:
+    """
+    Counters of the report pipeline, used to see if the broker keeps up.
+    """
+
+    def __init__(self) -> None:
+        self.enqueued = 0
+        self.published = 0
+        self.batches = 0
+        # NOTE: reports written to the spool because the broker was unreachable
+        self.spooled = 0
+        # NOTE: reports written to the spool because the queue was full
+        self.spilled = 0
+        self.replayed = 0
+        # NOTE: reports lost because the overflow was full or the spool could not be written
+        self.dropped = 0
+        self.max_depth = 0
+
+    def __str__(self) -> str:
+        return (
+            f"enqueued: {self.enqueued} published: {self.published} in {self.batches} batches "
+            f"spooled: {self.spooled} spilled: {self.spilled} replayed: {self.replayed} "
+            f"dropped: {self.dropped} max queue depth: {self.max_depth}"
+        )
+
 
 class Reporter:
     """
     Class to handle the reporting of the fisherynet system
     This will publish the reports to the FISHERYNET|REPORTS topic
     The report will be in format `est_size=x.y`
+
+    Reports are queued without blocking and published by a worker thread.
+    In the binary format several reports are sent as one batch from `codec`,
+    the text format keeps one `est_size=x.y` per message for the dashboard.
+    Reports that can not be published are appended to a spool file of
+    binary records that is replayed once the broker is reachable again.
     """
 
-    broker = "mqtt.eclipseprojects.io"
-    port = 1883
-    keepalive = 60
+    TOPIC = "FISHERYNET|REPORTS"
+    qos = 2
+    # NOTE: a batch is sent once it is this old or this big, whichever comes first,
+    # only binary reports are batched
+    flush_interval: float = 1.0
+    batch_size: int = 32
+    queue_size: int = 256
+    # NOTE: reports held for the worker to spool while the queue is full, more are dropped
+    overflow_size: int = 1024
+    spool_path = "report_spool.bin"
+    # NOTE: the dashboard only reads text, binary is for the cellular uplink
+    payload_format = PAYLOAD_FORMAT.TEXT
+    # NOTE: how often the stats are printed, in seconds
+    report_interval: float = 300
 
-    _client = None  # Use a private static variable for the client
+    __instance: Optional["Reporter"] = None
+    __instance_lock = threading.Lock()
 
-    def __init__(self) -> None:
-        pass  # No need for object-specific initialization in a static implementation
+    def __init__(self, bus: Optional[MQTTBus] = None) -> None:
+        self.bus = bus if bus else MQTTBus.shared()
+        self.queue: queue.Queue[MeasurementRecord] = queue.Queue(
+            maxsize=self.queue_size
+        )
+        self.overflow: deque[MeasurementRecord] = deque()
+        self.overflow_lock = threading.Lock()
+        self.stats = ReporterStats()
+        self.spool_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.worker = threading.Thread(target=self.__run, name="Reporter", daemon=True)
+        self.worker.start()
+
+    @classmethod
+    def shared(cls) -> "Reporter":
+        """
+        Returns the reporter of this process, starting it on first use.
+        """
+        with cls.__instance_lock:
+            if cls.__instance is None:
+                cls.__instance = cls()
+            return cls.__instance
 
     @staticmethod
-    def connect():
+    def connect() -> MQTTBus:
         """
-        Connects the Reporter to the MQTT broker.
+        Returns the shared MQTT connection, starting it if needed.
 
-        This method is called to establish the connection before sending reports.
+        This method is called to make sure the connection is up before sending reports.
         """
 
-        if Reporter._client is None:
-            Reporter._client = mqtt.Client(
-                mqtt.CallbackAPIVersion.VERSION2  # pyright: ignore
-            )
-            Reporter._client.on_connect = Reporter.__on_connect
-            Reporter._client.on_message = Reporter.__on_message
-            Reporter._client.connect(Reporter.broker, Reporter.port, Reporter.keepalive)
+        bus = MQTTBus.shared()
+        bus.start()
+        return bus
 
     @staticmethod
-    def __on_message(client, userdata, msg):
-        print(f":: [REPORTER] {msg.topic} {msg.payload}")
+    def send_report(report: str) -> None:
+        """
+        Queues a report for the FISHERYNET|REPORTS topic without waiting for the broker.
 
-    @staticmethod
-    def __on_connect(client, userdata, flags, reason_code, properties):
-        print(f":: [REPORTER] Connected with result code {reason_code}")
+        Validates the report format (est_size=x.y) before queueing.
+        """
+
+        try:
+            records = decode_text(report)
+        except CodecError as e:
+            print(f":: [REPORTER] Invalid report format: {e}")
+            return
+
+        for record in records:
+            Reporter.send_record(record)
 
     @staticmethod
-    def send_report(report: str) -> None:
+    def send_record(record: MeasurementRecord) -> None:
         """
-        Sends a report to the FISHERYNET|REPORTS topic.
-
-        Validates the report format (est_size=x.y) before publishing.
+        Queues a full measurement record without waiting for the broker.
         """
 
         Reporter.connect()  # Ensure connection before publishing
+        Reporter.shared().submit(record)
+
+    @classmethod
+    def close(cls) -> None:
+        """
+        Sends or spools the queued reports and stops the worker, if it was started.
+        """
+        with cls.__instance_lock:
+            reporter = cls.__instance
+            cls.__instance = None
+        if reporter:
+            reporter.stop()
 
-        key, value = report.split("=")
-        if key != "est_size":
-            print(":: [REPORTER] Invalid report format")
+    def submit(self, report: MeasurementRecord) -> None:
+        self.stats.enqueued += 1
+        try:
+            self.queue.put_nowait(report)
+        except queue.Full:
+            # NOTE: the broker is not keeping up, the worker writes the report to
+            # the spool so the caller never waits on the disk either
+            with self.overflow_lock:
+                if len(self.overflow) >= self.overflow_size:
+                    self.stats.dropped += 1
+                    return
+                self.overflow.append(report)
             return
+        self.stats.max_depth = max(self.stats.max_depth, self.queue.qsize())
+
+    def __spill(self) -> None:
+        """
+        Spools the reports that did not fit in the queue.
+        """
+        with self.overflow_lock:
+            reports = list(self.overflow)
+            self.overflow.clear()
+        if reports:
+            self.stats.spilled += self.__spool(reports)
+
+    def __batch_limit(self) -> int:
+        # NOTE: the dashboard reads a single report per message
+        if self.payload_format == PAYLOAD_FORMAT.TEXT:
+            return 1
+        return self.batch_size
+
+    def __collect(self) -> list[MeasurementRecord]:
+        """
+        Waits for the first report, then gathers more until the batch is full or old enough.
+        """
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.__batch_limit():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def __encodable(self, batch: list[MeasurementRecord]) -> list[MeasurementRecord]:
+        """
+        Returns the records that can be encoded, the others are logged and dropped.
+        """
+        records = []
+        for record in batch:
+            try:
+                encode_record(record)
+            except CodecError as e:
+                print(f":: [REPORTER] dropping a report that can not be encoded: {e}")
+                self.stats.dropped += 1
+                continue
+            records.append(record)
+        return records
+
+    def __publish(self, batch: list[MeasurementRecord]) -> bool:
+        if not self.bus.connected.is_set():
+            return False
+        try:
+            payload = encode(batch, self.payload_format)
+        except CodecError:
+            # NOTE: one bad record must not take the worker down or the batch with it
+            batch = self.__encodable(batch)
+            if not batch:
+                return True
+            payload = encode(batch, self.payload_format)
+        info = self.bus.publish(self.TOPIC, payload, self.qos)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            return False
+        self.stats.published += len(batch)
+        self.stats.batches += 1
+        return True
+
+    @staticmethod
+    def __frame(reports: list[MeasurementRecord]) -> bytes:
+        frames = []
+        for report in reports:
+            record = encode_record(report)
+            frames.append(SPOOL_FRAME.pack(len(record), zlib.crc32(record)) + record)
+        return b"".join(frames)
+
+    @staticmethod
+    def __unframe(data: bytes) -> tuple[list[MeasurementRecord], int]:
+        """
+        Returns the intact reports of the spool and how many bytes were skipped.
+        After a bad frame the next intact one is searched for byte by byte.
+        """
+        reports = []
+        skipped = 0
+        offset = 0
+        frame_size = SPOOL_FRAME.size + RECORD.size
+        while offset + frame_size <= len(data):
+            length, crc = SPOOL_FRAME.unpack_from(data, offset)
+            start = offset + SPOOL_FRAME.size
+            record = data[start : start + RECORD.size]
+            if length != RECORD.size or zlib.crc32(record) != crc:
+                offset += 1
+                skipped += 1
+                continue
+            reports.append(decode_record(record))
+            offset += frame_size
+        # NOTE: a trailing partial frame is the write a power cut tore
+        return reports, skipped + len(data) - offset
+
+    def __spool(self, reports: list[MeasurementRecord]) -> int:
+        """
+        Appends the reports to the spool, returns how many were written.
+        """
+        reports = self.__encodable(reports)
+        if not reports:
+            return 0
+        try:
+            with self.spool_lock, open(self.spool_path, "ab") as f:
+                f.write(self.__frame(reports))
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError as e:
+            print(f":: [REPORTER] failed to spool {len(reports)} reports: {e}")
+            self.stats.dropped += len(reports)
+            return 0
+        return len(reports)
+
+    def __replay(self) -> None:
+        """
+        Publishes the spooled reports, whatever is not sent stays in the spool.
+        """
+        with self.spool_lock:
+            try:
+                with open(self.spool_path, "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                return
+            reports, skipped = self.__unframe(data)
+            if skipped:
+                print(f":: [REPORTER] skipped {skipped} torn bytes of the spool")
+            sent = 0
+            while sent < len(reports):
+                batch = reports[sent : sent + self.__batch_limit()]
+                if not self.__publish(batch):
+                    break
+                sent += len(batch)
+            self.stats.replayed += sent
+            if sent == len(reports):
+                os.remove(self.spool_path)
+                print(f":: [REPORTER] replayed {sent} spooled reports")
+                return
+            # NOTE: replace atomically so a power cut never loses the rest of the spool
+            tmp_path = f"{self.spool_path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(self.__frame(reports[sent:]))
+            os.replace(tmp_path, self.spool_path)
+
+    def __flush(self, batch: list[MeasurementRecord]) -> None:
+        if not self.__publish(batch):
+            self.stats.spooled += self.__spool(batch)
+
+    def __run(self) -> None:
+        last_report = time.monotonic()
+        while not self.stop_event.is_set():
+            batch = self.__collect()
+            if batch:
+                self.__flush(batch)
+            self.__spill()
+            if self.bus.connected.is_set() and os.path.exists(self.spool_path):
+                try:
+                    self.__replay()
+                except OSError as e:
+                    print(f":: [REPORTER] failed to replay the spool: {e}")
+            if time.monotonic() - last_report >= self.report_interval:
+                print(f":: [REPORTER] {self.stats}")
+                last_report = time.monotonic()
 
-        Reporter._client.loop_start()  # Start the client loop for publishing # pyright: ignore
-        Reporter._client.publish("FISHERYNET|REPORTS", report, 2)  # pyright: ignore
-        Reporter._client.loop_stop()  # Stop the client loop after publishingoop_stop() # pyright: ignore
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.worker.join()
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self.__flush(batch)
+        self.__spill()
+        print(f":: [REPORTER] {self.stats}")
@@ -0,0 +1,60 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional
+
+
+class StartupTimer:
+    """
+    Records how long each startup step took and when it started,
+    steps running in parallel threads are recorded side by side.
+    """
+
+    def __init__(self, origin: Optional[float] = None) -> None:
+        """
+        Args:
+            origin (float, optional): perf_counter time the startup began, defaults to now.
+        """
+        self.origin = origin if origin is not None else time.perf_counter()
+        # INFO: (name, start offset, duration, thread name) in seconds
+        self.steps: list[tuple[str, float, float, str]] = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def step(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            ended = time.perf_counter()
+            with self.lock:
+                self.steps.append(
+                    (
+                        name,
+                        started - self.origin,
+                        ended - started,
+                        threading.current_thread().name,
+                    )
+                )
+
+    def timed(self, name: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Calls `fn` as a recorded step and returns what it returned.
+        """
+        with self.step(name):
+            return fn(*args, **kwargs)
+
+    def report(self) -> str:
+        total = time.perf_counter() - self.origin
+        with self.lock:
+            steps = sorted(self.steps, key=lambda step: step[1])
+        lines = [f":: [STARTUP] ready after {total * 1000:.0f} ms"]
+        for name, start, duration, thread in steps:
+            lines.append(
+                f"::   {name:<16} start: {start * 1000:7.0f} ms took: {duration * 1000:7.0f} ms ({thread})"
+            )
+        serial = sum(duration for _, _, duration, _ in steps)
+        lines.append(
+            f"::   steps took {serial * 1000:.0f} ms in total, {max(serial - total, 0) * 1000:.0f} ms saved by running them in parallel"
+        )
+        return "\n".join(lines)
@@ -1,49 +1,246 @@
-import queue  # Use queue for thread-safe communication
 import threading
+import time
+from collections import deque
+from typing import Optional
 
 import serial
 
+from distance_filter import DistanceFilter, default_filter
+
+# INFO: readings at or above this are null or unreadable data
+# or something is blocking the sensor
+MAX_VALID_DISTANCE = 500
+
+
+class DistanceFrameParser:
+    """
+    Incremental parser for the `Distance:NNN\\r\\n` frames sent by the sensor.
+    A single serial read can hold several frames or only part of one,
+    so bytes are buffered until a full line is available.
+    """
+
+    PREFIX = b"Distance:"
+    # NOTE: a frame is ~16 bytes, anything longer without a newline is garbage
+    MAX_PENDING = 256
+
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+
+    def feed(self, data: bytes) -> list[int]:
+        """
+        Appends the data to the buffer and returns the distances of every
+        complete frame, the trailing partial frame is kept for the next call.
+        """
+        self.buffer += data
+        distances = []
+        start = 0
+        while True:
+            end = self.buffer.find(b"\n", start)
+            if end < 0:
+                break
+            line = bytes(self.buffer[start:end]).strip()
+            start = end + 1
+            idx = line.rfind(self.PREFIX)
+            if idx < 0:
+                continue
+            try:
+                distances.append(int(line[idx + len(self.PREFIX) :]))
+            except ValueError:
+                print(f":: [PARSER] dropping malformed frame {line}")
+        del self.buffer[:start]
+        if len(self.buffer) > self.MAX_PENDING:
+            del self.buffer[: -len(self.PREFIX)]
+        return distances
+
 
 class SensorReaderThread(threading.Thread):
     """
     Thread class to continuously read sensor data from a serial port.
+    The port is kept open and the readings are kept in a bounded history,
+    so callers can get the current distance without waiting on the serial line.
     """
 
-    def __init__(self, port, baudrate, timeout=1):
-        super().__init__()
+    # NOTE: one reader per port, two readers would steal bytes from each other
+    __instances: dict[str, "SensorReaderThread"] = {}
+    __instances_lock = threading.Lock()
+
+    def __init__(
+        self,
+        port,
+        baudrate,
+        timeout=0.1,
+        history: int = 512,
+        distance_filter: Optional[DistanceFilter] = None,
+    ):
+        super().__init__(name=f"SensorReaderThread-{port}", daemon=True)
         self.port = port
         self.baudrate = baudrate
         self.timeout = timeout
         self.serial = None
-        self.data_queue = queue.Queue()  # Thread-safe queue for sensor readings
+        self.parser = DistanceFrameParser()
+        # INFO: (monotonic timestamp, filtered distance) after every reading the filter accepted
+        self.samples: deque[tuple[float, float]] = deque(maxlen=history)
+        # INFO: every valid reading goes through the filter to get the current distance
+        self.filter = distance_filter if distance_filter else default_filter()
+        self.filtered: Optional[float] = None
+        self.lock = threading.Lock()
+        self.fresh = threading.Condition(self.lock)
+        self.connected = False
+        self.opened = threading.Event()  # Set after the first connection attempt
         self.stop_event = threading.Event()  # Event to signal thread termination
 
-    def run(self):
+    @classmethod
+    def shared(cls, port: str, baudrate: int) -> "SensorReaderThread":
+        """
+        Returns the running reader for the port, starting it if needed.
         """
-        Continuously reads data from the serial port and stores it in the queue.
+        with cls.__instances_lock:
+            reader = cls.__instances.get(port)
+            if reader is None or not reader.is_alive():
+                reader = cls(port, baudrate)
+                reader.start()
+                cls.__instances[port] = reader
+        reader.opened.wait(2)
+        return reader
+
+    @classmethod
+    def release(cls, port: str) -> None:
+        """
+        Stops the port's reader if one is running, so the port is closed.
         """
+        with cls.__instances_lock:
+            reader = cls.__instances.pop(port, None)
+        if reader is not None and reader.is_alive():
+            reader.stop()
+
+    def __connect(self) -> bool:
         try:
             self.serial = serial.Serial(self.port, self.baudrate, timeout=self.timeout)
-            while not self.stop_event.is_set():
-                data = (
-                    self.serial.readline().decode("utf-8").strip()
-                )  # Decode and strip
-                self.data_queue.put(data)  # Add data to the queue
         except Exception as e:
-            print(f"Error reading serial port: {e}")
-        finally:
-            if self.serial:
-                self.serial.close()
+            # NOTE: only report the first failure, we retry every few seconds
+            if not self.opened.is_set():
+                print(f":: [SENSOR_READER] failed to open {self.port}: {e}")
+            self.serial = None
+            return False
+        print(f":: [SENSOR_READER] Connected to serial port: {self.port}")
+        return True
 
-    def get_latest_reading(self):
+    def __push(self, distance: int, timestamp: float) -> None:
+        with self.lock:
+            if self.filter.update(distance) is None:
+                # NOTE: rejected as an outlier, the current distance stays
+                return
+            self.filtered = self.filter.value
+            # NOTE: the filtered value is kept, pairing a frame with a raw echo would skip the filter
+            self.samples.append((timestamp, self.filtered))  # pyright: ignore
+            self.fresh.notify_all()
+
+    def run(self):
         """
-        Retrieves the latest reading from the queue (if available).
-        Blocks until data is available or a timeout occurs.
+        Continuously reads data from the serial port and stores the parsed readings.
         """
-        try:
-            return self.data_queue.get(timeout=1)  # Block for 1 second
-        except queue.Empty:
-            return None  # Return None if no data available
+        while not self.stop_event.is_set():
+            self.connected = self.__connect()
+            self.opened.set()
+            if not self.connected:
+                # NOTE: the sensor may be plugged in later, retry without spinning
+                self.stop_event.wait(2)
+                continue
+            port: serial.Serial = self.serial  # pyright: ignore
+            try:
+                while not self.stop_event.is_set():
+                    # NOTE: blocks for at most `timeout` when nothing is waiting
+                    data = port.read(port.in_waiting or 1)
+                    if not data:
+                        continue
+                    timestamp = time.monotonic()
+                    for distance in self.parser.feed(data):
+                        if distance < MAX_VALID_DISTANCE:
+                            self.__push(distance, timestamp)
+            except Exception as e:
+                print(f":: [SENSOR_READER] Error reading serial port: {e}")
+            finally:
+                self.connected = False
+                port.close()
+
+    def get_latest_reading(self) -> Optional[float]:
+        """
+        Returns the current filtered distance without blocking,
+        None if nothing has been read yet.
+        """
+        return self.filtered
+
+    def get_latest_sample(self) -> Optional[tuple[float, float]]:
+        """
+        Returns the newest (timestamp, filtered distance) without blocking.
+        """
+        with self.lock:
+            return self.samples[-1] if self.samples else None
+
+    def window_since(self, timestamp: float) -> list[tuple[float, float]]:
+        """
+        Returns the (timestamp, filtered distance) history at or after `timestamp`
+        oldest first. Only the matching tail of the history is visited.
+        """
+        with self.lock:
+            window = []
+            for sample in reversed(self.samples):
+                if sample[0] < timestamp:
+                    break
+                window.append(sample)
+        window.reverse()
+        return window
+
+    def filtered_at(
+        self, timestamp: float, max_skew: float
+    ) -> Optional[tuple[float, float]]:
+        """
+        Returns the (timestamp, filtered distance) closest to `timestamp`,
+        None when nothing was read within `max_skew` of it.
+        """
+        closest = None
+        for sample in self.window_since(timestamp - max_skew):
+            skew = abs(sample[0] - timestamp)
+            if skew > max_skew:
+                continue
+            if closest is None or skew < abs(closest[0] - timestamp):
+                closest = sample
+        return closest
+
+    def wait_for_reading(self, timeout: float = 1.0) -> Optional[float]:
+        """
+        Blocks until at least one reading is available or a timeout occurs.
+        """
+        with self.lock:
+            self.fresh.wait_for(lambda: self.filtered is not None, timeout)
+            return self.filtered
+
+    def get_confidence(self) -> tuple[float, float]:
+        """
+        Returns the (confidence, variance) of the current filtered distance.
+        """
+        with self.lock:
+            return self.filter.confidence(), self.filter.variance()
+
+    def is_settled(self, tolerance: float, min_samples: int = 5) -> bool:
+        """
+        Checks if the filtered distance is within `tolerance` without blocking.
+        """
+        with self.lock:
+            return self.filter.is_settled(tolerance, min_samples)
+
+    def wait_until_settled(
+        self, tolerance: float, min_samples: int = 5, timeout: float = 1.0
+    ) -> Optional[float]:
+        """
+        Blocks until the filtered distance is within `tolerance` or a timeout occurs,
+        then returns the current filtered distance.
+        """
+        with self.lock:
+            self.fresh.wait_for(
+                lambda: self.filter.is_settled(tolerance, min_samples), timeout
+            )
+            return self.filtered
 
     def stop(self):
         """